@@ -0,0 +1,70 @@
+"""Add users.username_lower and the users_fts full-text index
+
+Revision ID: 5b7c2e9a41d3
+Revises: 2ed3dc8e1818
+Create Date: 2026-10-17 10:12:40.118204
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+import sqlmodel
+
+
+# revision identifiers, used by Alembic.
+revision: str = '5b7c2e9a41d3'
+down_revision: Union[str, None] = '2ed3dc8e1818'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+USERS_FTS_DDL = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS users_fts USING fts5("
+    "username, first_name, last_name, email, content='users', content_rowid='id')",
+    "CREATE TRIGGER IF NOT EXISTS users_fts_ai AFTER INSERT ON users BEGIN "
+    "INSERT INTO users_fts(rowid, username, first_name, last_name, email) "
+    "VALUES (new.id, new.username, new.first_name, new.last_name, new.email); END",
+    "CREATE TRIGGER IF NOT EXISTS users_fts_ad AFTER DELETE ON users BEGIN "
+    "INSERT INTO users_fts(users_fts, rowid, username, first_name, last_name, email) "
+    "VALUES ('delete', old.id, old.username, old.first_name, old.last_name, old.email); END",
+    "CREATE TRIGGER IF NOT EXISTS users_fts_au AFTER UPDATE ON users BEGIN "
+    "INSERT INTO users_fts(users_fts, rowid, username, first_name, last_name, email) "
+    "VALUES ('delete', old.id, old.username, old.first_name, old.last_name, old.email); "
+    "INSERT INTO users_fts(rowid, username, first_name, last_name, email) "
+    "VALUES (new.id, new.username, new.first_name, new.last_name, new.email); END",
+]
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    with op.batch_alter_table('users') as batch_op:
+        batch_op.add_column(sa.Column('username_lower', sqlmodel.sql.sqltypes.AutoString(), nullable=True))
+    # SQL lower() only folds ASCII on SQLite; new rows get Python's str.lower(), so backfill with it too
+    bind = op.get_bind()
+    users = sa.table('users', sa.column('id', sa.Integer()), sa.column('username', sa.String()), sa.column('username_lower', sa.String()))
+    rows = [{'user_id': user_id, 'username_lower': username.lower()} for user_id, username in bind.execute(sa.select(users.c.id, users.c.username))]
+    if rows:
+        bind.execute(
+            users.update().where(users.c.id == sa.bindparam('user_id')).values(username_lower=sa.bindparam('username_lower')),
+            rows,
+        )
+    with op.batch_alter_table('users') as batch_op:
+        batch_op.alter_column('username_lower', existing_type=sqlmodel.sql.sqltypes.AutoString(), nullable=False)
+        batch_op.create_index('ix_users_username_lower_username', ['username_lower', 'username'], unique=False)
+
+    if op.get_bind().dialect.name == 'sqlite':
+        for statement in USERS_FTS_DDL:
+            op.execute(statement)
+        op.execute("INSERT INTO users_fts(users_fts) VALUES ('rebuild')")
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    if op.get_bind().dialect.name == 'sqlite':
+        for trigger in ('users_fts_ai', 'users_fts_ad', 'users_fts_au'):
+            op.execute(f"DROP TRIGGER IF EXISTS {trigger}")
+        op.execute("DROP TABLE IF EXISTS users_fts")
+
+    with op.batch_alter_table('users') as batch_op:
+        batch_op.drop_index('ix_users_username_lower_username')
+        batch_op.drop_column('username_lower')
@@ -0,0 +1,56 @@
+"""Add the requisitions table and the requisition permissions
+
+Revision ID: 7e6db06c6fbf
+Revises: 8d41f0c3a7b2
+Create Date: 2026-10-17 01:49:46.004526
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+import sqlmodel
+
+
+# revision identifiers, used by Alembic.
+revision: str = '7e6db06c6fbf'
+down_revision: Union[str, None] = '8d41f0c3a7b2'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    if op.get_bind().dialect.name == "postgresql":
+        # ADD VALUE cannot run inside a transaction block on older PostgreSQL
+        with op.get_context().autocommit_block():
+            op.execute("ALTER TYPE useraction ADD VALUE IF NOT EXISTS 'CREATE_REQUISITION'")
+            op.execute("ALTER TYPE useraction ADD VALUE IF NOT EXISTS 'APPROVE_REQUISITION'")
+    op.create_table('requisitions',
+    sa.Column('title', sqlmodel.sql.sqltypes.AutoString(), nullable=False),
+    sa.Column('description', sqlmodel.sql.sqltypes.AutoString(), nullable=True),
+    sa.Column('amount_cents', sa.Integer(), nullable=False),
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('team_id', sa.Integer(), nullable=False),
+    sa.Column('requester_id', sa.Integer(), nullable=True),
+    sa.Column('status', sa.Enum('PENDING', 'APPROVED', 'REJECTED', name='requisitionstatus'), nullable=False),
+    sa.Column('decided_by', sa.Integer(), nullable=True),
+    sa.Column('decided_at', sa.DateTime(), nullable=True),
+    sa.Column('created_at', sa.DateTime(), nullable=False),
+    sa.Column('updated_at', sa.DateTime(), nullable=False),
+    sa.ForeignKeyConstraint(['decided_by'], ['users.id'], ondelete='SET NULL'),
+    sa.ForeignKeyConstraint(['requester_id'], ['users.id'], ondelete='SET NULL'),
+    sa.ForeignKeyConstraint(['team_id'], ['teams.id'], ondelete='RESTRICT'),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_requisitions_requester_id_created_at', 'requisitions', ['requester_id', 'created_at', 'id'], unique=False)
+    op.create_index('ix_requisitions_status_team_id_created_at', 'requisitions', ['status', 'team_id', 'created_at', 'id'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    # PostgreSQL cannot drop enum values, so useraction keeps the requisition permissions
+    op.drop_index('ix_requisitions_status_team_id_created_at', table_name='requisitions')
+    op.drop_index('ix_requisitions_requester_id_created_at', table_name='requisitions')
+    op.drop_table('requisitions')
+    sa.Enum(name='requisitionstatus').drop(op.get_bind(), checkfirst=True)
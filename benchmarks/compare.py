@@ -0,0 +1,79 @@
+"""Compare two benchmark result files and flag regressions.
+
+Example::
+
+    python -m benchmarks.compare results.json benchmarks/baseline.json --threshold 0.25
+"""
+import argparse
+import json
+import sys
+
+# Settings that change the numbers enough to make a comparison meaningless
+_COMPARABLE_META = ("users", "concurrency", "database_mode")
+
+def compare(current: dict, baseline: dict, threshold: float) -> list[dict]:
+    """One row per scenario present in both runs.
+
+    A scenario regresses when its throughput drops, or its p95 latency
+    grows, by more than ``threshold`` (a fraction) relative to the
+    baseline, or when it starts returning errors.
+    """
+    for key in _COMPARABLE_META:
+        if current["meta"].get(key) != baseline["meta"].get(key):
+            print(f"warning: {key} differs from the baseline "
+                  f"({current['meta'].get(key)!r} vs {baseline['meta'].get(key)!r})", file=sys.stderr)
+
+    rows = []
+    for name, now in current["scenarios"].items():
+        before = baseline["scenarios"].get(name)
+        if before is None:
+            continue
+        throughput_change = _change(now["throughput_rps"], before["throughput_rps"])
+        p95_change = _change(now["latency_ms"]["p95"], before["latency_ms"]["p95"])
+        reasons = []
+        if throughput_change < -threshold:
+            reasons.append("throughput")
+        if p95_change > threshold:
+            reasons.append("p95")
+        if now["errors"] and not before["errors"]:
+            reasons.append("errors")
+        rows.append({
+            "scenario": name,
+            "throughput_rps": now["throughput_rps"],
+            "baseline_throughput_rps": before["throughput_rps"],
+            "throughput_change": throughput_change,
+            "p95_ms": now["latency_ms"]["p95"],
+            "baseline_p95_ms": before["latency_ms"]["p95"],
+            "p95_change": p95_change,
+            "regression": ", ".join(reasons),
+        })
+    return rows
+
+def _change(now: float, before: float) -> float:
+    return (now - before) / before if before else 0.0
+
+def print_comparison(rows: list[dict]) -> None:
+    print(f"{'scenario':18} {'req/s':>10} {'baseline':>10} {'change':>8}  {'p95 ms':>8} {'baseline':>8} {'change':>8}  regression")
+    for row in rows:
+        print(f"{row['scenario']:18} {row['throughput_rps']:>10.1f} {row['baseline_throughput_rps']:>10.1f} "
+              f"{row['throughput_change']:>+8.0%}  {row['p95_ms']:>8.2f} {row['baseline_p95_ms']:>8.2f} "
+              f"{row['p95_change']:>+8.0%}  {row['regression'] or '-'}")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("current", help="Results JSON written by benchmarks.run --output")
+    parser.add_argument("baseline", help="Baseline results JSON")
+    parser.add_argument("--threshold", type=float, default=0.25, help="Allowed relative slowdown before a regression is flagged")
+    args = parser.parse_args()
+
+    with open(args.current) as f:
+        current = json.load(f)
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    rows = compare(current, baseline, args.threshold)
+    print_comparison(rows)
+    if any(row["regression"] for row in rows):
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
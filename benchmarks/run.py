@@ -0,0 +1,212 @@
+"""Drive the ASGI app in-process with concurrent clients and record latencies.
+
+Example::
+
+    python -m benchmarks.run --users 100000 --output results.json --compare benchmarks/baseline.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import sqlite3
+import sys
+import time
+from typing import Awaitable, Callable
+import httpx
+from benchmarks.compare import compare, print_comparison
+from benchmarks.seed import ADMIN_USERNAME, PASSWORD, default_database_url, seed, seeded_user_count, username
+
+# A scenario sends one request per call, or returns None once it has nothing left to do
+Scenario = Callable[[httpx.AsyncClient, "Context", int], Awaitable[httpx.Response | None]]
+
+class Context:
+    """State shared by the workers of one run."""
+
+    def __init__(self, users: int, seed_value: int):
+        self.users = users
+        self.random = random.Random(seed_value)
+        self.headers: dict[str, str] = {}
+        # Accounts made by create_user, consumed by delete_user
+        self.created: list[str] = []
+
+    def any_user(self) -> str:
+        return username(self.random.randrange(self.users))
+
+async def login(client: httpx.AsyncClient, ctx: Context, worker: int) -> httpx.Response:
+    return await client.post("/auth/token", data={"username": ctx.any_user(), "password": PASSWORD})
+
+async def read_user(client: httpx.AsyncClient, ctx: Context, worker: int) -> httpx.Response:
+    return await client.get(f"/users/{ctx.any_user()}", headers=ctx.headers)
+
+async def prefix_search(client: httpx.AsyncClient, ctx: Context, worker: int) -> httpx.Response:
+    # Drop the last two digits so each lookup matches a range of up to 100 users
+    return await client.get(f"/users/{ctx.any_user()[:-2].upper()}", headers=ctx.headers)
+
+async def fulltext_search(client: httpx.AsyncClient, ctx: Context, worker: int) -> httpx.Response:
+    return await client.get("/users/search", params={"q": f"First{ctx.random.randrange(997)}"}, headers=ctx.headers)
+
+async def list_teams(client: httpx.AsyncClient, ctx: Context, worker: int) -> httpx.Response:
+    return await client.get("/users/teams/", headers=ctx.headers)
+
+async def list_roles(client: httpx.AsyncClient, ctx: Context, worker: int) -> httpx.Response:
+    return await client.get("/users/roles/all", headers=ctx.headers)
+
+async def list_permissions(client: httpx.AsyncClient, ctx: Context, worker: int) -> httpx.Response:
+    return await client.get("/users/roles/permissions/", headers=ctx.headers)
+
+async def create_user(client: httpx.AsyncClient, ctx: Context, worker: int) -> httpx.Response:
+    name = f"bench_new_{worker}_{len(ctx.created)}_{ctx.random.randrange(10**9)}"
+    response = await client.post("/users/", headers=ctx.headers, json={
+        "username": name, "password": PASSWORD, "first_name": "New", "last_name": "User",
+        "email": f"{name}@example.com", "role_id": None,
+    })
+    if response.status_code == 200:
+        ctx.created.append(name)
+    return response
+
+async def update_user(client: httpx.AsyncClient, ctx: Context, worker: int) -> httpx.Response:
+    return await client.patch(f"/users/{ctx.any_user()}", json={"last_name": f"Last{ctx.random.randrange(1009)}"}, headers=ctx.headers)
+
+async def delete_user(client: httpx.AsyncClient, ctx: Context, worker: int) -> httpx.Response | None:
+    if not ctx.created:
+        return None
+    return await client.delete(f"/users/{ctx.created.pop()}", headers=ctx.headers)
+
+# Run in this order; delete_user removes what create_user added
+SCENARIOS: dict[str, Scenario] = {
+    "login": login,
+    "read_user": read_user,
+    "prefix_search": prefix_search,
+    "fulltext_search": fulltext_search,
+    "list_teams": list_teams,
+    "list_roles": list_roles,
+    "list_permissions": list_permissions,
+    "create_user": create_user,
+    "update_user": update_user,
+    "delete_user": delete_user,
+}
+
+def percentile(ordered: list[float], fraction: float) -> float:
+    # Nearest-rank percentile of an already sorted sample
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, max(0, round(fraction * len(ordered)) - 1))]
+
+def summarize(latencies: list[float], errors: int, elapsed: float) -> dict:
+    ordered = sorted(latencies)
+    to_ms = lambda seconds: round(seconds * 1000, 3)
+    return {
+        "requests": len(ordered),
+        "errors": errors,
+        "duration_s": round(elapsed, 3),
+        "throughput_rps": round(len(ordered) / elapsed, 2) if elapsed else 0.0,
+        "latency_ms": {
+            "p50": to_ms(percentile(ordered, 0.50)),
+            "p95": to_ms(percentile(ordered, 0.95)),
+            "p99": to_ms(percentile(ordered, 0.99)),
+            "mean": to_ms(sum(ordered) / len(ordered)) if ordered else 0.0,
+            "max": to_ms(ordered[-1]) if ordered else 0.0,
+        },
+    }
+
+async def run_scenario(client: httpx.AsyncClient, ctx: Context, scenario: Scenario,
+                       concurrency: int, duration: float, max_requests: int | None) -> dict:
+    latencies: list[float] = []
+    errors = 0
+    started = time.perf_counter()
+    deadline = started + duration
+
+    async def worker(worker_id: int):
+        nonlocal errors
+        while time.perf_counter() < deadline and (max_requests is None or len(latencies) < max_requests):
+            sent = time.perf_counter()
+            response = await scenario(client, ctx, worker_id)
+            if response is None:
+                return
+            latencies.append(time.perf_counter() - sent)
+            if response.status_code >= 400:
+                errors += 1
+
+    await asyncio.gather(*(worker(worker_id) for worker_id in range(concurrency)))
+    return summarize(latencies, errors, time.perf_counter() - started)
+
+async def run(args) -> dict:
+    # Imported here so DATABASE_URL is set before the app reads its settings
+    from src.main import app
+
+    ctx = Context(args.users, args.seed)
+    results = {}
+    async with app.router.lifespan_context(app):
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            response = await client.post("/auth/token", data={"username": ADMIN_USERNAME, "password": PASSWORD})
+            response.raise_for_status()
+            ctx.headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+            for name in args.scenarios:
+                results[name] = await run_scenario(client, ctx, SCENARIOS[name], args.concurrency, args.duration, args.max_requests)
+                summary = results[name]
+                print(f"{name:18} {summary['throughput_rps']:>10.1f} req/s  p50 {summary['latency_ms']['p50']:>8.2f} ms  "
+                      f"p95 {summary['latency_ms']['p95']:>8.2f} ms  p99 {summary['latency_ms']['p99']:>8.2f} ms  "
+                      f"errors {summary['errors']}")
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=1000, help="Seeded member accounts, e.g. 1000, 100000 or 1000000")
+    parser.add_argument("--database-url", help="Benchmark database (default: a file per size in the temp dir)")
+    parser.add_argument("--reseed", action="store_true", help="Seed again even if the database already has --users users")
+    parser.add_argument("--concurrency", type=int, default=16, help="Concurrent clients per scenario")
+    parser.add_argument("--duration", type=float, default=5.0, help="Seconds to run each scenario")
+    parser.add_argument("--max-requests", type=int, help="Stop a scenario after this many requests")
+    parser.add_argument("--scenarios", nargs="+", choices=list(SCENARIOS), default=list(SCENARIOS))
+    parser.add_argument("--seed", type=int, default=1, help="Random seed for the request mix")
+    parser.add_argument("--output", help="Write the results as JSON to this file")
+    parser.add_argument("--compare", metavar="BASELINE", help="Compare against a baseline JSON and exit 1 on regressions")
+    parser.add_argument("--threshold", type=float, default=0.25, help="Allowed relative slowdown before a regression is flagged")
+    args = parser.parse_args()
+
+    os.environ["DATABASE_URL"] = args.database_url or default_database_url(args.users)
+    # Every simulated client shares one address, so login throttling would measure the limiter, not bcrypt
+    os.environ.setdefault("LOGIN_RATE_PER_IP", "0")
+    os.environ.setdefault("LOGIN_RATE_PER_USERNAME", "0")
+    from src.models import create_db_connection
+
+    engine = create_db_connection()
+    if args.reseed or seeded_user_count(engine) != args.users:
+        print(f"Seeding {args.users} users into {os.environ['DATABASE_URL']}")
+        seed(engine, args.users)
+    engine.dispose()
+
+    results = {
+        "meta": {
+            "users": args.users,
+            "concurrency": args.concurrency,
+            "duration_s": args.duration,
+            "max_requests": args.max_requests,
+            "database_mode": os.getenv("DATABASE_MODE", "async"),
+            "python": platform.python_version(),
+            "sqlite": sqlite3.sqlite_version,
+            "platform": platform.platform(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        },
+        "scenarios": asyncio.run(run(args)),
+    }
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+            f.write("\n")
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        rows = compare(results, baseline, args.threshold)
+        print_comparison(rows)
+        if any(row["regression"] for row in rows):
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
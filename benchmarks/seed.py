@@ -0,0 +1,82 @@
+"""Seed a database with a synthetic user directory for the benchmarks."""
+import argparse
+import os
+import tempfile
+import time
+from datetime import datetime
+from sqlalchemy import func, insert, select
+from sqlmodel import Session, SQLModel
+from src.models import RolePermissions, Roles, Teams, UserAction, Users, create_db_connection
+from src.passwords import hash_password_sync
+
+ADMIN_USERNAME = "bench_admin"
+PASSWORD = "benchpass"
+TEAM_COUNT = 50
+BATCH_SIZE = 10_000
+
+def default_database_url(users: int) -> str:
+    # Kept outside the work tree so a benchmark never drops the development database
+    return f"sqlite:///{os.path.join(tempfile.gettempdir(), f'eoffice-bench-{users}.db')}"
+
+def username(index: int) -> str:
+    return f"user{index:07d}"
+
+def seeded_user_count(engine) -> int | None:
+    """Users already seeded into ``engine``'s database, or None if it is not a benchmark database."""
+    with Session(engine) as session:
+        try:
+            if session.execute(select(Users.id).where(Users.username == ADMIN_USERNAME)).first() is None:
+                return None
+            return session.execute(select(func.count()).select_from(Users)).scalar_one() - 1
+        except Exception:
+            return None
+
+def seed(engine, users: int, batch_size: int = BATCH_SIZE) -> None:
+    """Recreate the schema and insert ``users`` members plus one admin.
+
+    Every account shares one bcrypt hash; computing a million hashes would
+    take hours and the benchmark only needs logins to cost one verify.
+    """
+    SQLModel.metadata.drop_all(engine)
+    SQLModel.metadata.create_all(engine)
+
+    hashed_password = hash_password_sync(PASSWORD)
+    now = datetime.now()
+    with Session(engine) as session:
+        admin_role = Roles(name="bench_admin", description="Benchmark administrator")
+        member_role = Roles(name="bench_member", description="Benchmark member")
+        session.add_all([admin_role, member_role])
+        session.flush()
+        session.add(RolePermissions(role_id=admin_role.id, permission=UserAction.MANAGE_USER))
+        session.execute(insert(Teams), [
+            {"name": f"team{index:03d}", "description": f"Team {index}"} for index in range(TEAM_COUNT)
+        ])
+        session.execute(insert(Users), [{
+            "username": ADMIN_USERNAME, "username_lower": ADMIN_USERNAME, "password": hashed_password,
+            "first_name": "Bench", "last_name": "Admin", "email": "bench_admin@example.com",
+            "role_id": admin_role.id, "team_id": None, "is_active": True, "created_at": now, "updated_at": now,
+        }])
+
+        for start in range(0, users, batch_size):
+            session.execute(insert(Users), [{
+                "username": username(index), "username_lower": username(index), "password": hashed_password,
+                "first_name": f"First{index % 997}", "last_name": f"Last{index % 1009}",
+                "email": f"{username(index)}@example.com", "role_id": member_role.id,
+                "team_id": index % TEAM_COUNT + 1, "is_active": True, "created_at": now, "updated_at": now,
+            } for index in range(start, min(start + batch_size, users))])
+        session.commit()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--users", type=int, default=1000, help="Number of member accounts to create")
+    parser.add_argument("--database-url", help="Database to seed; it is dropped first (default: a file in the temp dir)")
+    args = parser.parse_args()
+
+    os.environ["DATABASE_URL"] = args.database_url or default_database_url(args.users)
+    engine = create_db_connection()
+    started = time.perf_counter()
+    seed(engine, args.users)
+    print(f"Seeded {args.users} users into {os.environ['DATABASE_URL']} in {time.perf_counter() - started:.1f}s")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+"""Compare SQLite write throughput under each SQLITE_PROFILE.
+
+Every profile gets a fresh database file. Concurrent writer threads insert
+users one transaction at a time, which is what the API does, while reader
+threads keep prefix searches running against the same file.
+
+Example::
+
+    python -m benchmarks.sqlite_profiles --writers 8 --readers 4 --duration 5
+"""
+import argparse
+import os
+import statistics
+import tempfile
+import threading
+import time
+from datetime import datetime
+from sqlalchemy import create_engine, insert, select
+from sqlalchemy.exc import OperationalError
+from sqlmodel import SQLModel
+from src.models import SQLITE_PROFILES, Teams, Users, apply_sqlite_profile, sqlite_maintenance
+
+def run_profile(name: str, writers: int, readers: int, duration: float, directory: str) -> dict:
+    path = os.path.join(directory, f"eoffice-profile-{name}.db")
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+    engine = create_engine(f"sqlite:///{path}", connect_args={"check_same_thread": False},
+                           pool_size=writers + readers, max_overflow=0)
+    apply_sqlite_profile(engine, name)
+    SQLModel.metadata.create_all(engine)
+    with engine.begin() as connection:
+        connection.execute(insert(Teams), [{"name": "bench"}])
+
+    latencies, locked, reads = [], 0, 0
+    lock = threading.Lock()
+    stop = time.perf_counter() + duration
+
+    def write(worker_id: int):
+        nonlocal locked
+        count = 0
+        while time.perf_counter() < stop:
+            now = datetime.now()
+            row = {"username": f"w{worker_id}_{count}", "username_lower": f"w{worker_id}_{count}", "password": "x",
+                   "first_name": "Bench", "last_name": "Writer", "email": f"w{worker_id}_{count}@example.com",
+                   "team_id": 1, "is_active": True, "created_at": now, "updated_at": now}
+            started = time.perf_counter()
+            try:
+                with engine.begin() as connection:
+                    connection.execute(insert(Users), [row])
+            except OperationalError:
+                # "database is locked" once the busy timeout, if any, runs out
+                with lock:
+                    locked += 1
+                continue
+            with lock:
+                latencies.append(time.perf_counter() - started)
+            count += 1
+
+    def read():
+        nonlocal reads
+        query = select(Users.username).where(Users.username_lower.startswith("w1_")).limit(20)
+        while time.perf_counter() < stop:
+            try:
+                with engine.connect() as connection:
+                    connection.execute(query).all()
+            except OperationalError:
+                continue
+            with lock:
+                reads += 1
+
+    threads = [threading.Thread(target=write, args=(i,)) for i in range(writers)]
+    threads += [threading.Thread(target=read) for _ in range(readers)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    _, frames, _ = sqlite_maintenance(engine)
+    engine.dispose()
+
+    latencies.sort()
+    def percentile(q: float) -> float:
+        return latencies[min(len(latencies) - 1, int(q * len(latencies)))] * 1000 if latencies else 0.0
+    return {
+        "writes_per_s": len(latencies) / elapsed,
+        "reads_per_s": reads / elapsed,
+        "p50_ms": statistics.median(latencies) * 1000 if latencies else 0.0,
+        "p99_ms": percentile(0.99),
+        "locked": locked,
+        "wal_frames": frames,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--profiles", nargs="+", choices=list(SQLITE_PROFILES), default=list(SQLITE_PROFILES))
+    parser.add_argument("--writers", type=int, default=8, help="Concurrent writer threads")
+    parser.add_argument("--readers", type=int, default=4, help="Concurrent reader threads")
+    parser.add_argument("--duration", type=float, default=5.0, help="Seconds to run each profile")
+    parser.add_argument("--directory", default=tempfile.gettempdir(), help="Where the database files are created")
+    args = parser.parse_args()
+
+    for name in args.profiles:
+        result = run_profile(name, args.writers, args.readers, args.duration, args.directory)
+        print(f"{name:12} {result['writes_per_s']:>9.1f} writes/s  {result['reads_per_s']:>9.1f} reads/s  "
+              f"p50 {result['p50_ms']:>7.2f} ms  p99 {result['p99_ms']:>8.2f} ms  locked {result['locked']}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+"""Measure cold start: importing the app, running its lifespan and serving the first login.
+
+Every sample runs in a fresh interpreter so nothing is already imported or
+cached. With budgets set, exits 1 when the median exceeds one of them.
+
+Example::
+
+    python -m benchmarks.startup --runs 5 --budget-import-ms 1500 --budget-first-request-ms 800
+    python -m benchmarks.startup --importtime 15
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+from benchmarks.seed import ADMIN_USERNAME, PASSWORD, default_database_url
+
+# Runs in the child interpreter; prints one JSON line with the timings
+PROBE = f"""
+import asyncio, json, sys, time
+started = time.perf_counter()
+from src.main import app
+imported = time.perf_counter()
+
+async def first_request():
+    import httpx
+    async with app.router.lifespan_context(app):
+        ready = time.perf_counter()
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://startup") as client:
+            response = await client.post("/auth/token", data={{"username": {ADMIN_USERNAME!r}, "password": {PASSWORD!r}}})
+            response.raise_for_status()
+        return ready, time.perf_counter()
+
+ready, served = asyncio.run(first_request())
+print(json.dumps({{
+    "import_ms": (imported - started) * 1000,
+    "lifespan_ms": (ready - imported) * 1000,
+    "first_request_ms": (served - ready) * 1000,
+    "loaded": sorted(name for name in ("passlib", "jose", "dotenv") if name in sys.modules),
+}}))
+"""
+
+def probe(env: dict) -> dict:
+    result = subprocess.run([sys.executable, "-c", PROBE], env=env, capture_output=True, text=True, check=True)
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+def import_profile(env: dict, top: int) -> list[tuple[int, str]]:
+    # -X importtime writes "import time: self | cumulative | package" lines to stderr
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", "import src.main"],
+                            env=env, capture_output=True, text=True, check=True)
+    modules = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line.split("|")
+        modules.append((int(cumulative), name.strip()))
+    return sorted(modules, reverse=True)[:top]
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--database-url", help="Database to log in against (default: the 10-user benchmark file)")
+    parser.add_argument("--runs", type=int, default=5, help="Fresh interpreters to sample")
+    parser.add_argument("--importtime", type=int, metavar="N", help="Also list the N slowest imports (cumulative)")
+    parser.add_argument("--budget-import-ms", type=float, help="Fail when the median import time exceeds this")
+    parser.add_argument("--budget-first-request-ms", type=float,
+                        help="Fail when the median of lifespan plus first request exceeds this")
+    args = parser.parse_args()
+
+    env = dict(os.environ, DATABASE_URL=args.database_url or default_database_url(10))
+    if not args.database_url:
+        subprocess.run([sys.executable, "-m", "benchmarks.seed", "--users", "10", "--database-url", env["DATABASE_URL"]],
+                       env=env, check=True, stdout=subprocess.DEVNULL)
+
+    samples = [probe(env) for _ in range(args.runs)]
+    import_ms = statistics.median(sample["import_ms"] for sample in samples)
+    lifespan_ms = statistics.median(sample["lifespan_ms"] for sample in samples)
+    first_request_ms = statistics.median(sample["first_request_ms"] for sample in samples)
+    print(f"import src.main   {import_ms:>8.1f} ms")
+    print(f"lifespan startup  {lifespan_ms:>8.1f} ms")
+    print(f"first login       {first_request_ms:>8.1f} ms")
+    # Only the login should have pulled these in, never the import
+    print(f"lazy imports used {', '.join(samples[-1]['loaded']) or '-'}")
+
+    if args.importtime:
+        print("\nSlowest imports (cumulative):")
+        for cumulative, name in import_profile(env, args.importtime):
+            print(f"{cumulative / 1000:>8.1f} ms  {name}")
+
+    failed = False
+    if args.budget_import_ms is not None and import_ms > args.budget_import_ms:
+        print(f"\nImport took {import_ms:.1f} ms, over the {args.budget_import_ms:.0f} ms budget")
+        failed = True
+    if args.budget_first_request_ms is not None and lifespan_ms + first_request_ms > args.budget_first_request_ms:
+        print(f"\nFirst request took {lifespan_ms + first_request_ms:.1f} ms, over the {args.budget_first_request_ms:.0f} ms budget")
+        failed = True
+    sys.exit(1 if failed else 0)
+
+if __name__ == "__main__":
+    main()
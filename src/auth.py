@@ -1,11 +1,24 @@
-from fastapi import Depends, HTTPException, status
+from fastapi import BackgroundTasks, Depends, HTTPException, Request, status
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
-from jose import JWTError, jwt
-from datetime import datetime, timedelta
-from src.models import Users, RolePermissions, UserAction
-from src.dependency import get_session
-from sqlmodel import Session, select
-from passlib.context import CryptContext
+import hashlib
+import hmac
+import logging
+import secrets
+import time
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from src.models import RolePermissions, Roles, UserAction, Users
+from src.dependency import get_db, open_session, run_query, session_scope
+from src.db_queries.tokens import create_refresh_token_in_db, revoke_refresh_token_in_db, rotate_refresh_token_in_db
+from src.db_queries.users import get_user_by_username_from_db, update_password_hash_in_db, get_role_permissions_by_role, get_all_role_permissions, get_user_principals_from_db
+from src.cache import role_permissions_cache, user_principal_cache, verified_token_cache, current_permission_epoch
+from sqlmodel import Session
+from sqlmodel.ext.asyncio.session import AsyncSession
+from src.passwords import needs_rehash, password_hasher
+from src.throttle import login_throttle
+from src.settings import get_settings
+
+logger = logging.getLogger(__name__)
 
 # to get a string like this run: openssl rand -hex 32
 SECRET_KEY = "my-kothin-jotil-gopon-kotha"
@@ -14,83 +27,251 @@ ACCESS_TOKEN_EXPIRE_MINUTES = 30
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/auth/token")
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# Principal lookups read from a replica unless one of these changed recently
+AUTH_TABLES = (Users.__tablename__, Roles.__tablename__, RolePermissions.__tablename__)
+
+@dataclass(frozen=True)
+class CurrentUser:
+    username: str
+    role_id: int | None
+    permissions: frozenset[UserAction]
+    user_id: int | None = None
+    team_id: int | None = None
 
-def get_password_hash(password):
-    return pwd_context.hash(password)
+    def has_permission(self, action: UserAction) -> bool:
+        return action in self.permissions
 
 from typing import Optional
 
+def get_token_mode() -> str:
+    # "reference" tokens carry only the username; "claims" tokens also carry the
+    # role, its permissions and the permission epoch they were issued under
+    mode = get_settings().token_mode
+    if mode not in ("reference", "claims"):
+        raise ValueError(f"Invalid TOKEN_MODE {mode!r}, expected 'reference' or 'claims'")
+    return mode
+
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     to_encode = data.copy()
     if expires_delta:
-        expire = datetime.now() + expires_delta
+        expire = datetime.now(timezone.utc) + expires_delta
     else:
-        expire = datetime.now() + timedelta(minutes=15)
+        expire = datetime.now(timezone.utc) + timedelta(minutes=15)
     to_encode.update({"exp": expire})
+    # python-jose pulls in its crypto backends on import, so load it on first use
+    from jose import jwt
+
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
-async def authenticate_user(username: str, password: str, session: Session):
-    user = session.exec(select(Users).where(Users.username == username)).first()
+def decode_access_token(token: str) -> dict:
+    """Verify a JWT, reusing the result for repeat presentations of the same token.
+
+    Cached payloads are only returned while their ``exp`` is still in the
+    future, so a hit never outlives the token itself.
+    """
+    key = hashlib.sha256(token.encode()).digest()
+    payload = verified_token_cache.get(key)
+    if payload is not None:
+        if payload["exp"] > time.time():
+            return payload
+        verified_token_cache.invalidate(key)
+
+    from jose import jwt
+
+    payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+    exp = payload.get("exp")
+    if isinstance(exp, (int, float)):
+        verified_token_cache.set(key, payload, ttl=exp - time.time())
+    return payload
+
+async def rehash_password(engine, username: str, old_hash: str, password: str) -> None:
+    # Runs after the response is sent, so a failure has nobody to report to; the next login retries
+    try:
+        new_hash = await password_hasher.rehash(password)
+        async with session_scope(engine) as session:
+            await run_query(session, update_password_hash_in_db, username, old_hash, new_hash)
+    except Exception as e:
+        logger.warning(f"Could not rehash the password of {username}: {e}")
+
+async def authenticate_user(
+    username: str, password: str, session: Session | AsyncSession, background_tasks: BackgroundTasks | None = None
+):
+    user = await run_query(session, get_user_by_username_from_db, username)
     if not user:
         return False
-    if not pwd_context.verify(password, user.password):
+    if not await password_hasher.verify(password, user.password):
+        return False
+    # Checked after the password so the answer says nothing about the account to a guesser;
+    # claims tokens are trusted without a lookup, so one must never be issued to an inactive user
+    if not user.is_active:
         return False
+    # A hash of another cost than BCRYPT_ROUNDS is replaced once the response has been sent
+    if background_tasks is not None and needs_rehash(user.password):
+        background_tasks.add_task(rehash_password, session.bind, user.username, user.password, password)
     return user
 
+def hash_refresh_token(token: str) -> str:
+    # Refresh tokens are long and random, so a keyed SHA-256 is enough; no bcrypt on refresh
+    key = (get_settings().refresh_token_key or SECRET_KEY).encode()
+    return hmac.new(key, token.encode(), hashlib.sha256).hexdigest()
+
+def new_refresh_token() -> tuple[str, str, datetime]:
+    """A fresh opaque token, its hash for the database and its expiry."""
+    token = secrets.token_urlsafe(32)
+    expires_at = datetime.now() + timedelta(days=get_settings().refresh_token_expire_days)
+    return token, hash_refresh_token(token), expires_at
+
+async def issue_access_token(session: Session | AsyncSession, user) -> str:
+    claims = {"sub": user.username}
+    if get_token_mode() == "claims":
+        # Read the epoch first so a change racing with this login makes the token stale, not wrong
+        epoch = current_permission_epoch()
+        permissions = await get_role_permission_set(session, user.role_id)
+        claims.update({
+            "uid": user.id,
+            "team": user.team_id,
+            "role": user.role_id,
+            "perms": sorted(permission.value for permission in permissions),
+            "pe": epoch,
+        })
+
+    access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
+    return create_access_token(
+        data=claims, expires_delta=access_token_expires
+    )
+
 async def login_for_access_token(
+    request: Request,
+    background_tasks: BackgroundTasks,
     form_data: OAuth2PasswordRequestForm = Depends(),
-    session: Session = Depends(get_session)
+    session: Session | AsyncSession = Depends(get_db)
 ):
-    user = await authenticate_user(form_data.username, form_data.password, session)
+    # Throttled attempts are turned away before the user lookup or any bcrypt work
+    login_throttle.check(form_data.username, request.client.host if request.client else None)
+    user = await authenticate_user(form_data.username, form_data.password, session, background_tasks)
     if not user:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect username or password",
             headers={"WWW-Authenticate": "Bearer"},
         )
-    access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
-    access_token = create_access_token(
-        data={"sub": user.username}, expires_delta=access_token_expires
+    access_token = await issue_access_token(session, user)
+    # Each login starts a new token family
+    refresh_token, token_hash, expires_at = new_refresh_token()
+    await run_query(session, create_refresh_token_in_db, user.id, token_hash, secrets.token_hex(16), expires_at)
+    return {"access_token": access_token, "token_type": "bearer", "refresh_token": refresh_token}
+
+async def refresh_access_token(refresh_token: str, session: Session | AsyncSession):
+    """Trade a refresh token for a new access token and its rotated successor."""
+    new_token, new_hash, expires_at = new_refresh_token()
+    user = await run_query(
+        session, rotate_refresh_token_in_db, hash_refresh_token(refresh_token), new_hash, expires_at,
+        get_settings().refresh_token_reuse_grace_seconds,
     )
-    return {"access_token": access_token, "token_type": "bearer"}
+    if user is None:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Invalid or expired refresh token",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+    access_token = await issue_access_token(session, user)
+    return {"access_token": access_token, "token_type": "bearer", "refresh_token": new_token}
+
+async def revoke_refresh_token(refresh_token: str, session: Session | AsyncSession) -> None:
+    await run_query(session, revoke_refresh_token_in_db, hash_refresh_token(refresh_token))
+
+async def get_role_permission_set(session: Session | AsyncSession, role_id: int | None) -> frozenset[UserAction]:
+    permissions = role_permissions_cache.get(role_id)
+    if permissions is None:
+        role_permissions = await run_query(session, get_role_permissions_by_role, role_id)
+        permissions = frozenset(rp.permission for rp in role_permissions)
+        role_permissions_cache.set(role_id, permissions)
+    return permissions
+
+def current_user_from_claims(payload: dict) -> CurrentUser | None:
+    # Only trusted while no role or permission has changed since the token was issued
+    if payload.get("pe") != current_permission_epoch() or "perms" not in payload:
+        return None
+    try:
+        permissions = frozenset(UserAction(value) for value in payload["perms"])
+    except (TypeError, ValueError):
+        return None
+    return CurrentUser(
+        username=payload["sub"], role_id=payload.get("role"), permissions=permissions,
+        user_id=payload.get("uid"), team_id=payload.get("team"),
+    )
+
+async def get_current_user(request: Request, token: str = Depends(oauth2_scheme)):
+    from jose import JWTError
 
-async def get_current_user(token: str = Depends(oauth2_scheme), session: Session = Depends(get_session)):
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="User not found or has no role permissions",
         headers={"WWW-Authenticate": "Bearer"},
     )
     try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        payload = decode_access_token(token)
         username = payload.get("sub")
         if username is None or not isinstance(username, str):
             raise credentials_exception
     except JWTError:
         raise credentials_exception
-    
-    user = session.exec(select(Users).where(Users.username == username)).first()
-    if user is None:
-        raise credentials_exception
-    
-    role_permissions = session.exec(select(RolePermissions).where(RolePermissions.role_id == user.role_id)).all()
-    if role_permissions is None:
-        raise credentials_exception
-    
-    return role_permissions 
-
-async def check_manage_user_permission(current_user_role_permissions: list[RolePermissions] = Depends(get_current_user)) -> bool:
-    has_permission = False
-    for permission in current_user_role_permissions:
-        if permission.permission == UserAction.MANAGE_USER:
-            has_permission = True
-            break
-    
-    if not has_permission:
+
+    # Routes this request's sessions and marks the principal after a write
+    request.state.principal = username
+    current_user = current_user_from_claims(payload)
+    if current_user is not None:
+        return current_user
+
+    # Sessions connect lazily, so a fully cached principal never touches the database
+    async with open_session(request, read_only=True, tables=AUTH_TABLES) as session:
+        principal = user_principal_cache.get(username)
+        if principal is None:
+            user = await run_query(session, get_user_by_username_from_db, username)
+            if user is None:
+                raise credentials_exception
+            principal = (user.id, user.role_id, user.team_id, user.is_active)
+            user_principal_cache.set(username, principal)
+
+        user_id, role_id, team_id, is_active = principal
+        if not is_active:
+            raise credentials_exception
+
+        permissions = await get_role_permission_set(session, role_id)
+    return CurrentUser(username=username, role_id=role_id, permissions=permissions, user_id=user_id, team_id=team_id)
+
+def require_permission(action: UserAction):
+    """Build a dependency that returns the caller if their role grants ``action``."""
+    async def dependency(current_user: CurrentUser = Depends(get_current_user)) -> CurrentUser:
+        if not current_user.has_permission(action):
+            raise HTTPException(
+                status_code=status.HTTP_403_FORBIDDEN,
+                detail="You do not have the necessary permissions"
+            )
+        return current_user
+
+    return dependency
+
+async def check_manage_user_permission(current_user: CurrentUser = Depends(get_current_user)) -> bool:
+    if not current_user.has_permission(UserAction.MANAGE_USER):
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
             detail="You do not have the necessary permissions"
         )
     
-    return has_permission
+    return True
+
+def warm_auth_caches(session: Session) -> None:
+    # Preload every role's permissions and the most recently active users
+    role_permissions_cache.clear()
+    user_principal_cache.clear()
+
+    permissions_by_role: dict[int, set[UserAction]] = {}
+    for rp in get_all_role_permissions(session):
+        permissions_by_role.setdefault(rp.role_id, set()).add(rp.permission)
+    for role_id, permissions in permissions_by_role.items():
+        role_permissions_cache.set(role_id, frozenset(permissions))
+
+    for username, user_id, role_id, team_id, is_active in get_user_principals_from_db(session, user_principal_cache.maxsize):
+        user_principal_cache.set(username, (user_id, role_id, team_id, is_active))
@@ -0,0 +1,233 @@
+import secrets
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Hashable
+from src.settings import Settings
+
+_MISSING = object()
+
+class TTLCache:
+    """Bounded LRU mapping whose entries also expire after ``ttl`` seconds."""
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: OrderedDict[Hashable, tuple[float, Any]] = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            entry = self._data.get(key, _MISSING)
+            if entry is _MISSING:
+                self.misses += 1
+                return default
+            expires_at, value = entry
+            if expires_at <= time.monotonic():
+                del self._data[key]
+                self.expirations += 1
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key: Hashable, value: Any, ttl: float | None = None) -> None:
+        # ``ttl`` overrides the cache-wide lifetime for this entry
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            self._data[key] = (time.monotonic() + (self.ttl if ttl is None else ttl), value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, key: Hashable) -> None:
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def stats(self) -> dict:
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+        }
+
+class ResponseCache:
+    """LRU of encoded response bodies, capped by their total size in bytes.
+
+    Entries are tagged with the tables they were read from so a write can
+    drop them, and they still expire after ``ttl`` seconds to bound how long
+    a write made by another process goes unseen.
+    """
+
+    def __init__(self, max_bytes: int, ttl: float):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        # key -> (expires_at, tables, body, headers)
+        self._data: OrderedDict[Hashable, tuple[float, tuple[str, ...], bytes, dict[str, str]]] = OrderedDict()
+        self._lock = threading.Lock()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    def _pop(self, key: Hashable) -> None:
+        self.bytes -= len(self._data.pop(key)[2])
+
+    def get(self, key: Hashable) -> tuple[bytes, dict[str, str]] | None:
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            expires_at, _, body, headers = entry
+            if expires_at <= time.monotonic():
+                self._pop(key)
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return body, headers
+
+    def set(self, key: Hashable, body: bytes, headers: dict[str, str], tables: tuple[str, ...]) -> None:
+        # A body bigger than the whole budget is not worth evicting everything for
+        if len(body) > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._data:
+                self._pop(key)
+            self._data[key] = (time.monotonic() + self.ttl, tables, body, headers)
+            self.bytes += len(body)
+            while self.bytes > self.max_bytes:
+                self._pop(next(iter(self._data)))
+                self.evictions += 1
+
+    def invalidate_tables(self, *tables: str) -> None:
+        with self._lock:
+            stale = [key for key, entry in self._data.items() if not set(tables).isdisjoint(entry[1])]
+            for key in stale:
+                self._pop(key)
+            self.invalidations += len(stale)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+            self.bytes = 0
+
+    def stats(self) -> dict:
+        return {
+            "size": len(self._data),
+            "bytes": self.bytes,
+            "max_bytes": self.max_bytes,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "invalidations": self.invalidations,
+        }
+
+# Sizes and lifetimes below are the defaults; configure_caches applies the
+# settings at startup so importing this module reads no configuration
+
+# role_id -> frozenset[UserAction]
+role_permissions_cache = TTLCache(256, 60)
+
+# username -> (user id, role_id, team_id, is_active)
+user_principal_cache = TTLCache(1024, 60)
+
+# Bumped on every role or permission change. The boot id keeps epochs from
+# different processes (or restarts) from ever comparing equal.
+_epoch_boot_id = secrets.token_hex(4)
+_epoch_counter = 0
+_epoch_lock = threading.Lock()
+
+def current_permission_epoch() -> str:
+    return f"{_epoch_boot_id}:{_epoch_counter}"
+
+def bump_permission_epoch() -> None:
+    global _epoch_counter
+    with _epoch_lock:
+        _epoch_counter += 1
+
+# Encoded bodies of the reference-data listings, keyed by their ETag
+response_cache = ResponseCache(4 * 1024 * 1024, 60)
+
+# Table name -> (write counter, time of the last write), bumped by the
+# db_queries write paths after commit. Like the permission epoch, versions are
+# per process and carry the boot id; they only key response_cache entries and
+# never see writes made by other processes.
+_table_versions: dict[str, tuple[int, float]] = {}
+_table_versions_lock = threading.Lock()
+
+def table_version(*tables: str) -> str:
+    counters = ",".join(str(_table_versions.get(table, (0, 0.0))[0]) for table in tables)
+    return f"{_epoch_boot_id}:{counters}"
+
+def table_modified_at(*tables: str) -> float:
+    # Last write this process made to any of the tables; 0 when it made none
+    return max(_table_versions.get(table, (0, 0.0))[1] for table in tables)
+
+def tables_written_within(seconds: float, *tables: str) -> bool:
+    since = time.time() - seconds
+    return any(_table_versions.get(table, (0, 0.0))[1] > since for table in tables)
+
+def bump_table_version(*tables: str) -> None:
+    now = time.time()
+    with _table_versions_lock:
+        for table in tables:
+            counter, _ = _table_versions.get(table, (0, 0.0))
+            _table_versions[table] = (counter + 1, now)
+    response_cache.invalidate_tables(*tables)
+
+# sha256(token) -> decoded JWT payload; entries are stored with the token's own
+# remaining lifetime, the day-long default only bounds tokens without one
+verified_token_cache = TTLCache(4096, 86400)
+
+# Principals who wrote within READ_YOUR_WRITES_SECONDS; their reads stay on the
+# primary so they never see a replica that has not caught up with them yet
+recent_writers = TTLCache(4096, 5)
+
+def configure_caches(settings: Settings) -> None:
+    role_permissions_cache.maxsize = settings.role_cache_size
+    role_permissions_cache.ttl = settings.auth_cache_ttl
+    user_principal_cache.maxsize = settings.user_cache_size
+    user_principal_cache.ttl = settings.auth_cache_ttl
+    verified_token_cache.maxsize = settings.token_cache_size
+    response_cache.max_bytes = settings.response_cache_max_bytes
+    response_cache.ttl = settings.response_cache_ttl
+    recent_writers.ttl = settings.read_your_writes_seconds
+
+def invalidate_role(role_id: int | None) -> None:
+    role_permissions_cache.invalidate(role_id)
+    bump_permission_epoch()
+
+def invalidate_user(username: str) -> None:
+    user_principal_cache.invalidate(username)
+
+def auth_cache_stats() -> dict:
+    return {
+        "role_permissions": role_permissions_cache.stats(),
+        "users": user_principal_cache.stats(),
+        "tokens": verified_token_cache.stats(),
+    }
@@ -0,0 +1,137 @@
+import hashlib
+from datetime import datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+from functools import lru_cache
+from typing import Any, Awaitable, Callable, Sequence
+from fastapi import HTTPException, Request, Response
+from pydantic import TypeAdapter
+from src.cache import response_cache, table_modified_at, table_version
+
+# Headers a listing sets on the way out that belong with its encoded body
+_BODY_HEADERS = ("X-Next-Cursor", "Link")
+
+def _cache_key(request: Request, tables: tuple[str, ...]) -> str:
+    # The query string is part of the key, so every page and filter gets its own entry
+    query = "&".join(sorted(f"{key}={value}" for key, value in request.query_params.multi_items()))
+    return f"{table_version(*tables)}|{request.url.path}?{query}"
+
+def _etag(body: bytes, headers: dict[str, str]) -> str:
+    # Derived from the bytes sent, so one tag never names two different bodies
+    digest = hashlib.sha256(body)
+    for key in sorted(headers):
+        digest.update(f"\n{key}: {headers[key]}".encode())
+    return '"' + digest.hexdigest()[:32] + '"'
+
+def _etag_matches(if_none_match: str, etag: str) -> bool:
+    # If-None-Match uses weak comparison, so a W/ prefix still matches
+    if if_none_match.strip() == "*":
+        return True
+    return any(tag.strip().removeprefix("W/") == etag for tag in if_none_match.split(","))
+
+def _http_date(value: datetime | float) -> datetime:
+    if not isinstance(value, datetime):
+        value = datetime.fromtimestamp(value, timezone.utc)
+    # Naive timestamps in the database are local time; HTTP dates have second precision
+    return value.astimezone(timezone.utc).replace(microsecond=0)
+
+@lru_cache
+def _list_adapter(model: type) -> TypeAdapter:
+    return TypeAdapter(list[model])
+
+class Conditional:
+    """Validators for one GET request; built by the ``conditional_get`` dependency."""
+
+    def __init__(self, request: Request, response: Response, tables: tuple[str, ...], key: str,
+                 entry: tuple[bytes, dict[str, str]] | None):
+        self.request = request
+        self.response = response
+        self.tables = tables
+        self.key = key
+        self.entry = entry
+
+    def _encode(self, model: type, rows: Sequence[Any]) -> tuple[bytes, dict[str, str]]:
+        adapter = _list_adapter(model)
+        body = adapter.dump_json(adapter.validate_python(rows, from_attributes=True))
+        headers = {key: self.response.headers[key] for key in _BODY_HEADERS if key in self.response.headers}
+        return body, {"ETag": _etag(body, headers), **headers}
+
+    def _send(self, body: bytes, headers: dict[str, str]) -> Response:
+        if "Last-Modified" in self.response.headers:
+            headers = {**headers, "Last-Modified": self.response.headers["Last-Modified"]}
+        if_none_match = self.request.headers.get("if-none-match")
+        if if_none_match is not None and _etag_matches(if_none_match, headers["ETag"]):
+            # The rows were read, but the client keeps its copy of the body
+            raise HTTPException(status_code=304, headers={key: headers[key] for key in ("ETag", "Last-Modified") if key in headers})
+        return Response(content=body, media_type="application/json", headers=headers)
+
+    async def cached(self, model: type, load: Callable[[], Awaitable[Sequence[Any]]]) -> Response:
+        """Serve the encoded ``list[model]`` body from the response cache.
+
+        ``load`` runs only on a miss; the rows are validated, encoded and
+        tagged once and the bytes are reused until one of ``tables`` is
+        written here or the entry's TTL runs out.
+        """
+        if self.entry is None and "if-none-match" not in self.request.headers:
+            # conditional_get has already looked up requests that carry a validator
+            self.entry = response_cache.get(self.key)
+        if self.entry is None:
+            self.entry = self._encode(model, await load())
+            response_cache.set(self.key, *self.entry, self.tables)
+        return self._send(*self.entry)
+
+    def respond(self, model: type, rows: Sequence[Any]) -> Response:
+        """Encode ``rows`` as ``list[model]`` with an ETag, without caching the body."""
+        return self._send(*self._encode(model, rows))
+
+    def last_modified(self, *timestamps: datetime) -> None:
+        """Send Last-Modified for the rows being returned and honour If-Modified-Since.
+
+        The date is the newest persisted ``updated_at`` among the rows. Deletes
+        leave no timestamp behind, so writes this process made to the tables
+        are folded in too; a row deleted by another process is only noticed
+        through the ETag. HTTP dates have one-second precision, so a date in
+        the current second never answers 304: another write may follow
+        within that second.
+        """
+        modified = max(_http_date(ts) for ts in (*timestamps, table_modified_at(*self.tables)))
+        self.response.headers["Last-Modified"] = format_datetime(modified, usegmt=True)
+
+        # If-None-Match takes precedence when both are sent
+        if_modified_since = self.request.headers.get("if-modified-since")
+        if if_modified_since is None or "if-none-match" in self.request.headers:
+            return
+        if modified >= datetime.now(timezone.utc).replace(microsecond=0):
+            return
+        try:
+            since = parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError):
+            return
+        if since.tzinfo is not None and modified <= since:
+            raise HTTPException(status_code=304, headers={"Last-Modified": self.response.headers["Last-Modified"]})
+
+def conditional_get(*tables: str):
+    """Build a dependency for ETag and Last-Modified handling on a listing.
+
+    The ETag is a hash of the encoded body, so it stays a valid strong
+    validator whichever process or script wrote the rows. A matching
+    If-None-Match is answered with 304 before the database is queried only
+    when this process holds the body in ``response_cache``. Those entries are
+    dropped by this process's writes to ``tables`` and otherwise live for
+    RESPONSE_CACHE_TTL seconds, which bounds how long a write made elsewhere
+    can go unseen. Otherwise the rows are read and the tag compared after
+    encoding. Declare it ahead of ``get_read_db`` so the session is never
+    opened for a cached 304, and so the read is sent to the primary while
+    ``tables`` have recent writes.
+    """
+    def dependency(request: Request, response: Response) -> Conditional:
+        request.state.read_tables = tables
+        key = _cache_key(request, tables)
+        if_none_match = request.headers.get("if-none-match")
+        entry = None
+        if if_none_match is not None:
+            entry = response_cache.get(key)
+            if entry is not None and _etag_matches(if_none_match, entry[1]["ETag"]):
+                raise HTTPException(status_code=304, headers={"ETag": entry[1]["ETag"]})
+        return Conditional(request, response, tables, key, entry)
+
+    return dependency
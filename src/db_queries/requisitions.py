@@ -0,0 +1,127 @@
+from datetime import datetime
+from sqlmodel import Session, select, or_, and_
+from sqlalchemy import update
+from src.models import Requisitions, RequisitionCreate, RequisitionStatus
+from src.cache import bump_table_version
+
+# Listings are keyset-paginated on (created_at, id), which is the tail of both
+# requisition indexes, so every page is a range scan with no sort.
+
+# Ids per IN list when a decision covers many requisitions
+DECISION_BATCH_SIZE = 500
+
+def create_requisition_in_db(session: Session, data: RequisitionCreate, team_id: int, requester_id: int) -> Requisitions:
+    now = datetime.now()
+    db_requisition = Requisitions(
+        **data.model_dump(), team_id=team_id, requester_id=requester_id,
+        status=RequisitionStatus.PENDING, created_at=now, updated_at=now,
+    )
+    session.add(db_requisition)
+    session.commit()
+    bump_table_version(Requisitions.__tablename__)
+    return db_requisition
+
+def get_requisition_from_db(session: Session, requisition_id: int) -> Requisitions | None:
+    return session.get(Requisitions, requisition_id)
+
+def get_requisition_queue_from_db(
+    session: Session, team_id: int, status: RequisitionStatus, limit: int | None = None, after: tuple | None = None
+) -> list[Requisitions]:
+    """Oldest first; served by ix_requisitions_status_team_id_created_at."""
+    statement = (
+        select(Requisitions)
+        .where(Requisitions.status == status, Requisitions.team_id == team_id)
+        .order_by(Requisitions.created_at, Requisitions.id) # type: ignore
+    )
+    if after is not None:
+        after_created_at, after_id = after
+        statement = statement.where(or_(
+            Requisitions.created_at > after_created_at,
+            and_(Requisitions.created_at == after_created_at, Requisitions.id > after_id),
+        ))
+    return session.exec(statement.limit(limit)).all()
+
+def get_requester_requisitions_from_db(
+    session: Session, requester_id: int, limit: int | None = None, after: tuple | None = None
+) -> list[Requisitions]:
+    """Newest first; a backward scan of ix_requisitions_requester_id_created_at."""
+    statement = (
+        select(Requisitions)
+        .where(Requisitions.requester_id == requester_id)
+        .order_by(Requisitions.created_at.desc(), Requisitions.id.desc()) # type: ignore
+    )
+    if after is not None:
+        after_created_at, after_id = after
+        statement = statement.where(or_(
+            Requisitions.created_at < after_created_at,
+            and_(Requisitions.created_at == after_created_at, Requisitions.id < after_id),
+        ))
+    return session.exec(statement.limit(limit)).all()
+
+def _chunks(items: list, size: int):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+def decide_requisitions_in_db(
+    session: Session, ids: list[int], status: RequisitionStatus, approver_id: int, team_id: int, atomic: bool = True
+) -> tuple[list[int], list[dict]]:
+    """Approve or reject many pending requisitions in one transaction.
+
+    Returns (decided ids, errors per id). Requisitions that do not exist, are
+    outside the approver's team, were raised by the approver or are no longer
+    pending are reported instead of decided. In atomic mode any error means
+    nothing is written.
+    """
+    ids = sorted(set(ids))
+    errors: list[dict] = []
+
+    # Primary-key lookups first, so every rejected id gets a precise reason
+    found = {}
+    for chunk in _chunks(ids, DECISION_BATCH_SIZE):
+        statement = select(Requisitions.id, Requisitions.team_id, Requisitions.requester_id, Requisitions.status)
+        for row in session.exec(statement.where(Requisitions.id.in_(chunk))).all(): # type: ignore
+            found[row.id] = row
+
+    eligible = []
+    for requisition_id in ids:
+        row = found.get(requisition_id)
+        if row is None or row.team_id != team_id:
+            # Other teams' requisitions are indistinguishable from missing ones
+            errors.append({"id": requisition_id, "error": "Requisition not found"})
+        elif row.requester_id == approver_id:
+            errors.append({"id": requisition_id, "error": "Requisitions cannot be decided by their requester"})
+        elif row.status != RequisitionStatus.PENDING:
+            errors.append({"id": requisition_id, "error": f"Requisition is already {row.status.value}"})
+        else:
+            eligible.append(requisition_id)
+    if atomic and errors:
+        return [], errors
+
+    now = datetime.now()
+    decided: list[int] = []
+    for chunk in _chunks(eligible, DECISION_BATCH_SIZE):
+        # The status guard keeps a requisition decided concurrently by another approver from flipping
+        statement = (
+            update(Requisitions)
+            .where(Requisitions.id.in_(chunk), Requisitions.status == RequisitionStatus.PENDING) # type: ignore
+            .values(status=status, decided_by=approver_id, decided_at=now, updated_at=now)
+        )
+        if session.get_bind().dialect.update_returning:
+            decided.extend(session.execute(statement.returning(Requisitions.id)).scalars().all())
+        elif session.execute(statement).rowcount == len(chunk):
+            decided.extend(chunk)
+        else:
+            decided.extend(session.exec(
+                select(Requisitions.id).where(Requisitions.id.in_(chunk), Requisitions.decided_at == now) # type: ignore
+            ).all())
+
+    raced = sorted(set(eligible) - set(decided))
+    errors.extend({"id": requisition_id, "error": "Requisition is no longer pending"} for requisition_id in raced)
+    if atomic and raced:
+        session.rollback()
+        return [], sorted(errors, key=lambda error: error["id"])
+
+    session.commit()
+    if decided:
+        bump_table_version(Requisitions.__tablename__)
+    return sorted(decided), sorted(errors, key=lambda error: error["id"])
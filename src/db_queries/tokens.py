@@ -0,0 +1,99 @@
+from datetime import datetime, timedelta
+from sqlmodel import Session, select
+from sqlalchemy import delete, update
+from src.models import RefreshTokens, Users
+
+# Refresh tokens are looked up by the unique token_hash index, so every
+# operation here is one indexed statement plus, on rotation, one insert.
+
+def create_refresh_token_in_db(
+    session: Session, user_id: int, token_hash: str, family_id: str, expires_at: datetime
+) -> RefreshTokens:
+    db_token = RefreshTokens(
+        user_id=user_id, token_hash=token_hash, family_id=family_id, created_at=datetime.now(), expires_at=expires_at
+    )
+    session.add(db_token)
+    session.commit()
+    return db_token
+
+def _revoke_family(session: Session, family_id: str, now: datetime) -> None:
+    session.execute(
+        update(RefreshTokens)
+        .where(RefreshTokens.family_id == family_id, RefreshTokens.revoked_at.is_(None))
+        .values(revoked_at=now)
+    )
+
+def rotate_refresh_token_in_db(
+    session: Session, token_hash: str, new_token_hash: str, expires_at: datetime, reuse_grace_seconds: float = 0
+) -> Users | None:
+    """Spend a refresh token and store its successor in the same family.
+
+    Returns the token's user, or None when the token is unknown, expired or
+    already spent. Presenting a spent token means it was copied, so the
+    whole family is revoked and the legitimate holder has to log in again.
+    A token spent less than ``reuse_grace_seconds`` ago is only refused:
+    that is a client retry or two tabs refreshing at once, and revoking the
+    family would also revoke the successor just handed to the winner.
+    """
+    now = datetime.now()
+    # The revoked_at IS NULL guard lets only one of several concurrent refreshes with a token spend it
+    statement = (
+        update(RefreshTokens)
+        .where(RefreshTokens.token_hash == token_hash, RefreshTokens.revoked_at.is_(None), RefreshTokens.expires_at > now)
+        .values(revoked_at=now)
+    )
+    if session.get_bind().dialect.update_returning:
+        db_token = session.execute(statement.returning(RefreshTokens)).scalars().first()
+    elif session.execute(statement).rowcount:
+        db_token = session.exec(select(RefreshTokens).where(RefreshTokens.token_hash == token_hash)).one()
+    else:
+        db_token = None
+
+    if db_token is None:
+        spent = session.exec(select(RefreshTokens).where(RefreshTokens.token_hash == token_hash)).first()
+        reused_after = now - timedelta(seconds=reuse_grace_seconds)
+        if spent is not None and spent.revoked_at is not None and spent.revoked_at <= reused_after:
+            _revoke_family(session, spent.family_id, now)
+        session.commit()
+        return None
+
+    user = session.get(Users, db_token.user_id)
+    if user is None or not user.is_active:
+        _revoke_family(session, db_token.family_id, now)
+        session.commit()
+        return None
+
+    session.add(RefreshTokens(
+        user_id=db_token.user_id, token_hash=new_token_hash, family_id=db_token.family_id,
+        created_at=now, expires_at=expires_at,
+    ))
+    session.commit()
+    return user
+
+def revoke_refresh_token_in_db(session: Session, token_hash: str) -> bool:
+    """Revoke the token's whole family (logout); returns False for an unknown token."""
+    db_token = session.exec(select(RefreshTokens).where(RefreshTokens.token_hash == token_hash)).first()
+    if db_token is None:
+        return False
+    _revoke_family(session, db_token.family_id, datetime.now())
+    session.commit()
+    return True
+
+def revoke_user_refresh_tokens(session: Session, user_id: int) -> None:
+    # Runs inside the caller's transaction, e.g. a password change; the caller commits
+    session.execute(
+        update(RefreshTokens)
+        .where(RefreshTokens.user_id == user_id, RefreshTokens.revoked_at.is_(None))
+        .values(revoked_at=datetime.now())
+    )
+
+def purge_expired_refresh_tokens_in_db(session: Session, now: datetime | None = None) -> int:
+    """Delete tokens past their expiry; returns how many rows went.
+
+    Spent and revoked tokens are kept until they expire, so replaying one
+    still revokes its family. Every login adds a row, and this keeps the
+    table to the tokens issued within REFRESH_TOKEN_EXPIRE_DAYS.
+    """
+    result = session.execute(delete(RefreshTokens).where(RefreshTokens.expires_at <= (now or datetime.now())))
+    session.commit()
+    return result.rowcount
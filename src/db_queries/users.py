@@ -1,20 +1,43 @@
-from sqlmodel import Session, select
-from src.models import Users, Teams, TeamUpdate, UserCreate, RoleCreate, Roles, RolePermissions, RolePermissionCreate
+import re
+import sys
+from sqlmodel import Session, select, or_, and_
+from sqlalchemy import Select, column, delete, insert, literal_column, table, update
+from sqlalchemy import select as sa_select
+from sqlalchemy.dialects import postgresql, sqlite
+from src.models import Users, Teams, TeamUpdate, UserCreate, RoleCreate, Roles, RolePermissions, RolePermissionCreate, UserAction
 from sqlalchemy.exc import IntegrityError
 from datetime import datetime
-from passlib.context import CryptContext
+from src.db_queries.tokens import revoke_user_refresh_tokens
+from src.cache import invalidate_role, invalidate_user, bump_permission_epoch, bump_table_version
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# Write paths below use one UPDATE/DELETE ... RETURNING or INSERT ... ON CONFLICT
+# statement where the dialect supports it, and sessions are opened with
+# expire_on_commit=False, so nothing is re-selected after commit.
 
-def hash_password(password: str) -> str:
-    return pwd_context.hash(password)
+def _update_returning(session: Session, model, where: list, values: dict):
+    statement = update(model).where(*where).values(**values)
+    if session.get_bind().dialect.update_returning:
+        return session.execute(statement.returning(model)).scalars().first()
+    if session.execute(statement).rowcount == 0:
+        return None
+    return session.exec(select(model).where(*where)).first()
 
-def verify_password(plain_password: str, hashed_password: str) -> bool:
-    return pwd_context.verify(plain_password, hashed_password)
+def _delete_returning(session: Session, model, where: list):
+    if session.get_bind().dialect.delete_returning:
+        return session.execute(delete(model).where(*where).returning(model)).scalars().first()
+    row = session.exec(select(model).where(*where)).first()
+    if row is not None:
+        session.execute(delete(model).where(*where))
+    return row
 
-def create_user_in_db(session: Session, user_data: UserCreate) -> Users:
+def _model_columns(model, data: dict) -> dict:
+    columns = model.__table__.columns.keys()
+    return {key: value for key, value in data.items() if key in columns}
+
+def create_user_in_db(session: Session, user_data: UserCreate, hashed_password: str) -> Users:
+    # Hashing happens in the caller, off the event loop, via src.passwords
     db_user = Users(**user_data.model_dump())
-    db_user.password = hash_password(user_data.password)
+    db_user.password = hashed_password
     db_user.is_active = True
     db_user.created_at = datetime.now()
     db_user.updated_at = datetime.now()
@@ -22,38 +45,220 @@ def create_user_in_db(session: Session, user_data: UserCreate) -> Users:
     session.add(db_user)
     try:
         session.commit()
-        session.refresh(db_user)
+        invalidate_user(db_user.username)
+        bump_table_version(Users.__tablename__)
         return db_user
     except IntegrityError:
         session.rollback()
         raise
 
-def get_users_from_db(session: Session, username: str):
-    statement = select(Users).where(Users.username.ilike(f"{username}%")) # type: ignore
+def _chunks(items: list, size: int):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+def _existing_values(session: Session, column, values: set, batch_size: int) -> set:
+    found = set()
+    for chunk in _chunks(sorted(values), batch_size):
+        found.update(session.exec(select(column).where(column.in_(chunk))).all())
+    return found
+
+def check_bulk_users_in_db(
+    session: Session, users: list[tuple[int, UserCreate]], batch_size: int = 500
+) -> tuple[list[tuple[int, UserCreate]], list[dict]]:
+    """Find the rows of a bulk import that cannot be inserted, before any password is hashed.
+
+    ``users`` holds (row number, validated record). Duplicate usernames or
+    emails, within the import or already stored, and unknown team or role
+    ids are found with a few IN queries. Returns the rows that passed and an
+    error per rejected row.
+    """
+    errors: list[dict] = []
+    existing_usernames = _existing_values(session, Users.username, {user.username for _, user in users}, batch_size)
+    existing_emails = _existing_values(session, Users.email, {user.email for _, user in users}, batch_size)
+    team_ids = _existing_values(session, Teams.id, {user.team_id for _, user in users if user.team_id is not None}, batch_size)
+    role_ids = _existing_values(session, Roles.id, {user.role_id for _, user in users if user.role_id is not None}, batch_size)
+    # Hashing comes next and may take a while, so hold no read transaction through it
+    session.rollback()
+
+    accepted = []
+    seen_usernames: set[str] = set()
+    seen_emails: set[str] = set()
+    for row, user in users:
+        if user.username in existing_usernames or user.username in seen_usernames:
+            error = f"Username {user.username} already exists"
+        elif user.email in existing_emails or user.email in seen_emails:
+            error = f"Email {user.email} already exists"
+        elif user.team_id is not None and user.team_id not in team_ids:
+            error = f"Team with ID {user.team_id} not found"
+        elif user.role_id is not None and user.role_id not in role_ids:
+            error = f"Role with ID {user.role_id} not found"
+        else:
+            seen_usernames.add(user.username)
+            seen_emails.add(user.email)
+            accepted.append((row, user))
+            continue
+        errors.append({"row": row, "username": user.username, "error": error})
+    return accepted, errors
+
+def bulk_create_users_in_db(
+    session: Session, users: list[tuple[int, UserCreate, str]], batch_size: int = 500, atomic: bool = True
+) -> tuple[int, list[dict]]:
+    """Insert many users with executemany, reporting failures per input row.
+
+    ``users`` holds (row number, validated record, password hash) for rows
+    that passed ``check_bulk_users_in_db``. A concurrent writer can still
+    cause a constraint error; in atomic mode that means nothing is written,
+    in best-effort mode every good row is inserted and each batch is committed.
+    """
+    errors: list[dict] = []
+
+    def reject(row: int, user: UserCreate, error: str):
+        errors.append({"row": row, "username": user.username, "error": error})
+
+    now = datetime.now()
+    def values(user: UserCreate, hashed_password: str) -> dict:
+        return dict(user.model_dump(), password=hashed_password, username_lower=user.username.lower(),
+                    is_active=True, created_at=now, updated_at=now)
+
+    created = []
+    try:
+        for batch in _chunks(users, batch_size):
+            try:
+                session.execute(insert(Users), [values(user, hashed_password) for _, user, hashed_password in batch])
+                if not atomic:
+                    session.commit()
+                created.extend(user.username for _, user, _ in batch)
+            except IntegrityError as e:
+                session.rollback()
+                if atomic:
+                    return 0, errors + [{"row": batch[0][0], "username": None, "error": f"Batch insert failed: {e.orig}"}]
+                # A concurrent writer beat the pre-checks; find the offending rows one by one
+                for row, user, hashed_password in batch:
+                    try:
+                        session.execute(insert(Users), [values(user, hashed_password)])
+                        session.commit()
+                        created.append(user.username)
+                    except IntegrityError as row_error:
+                        session.rollback()
+                        reject(row, user, str(row_error.orig))
+        if atomic:
+            session.commit()
+    except Exception:
+        session.rollback()
+        raise
+    finally:
+        # Best-effort batches may have committed before a failure
+        if created:
+            bump_table_version(Users.__tablename__)
+
+    for username in created:
+        invalidate_user(username)
+    return len(created), sorted(errors, key=lambda error: error["row"])
+
+def get_user_by_username_from_db(session: Session, username: str) -> Users | None:
+    statement = select(Users).where(Users.username == username)
+    return session.exec(statement).first()
+
+def get_user_principals_from_db(session: Session, limit: int):
+    # (username, id, role_id, team_id, is_active) rows used to warm the auth cache
+    statement = select(Users.username, Users.id, Users.role_id, Users.team_id, Users.is_active).order_by(Users.updated_at.desc()).limit(limit) # type: ignore
     return session.exec(statement).all()
 
+def _prefix_upper_bound(prefix: str) -> str | None:
+    # Smallest string greater than every string starting with prefix; None when there is none
+    prefix = prefix.rstrip(chr(sys.maxunicode))
+    if not prefix:
+        return None
+    next_char = ord(prefix[-1]) + 1
+    if 0xD800 <= next_char <= 0xDFFF:
+        # Surrogates cannot be encoded, and no stored character falls between them
+        next_char = 0xE000
+    return prefix[:-1] + chr(next_char)
+
+def get_users_from_db(session: Session, username: str, limit: int | None = None, after: tuple | None = None):
+    # Case-insensitive prefix match as a range scan on ix_users_username_lower_username
+    prefix = username.lower()
+    statement = select(Users).order_by(Users.username_lower, Users.username) # type: ignore
+    if prefix:
+        statement = statement.where(Users.username_lower >= prefix)
+        upper_bound = _prefix_upper_bound(prefix)
+        if upper_bound is not None:
+            statement = statement.where(Users.username_lower < upper_bound)
+    if after is not None:
+        after_lower, after_username = after
+        statement = statement.where(or_(
+            Users.username_lower > after_lower,
+            and_(Users.username_lower == after_lower, Users.username > after_username),
+        ))
+    return session.exec(statement.limit(limit)).all()
+
+users_fts = table("users_fts", column("rowid"), column("rank"))
+
+def _fts_query(search_text: str) -> str:
+    # Quote every word so user input can never be read as FTS5 query syntax
+    return " ".join(f'"{token}"*' for token in re.findall(r"\w+", search_text))
+
+def search_users_in_db(session: Session, query: str, limit: int | None = None, offset: int = 0) -> list[Users]:
+    """Full-text search over username, first_name, last_name and email, best match first."""
+    if session.get_bind().dialect.name != "sqlite":
+        pattern = f"%{query}%"
+        statement = select(Users).where(or_(
+            Users.username.ilike(pattern), Users.first_name.ilike(pattern), # type: ignore
+            Users.last_name.ilike(pattern), Users.email.ilike(pattern), # type: ignore
+        )).order_by(Users.username_lower) # type: ignore
+        return list(session.exec(statement.offset(offset).limit(limit)).all())
+
+    match = _fts_query(query)
+    if not match:
+        return []
+    statement = (
+        select(Users)
+        .join(users_fts, users_fts.c.rowid == Users.id)
+        .where(literal_column("users_fts").op("MATCH")(match))
+        .order_by(users_fts.c.rank, Users.id)
+    )
+    return list(session.exec(statement.offset(offset).limit(limit)).all())
+
+# Everything in UserInfo; the password hash is never exported
+USER_EXPORT_COLUMNS = ["id", "username", "first_name", "last_name", "email", "team_id", "role_id", "is_active", "created_at", "updated_at"]
+
+def get_users_export_statement(team_id: int | None = None, role_id: int | None = None, batch_size: int = 1000) -> Select:
+    # yield_per makes the driver hand rows over in batches instead of buffering the table
+    statement = sa_select(*(getattr(Users, name) for name in USER_EXPORT_COLUMNS)).order_by(Users.id) # type: ignore
+    if team_id is not None:
+        statement = statement.where(Users.team_id == team_id)
+    if role_id is not None:
+        statement = statement.where(Users.role_id == role_id)
+    return statement.execution_options(yield_per=batch_size)
+
 def delete_user_from_db(session: Session, username: str):
-    statement = select(Users).where(Users.username == username)
-    db_user = session.exec(statement).first()
-    if db_user:
-        session.delete(db_user)
+    try:
+        db_user = _delete_returning(session, Users, [Users.username == username])
         session.commit()
+    except Exception:
+        session.rollback()
+        raise
+    if db_user:
+        invalidate_user(username)
+        bump_permission_epoch()
+        bump_table_version(Users.__tablename__)
     return db_user
 
 def update_user_in_db(session: Session, username: str, updated_data: dict) -> Users:
-    statement = select(Users).where(Users.username == username)
-    db_user = session.exec(statement).first()
-    if not db_user:
-        raise ValueError(f"User with username {username} not found")
-
-    for key, value in updated_data.items():
-        if hasattr(db_user, key):
-            setattr(db_user, key, value)
-    db_user.updated_at = datetime.now()
-
+    values = dict(_model_columns(Users, updated_data), updated_at=datetime.now())
     try:
+        db_user = _update_returning(session, Users, [Users.username == username], values)
+        if not db_user:
+            raise ValueError(f"User with username {username} not found")
+        # A new password or a deactivation ends every session the user could refresh
+        if "password" in updated_data or updated_data.get("is_active") is False:
+            revoke_user_refresh_tokens(session, db_user.id)
         session.commit()
-        session.refresh(db_user)
+        invalidate_user(username)
+        bump_table_version(Users.__tablename__)
+        # Claims tokens carry the role and team, so either change makes them stale
+        if "role_id" in updated_data or "is_active" in updated_data or "team_id" in updated_data:
+            bump_permission_epoch()
         return db_user
     except IntegrityError:
         #logger.error(f"{str(e)}")
@@ -64,13 +269,25 @@ def update_user_in_db(session: Session, username: str, updated_data: dict) -> Us
         session.rollback()
         raise e
 
+def update_password_hash_in_db(session: Session, username: str, old_hash: str, new_hash: str) -> bool:
+    """Swap a stored hash for one of the same password at another cost.
+
+    The old hash is part of the WHERE clause, so a password changed since
+    the login is never overwritten. No other column, cache or token changes.
+    """
+    result = session.execute(
+        update(Users).where(Users.username == username, Users.password == old_hash).values(password=new_hash)
+    )
+    session.commit()
+    return result.rowcount > 0
+
 # --- CRUD operations for Teams ---
 
 def create_team_in_db(session: Session, db_team_data: Teams):    
     session.add(db_team_data)
     try:
         session.commit()
-        session.refresh(db_team_data)
+        bump_table_version(Teams.__tablename__)
         return db_team_data
     except IntegrityError:
         session.rollback()
@@ -81,46 +298,53 @@ def get_team_by_name_from_db(session: Session, team_name: str) -> Teams | None:
     return session.exec(statement).first()
 
 def update_team_in_db(session: Session, team_update_data: TeamUpdate) -> Teams | None:
-    statement = select(Teams).where(Teams.name == team_update_data.name)
-    db_team = session.exec(statement).first()
-    if not db_team:
-        raise ValueError(f"Team with name {team_update_data.name} not found")
-
-    db_team.description = team_update_data.description
-
+    """Set the team's description; returns None when it already had that description."""
     try:
-        session.commit()
-        session.refresh(db_team)
-        return db_team
+        db_team = _update_returning(
+            session, Teams,
+            [Teams.name == team_update_data.name, Teams.description.is_distinct_from(team_update_data.description)],
+            {"description": team_update_data.description},
+        )
+        if db_team:
+            session.commit()
+            bump_table_version(Teams.__tablename__)
+            return db_team
+        session.rollback()
     except Exception as e:
         session.rollback()
         raise e 
 
+    # Only the no-op path pays for telling "unchanged" apart from "missing"
+    if get_team_by_name_from_db(session, team_update_data.name) is None:
+        raise ValueError(f"Team with name {team_update_data.name} not found")
+    return None
+
 def delete_team_from_db(session: Session, team_name: str):
-    statement = select(Teams).where(Teams.name == team_name)
-    db_team = session.exec(statement).first()
-    if not db_team:
-        raise ValueError(f"Team with name {team_name} not found")
-    
     try:
-        session.delete(db_team)
+        db_team = _delete_returning(session, Teams, [Teams.name == team_name])
+        if not db_team:
+            raise ValueError(f"Team with name {team_name} not found")
         session.commit()
-    except IntegrityError as e:
+    except Exception as e:
         session.rollback()
         raise e
     
+    bump_table_version(Teams.__tablename__)
     return db_team
 
-def get_team_list_from_db(session: Session):
-    statement = select(Teams)
-    return session.exec(statement).all()
+def get_team_list_from_db(session: Session, limit: int | None = None, after: tuple | None = None):
+    statement = select(Teams).order_by(Teams.id) # type: ignore
+    if after is not None:
+        statement = statement.where(Teams.id > after[0])
+    return session.exec(statement.limit(limit)).all()
 
 def create_role_in_db(session: Session, role_data: RoleCreate) -> Roles:
     role = Roles(name=role_data.name, description=role_data.description)
     session.add(role)
     try:
         session.commit()
-        session.refresh(role)
+        invalidate_role(role.id)
+        bump_table_version(Roles.__tablename__)
         return role
     except IntegrityError:
         session.rollback()
@@ -133,22 +357,24 @@ def get_role_by_name_from_db(session: Session, name: str) -> Roles | None:
     statement = select(Roles).where(Roles.name == name)
     return session.exec(statement).first()
 
-def get_all_roles(session: Session) -> list[Roles] | None:
-    statement = select(Roles)
-    return list(session.exec(statement).all())
+def get_role_from_db(session: Session, role_id: int) -> Roles | None:
+    return session.get(Roles, role_id)
+
+def get_all_roles(session: Session, limit: int | None = None, after: tuple | None = None) -> list[Roles] | None:
+    statement = select(Roles).order_by(Roles.id) # type: ignore
+    if after is not None:
+        statement = statement.where(Roles.id > after[0])
+    return list(session.exec(statement.limit(limit)).all())
 
 def update_role_in_db(session: Session, role_id: int, update_data: dict) -> Roles | None:
-    role = session.get(Roles, role_id)
-    if not role:
-        raise ValueError(f"Role with ID {role_id} not found")
- 
-    for key, value in update_data.items():
-         if hasattr(role, key):
-             setattr(role, key, value)
-    
+    values = _model_columns(Roles, update_data)
     try:
+         role = _update_returning(session, Roles, [Roles.id == role_id], values) if values else session.get(Roles, role_id)
+         if not role:
+             raise ValueError(f"Role with ID {role_id} not found")
          session.commit()
-         session.refresh(role)
+         invalidate_role(role_id)
+         bump_table_version(Roles.__tablename__)
          return role
     except IntegrityError:
          session.rollback()
@@ -158,13 +384,13 @@ def update_role_in_db(session: Session, role_id: int, update_data: dict) -> Role
          raise
 
 def delete_role_from_db(session: Session, role_id: int) -> str:
-    role = session.get(Roles, role_id)
-    if not role:
-        raise ValueError(f"Role with ID {role_id} not found")
-    
     try:
-        session.delete(role)
+        role = _delete_returning(session, Roles, [Roles.id == role_id])
+        if not role:
+            raise ValueError(f"Role with ID {role_id} not found")
         session.commit()
+        invalidate_role(role_id)
+        bump_table_version(Roles.__tablename__)
         return f"Role with ID {role_id} deleted successfully"
     except IntegrityError:
         session.rollback()
@@ -174,52 +400,93 @@ def delete_role_from_db(session: Session, role_id: int) -> str:
         raise
 
 def create_role_permission_in_db(session: Session, role_permission_data: RolePermissionCreate) -> RolePermissions:
-    # Verify the role exists
-    role = session.get(Roles, role_permission_data.role_id)
-    if not role:
-        raise ValueError(f"Role with ID {role_permission_data.role_id} not found")
-
-    # Check for duplicate permission entry
-    stmt = select(RolePermissions).where(
-        RolePermissions.role_id == role_permission_data.role_id,
-        RolePermissions.permission == role_permission_data.permission
-    )
-    existing_permission = session.exec(stmt).first()
-    if existing_permission:
-        raise ValueError(
-            f"Role permission with Role ID {role_permission_data.role_id} and Permission {role_permission_data.permission} already exists"
-        )
+    role_id, permission = role_permission_data.role_id, role_permission_data.permission
+    duplicate = ValueError(f"Role permission with Role ID {role_id} and Permission {permission} already exists")
+    missing_role = ValueError(f"Role with ID {role_id} not found")
+    values = {"role_id": role_id, "permission": permission}
 
-    role_permission_db = RolePermissions(**role_permission_data.model_dump())
-    session.add(role_permission_db)
+    dialect = session.get_bind().dialect.name
     try:
+        if dialect in ("sqlite", "postgresql"):
+            # Duplicates insert nothing; a missing role still fails the foreign key
+            dialect_insert = sqlite.insert if dialect == "sqlite" else postgresql.insert
+            statement = dialect_insert(RolePermissions).values(**values).on_conflict_do_nothing().returning(RolePermissions.role_id)
+            if session.execute(statement).first() is None:
+                raise duplicate
+        else:
+            session.execute(insert(RolePermissions).values(**values))
         session.commit()
-        session.refresh(role_permission_db)
-        return role_permission_db
+    except IntegrityError:
+        session.rollback()
+        if dialect in ("sqlite", "postgresql") or session.get(Roles, role_id) is None:
+            raise missing_role
+        raise duplicate
     except Exception:
         session.rollback()
         raise
 
+    invalidate_role(role_id)
+    bump_table_version(RolePermissions.__tablename__)
+    return RolePermissions(role_id=role_id, permission=permission)
+
 def delete_role_permission_from_db(session: Session, role_id: int, permission: str) -> None:
-    stmt = select(RolePermissions).where(
-        RolePermissions.role_id == role_id,
-        RolePermissions.permission == permission
-    )
-    role_permission_in_db = session.exec(stmt).first()
-    if not role_permission_in_db:
-        raise ValueError(
-            f"Role permission {permission} for Role ID {role_id} not found"
-        )
     try:
-        session.delete(role_permission_in_db)
+        role_permission_in_db = _delete_returning(session, RolePermissions, [
+            RolePermissions.role_id == role_id,
+            RolePermissions.permission == permission
+        ])
+        if not role_permission_in_db:
+            raise ValueError(
+                f"Role permission {permission} for Role ID {role_id} not found"
+            )
         session.commit()
+        invalidate_role(role_id)
+        bump_table_version(RolePermissions.__tablename__)
     except Exception:
         session.rollback()
         raise
 
-def get_all_role_permissions(session: Session) -> list[RolePermissions]:
-    stmt = select(RolePermissions)
-    return list(session.exec(stmt).all())  # Explicitly convert to list
+def replace_role_permissions_in_db(session: Session, role_id: int, permissions: set[UserAction]) -> list[RolePermissions]:
+    """Make the role's permission set exactly ``permissions`` in one transaction."""
+    if session.get(Roles, role_id) is None:
+        raise ValueError(f"Role with ID {role_id} not found")
+
+    current = set(session.exec(select(RolePermissions.permission).where(RolePermissions.role_id == role_id)).all())
+    to_remove = current - permissions
+    to_add = permissions - current
+    try:
+        if to_remove:
+            session.execute(delete(RolePermissions).where(
+                RolePermissions.role_id == role_id, RolePermissions.permission.in_(to_remove) # type: ignore
+            ))
+        if to_add:
+            session.execute(insert(RolePermissions), [{"role_id": role_id, "permission": permission} for permission in to_add])
+        if to_remove or to_add:
+            session.commit()
+            invalidate_role(role_id)
+            bump_table_version(RolePermissions.__tablename__)
+    except IntegrityError:
+        session.rollback()
+        # The role was deleted or another request changed its permissions since the reads above
+        if session.get(Roles, role_id) is None:
+            raise ValueError(f"Role with ID {role_id} not found")
+        raise
+    except Exception:
+        session.rollback()
+        raise
+
+    return [RolePermissions(role_id=role_id, permission=permission) for permission in sorted(permissions, key=lambda p: p.value)]
+
+def get_all_role_permissions(session: Session, limit: int | None = None, after: tuple | None = None) -> list[RolePermissions]:
+    # Walks the (role_id, permission) primary key in order
+    stmt = select(RolePermissions).order_by(RolePermissions.role_id, RolePermissions.permission) # type: ignore
+    if after is not None:
+        after_role_id, after_permission = after
+        stmt = stmt.where(or_(
+            RolePermissions.role_id > after_role_id,
+            and_(RolePermissions.role_id == after_role_id, RolePermissions.permission > after_permission),
+        ))
+    return list(session.exec(stmt.limit(limit)).all())  # Explicitly convert to list
 
 def get_role_permissions_by_role(session: Session, role_id: int) -> list[RolePermissions]:
     stmt = select(RolePermissions).where(RolePermissions.role_id == role_id)
@@ -1,7 +1,158 @@
+import hashlib
+import hmac
+import itertools
+import math
+import time
+from contextlib import asynccontextmanager
+from typing import Any, Callable, TypeVar
+from fastapi import Request, Response
+from sqlalchemy.engine import Engine
+from sqlalchemy.ext.asyncio import AsyncEngine
 from sqlmodel import Session
-from src.models import create_db_connection
+from sqlmodel.ext.asyncio.session import AsyncSession
+from src.cache import recent_writers, tables_written_within
+from src.metrics import metrics
+from src.settings import get_settings
 
-def get_session():
-    engine = create_db_connection()
-    with Session(engine) as session:
-        yield session
\ No newline at end of file
+T = TypeVar("T")
+
+def get_engine(request: Request) -> Engine:
+    # Created once per process by the lifespan handler in src.main
+    return request.app.state.engine
+
+def get_session(request: Request):
+    # db_queries write paths don't re-select after commit, so keep objects loaded
+    with Session(get_engine(request), expire_on_commit=False) as session:
+        yield session
+
+async def get_async_session(request: Request):
+    # Objects stay loaded after commit so responses can be built outside the greenlet
+    async with AsyncSession(request.app.state.async_engine, expire_on_commit=False) as session:
+        yield session
+
+# Requests with these methods never write, so their principal is not marked as a writer
+SAFE_METHODS = ("GET", "HEAD", "OPTIONS")
+
+_read_counter = itertools.count()
+
+# Carries the caller's last write time to whichever worker serves their next read
+LAST_WRITE_COOKIE = "last_write"
+
+def _last_write_signature(principal: str, written_at: str) -> str:
+    # Imported here because src.auth depends on this module
+    from src.auth import SECRET_KEY
+
+    key = (get_settings().refresh_token_key or SECRET_KEY).encode()
+    return hmac.new(key, f"last-write|{principal}|{written_at}".encode(), hashlib.sha256).hexdigest()
+
+def _wrote_recently(request: Request, principal: str) -> bool:
+    if recent_writers.get(principal) is not None:
+        return True
+    # Another worker may have handled the write; trust its signed cookie
+    written_at, _, signature = request.cookies.get(LAST_WRITE_COOKIE, "").rpartition(".")
+    if not signature or not hmac.compare_digest(signature, _last_write_signature(principal, written_at)):
+        return False
+    try:
+        return time.time() - float(written_at) < recent_writers.ttl
+    except ValueError:
+        return False
+
+def _read_replica_index(request: Request, tables: tuple[str, ...]) -> int | None:
+    # None sends the read to the primary
+    replicas = request.app.state.read_engines
+    if not replicas:
+        return None
+    principal = getattr(request.state, "principal", None)
+    if principal is not None and _wrote_recently(request, principal):
+        return None
+    # A replica may not have caught up with a write this process made moments ago
+    if tables and tables_written_within(recent_writers.ttl, *tables):
+        return None
+    return next(_read_counter) % len(replicas)
+
+def pick_engine(request: Request, read_only: bool = False, tables: tuple[str, ...] = ()) -> Engine | AsyncEngine:
+    """The engine for this request in the current DATABASE_MODE.
+
+    Reads go round-robin to the DATABASE_READ_URLS replicas, except while
+    the caller is inside its read-your-writes window or one of ``tables``
+    was written within it; everything else uses the primary. The caller's
+    window follows them across workers through the signed last-write
+    cookie; the ``tables`` window only sees writes made by this process.
+    """
+    index = _read_replica_index(request, tables) if read_only else None
+    if request.app.state.async_engine is not None:
+        return request.app.state.async_engine if index is None else request.app.state.async_read_engines[index]
+    return get_engine(request) if index is None else request.app.state.read_engines[index]
+
+@asynccontextmanager
+async def open_session(request: Request, read_only: bool = False, tables: tuple[str, ...] = ()):
+    async with session_scope(pick_engine(request, read_only, tables)) as session:
+        yield session
+
+@asynccontextmanager
+async def session_scope(engine: Engine | AsyncEngine):
+    # For work outside a request's dependencies, e.g. background tasks
+    sync_engine = engine.sync_engine if isinstance(engine, AsyncEngine) else engine
+    histogram = metrics.checkout_histogram(sync_engine)
+    if isinstance(engine, AsyncEngine):
+        async with AsyncSession(engine, expire_on_commit=False) as session:
+            if histogram is not None:
+                # Check the connection out up front so the pool wait can be timed
+                started = time.perf_counter()
+                await session.connection()
+                histogram.observe(time.perf_counter() - started)
+            yield session
+    else:
+        with Session(engine, expire_on_commit=False) as session:
+            if histogram is not None:
+                started = time.perf_counter()
+                session.connection()
+                histogram.observe(time.perf_counter() - started)
+            yield session
+
+def mark_write(request: Request) -> None:
+    principal = getattr(request.state, "principal", None)
+    if principal is not None:
+        recent_writers.set(principal, True)
+
+def set_last_write_cookie(request: Request, response: Response) -> None:
+    principal = getattr(request.state, "principal", None)
+    window = recent_writers.ttl
+    if principal is None or window <= 0:
+        return
+    written_at = f"{time.time():.3f}"
+    response.set_cookie(
+        LAST_WRITE_COOKIE, f"{written_at}.{_last_write_signature(principal, written_at)}",
+        max_age=math.ceil(window), httponly=True, samesite="lax",
+    )
+
+async def get_db(request: Request, response: Response):
+    # Picks the data-access path chosen by DATABASE_MODE at startup; always the primary
+    write = request.method not in SAFE_METHODS
+    if write:
+        mark_write(request)
+        # Headers must be set before the handler runs; the in-process mark below covers the write's end
+        set_last_write_cookie(request, response)
+    try:
+        async with open_session(request) as session:
+            yield session
+    finally:
+        # The window runs from the end of the write as well as its start
+        if write:
+            mark_write(request)
+
+async def get_read_db(request: Request):
+    # For GET handlers: a replica when one is configured and safe to read from.
+    # conditional_get records the tables the listing reads in request.state.
+    async with open_session(request, read_only=True, tables=getattr(request.state, "read_tables", ())) as session:
+        yield session
+
+async def run_query(session: Session | AsyncSession, query: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+    """Run a db_queries function on either session type.
+
+    On an AsyncSession the function runs through ``run_sync`` on the async
+    driver, so the event loop is free while the database works.
+    """
+    if isinstance(session, AsyncSession):
+        return await session.run_sync(query, *args, **kwargs)
+    return query(session, *args, **kwargs)
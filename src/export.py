@@ -0,0 +1,63 @@
+import csv
+import io
+import json
+from datetime import datetime
+from typing import AsyncIterator, Iterator
+from sqlalchemy import Select
+from sqlalchemy.engine import Engine, RowMapping
+from sqlalchemy.ext.asyncio import AsyncEngine
+from sqlmodel import Session
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+EXPORT_FORMATS = {
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv",
+}
+
+def _plain(value):
+    return value.isoformat() if isinstance(value, datetime) else value
+
+class RowEncoder:
+    """Turns result rows into NDJSON or CSV bytes, one partition at a time."""
+
+    def __init__(self, fmt: str, columns: list[str]):
+        self.fmt = fmt
+        self.columns = columns
+        self._buffer = io.StringIO()
+        self._writer = csv.writer(self._buffer, lineterminator="\n")
+
+    def _drain(self) -> bytes:
+        data = self._buffer.getvalue().encode()
+        self._buffer.seek(0)
+        self._buffer.truncate()
+        return data
+
+    def header(self) -> bytes:
+        if self.fmt != "csv":
+            return b""
+        self._writer.writerow(self.columns)
+        return self._drain()
+
+    def encode(self, rows: list[RowMapping]) -> bytes:
+        if self.fmt == "csv":
+            self._writer.writerows([_plain(row[column]) for column in self.columns] for row in rows)
+            return self._drain()
+        return "".join(
+            json.dumps({column: _plain(row[column]) for column in self.columns}, separators=(",", ":")) + "\n"
+            for row in rows
+        ).encode()
+
+def stream_rows(engine: Engine, statement: Select, encoder: RowEncoder) -> Iterator[bytes]:
+    # The session lives inside the generator so it stays open for the whole response
+    with Session(engine) as session:
+        result = session.execute(statement).mappings()
+        yield encoder.header()
+        for partition in result.partitions():
+            yield encoder.encode(partition)
+
+async def stream_rows_async(engine: AsyncEngine, statement: Select, encoder: RowEncoder) -> AsyncIterator[bytes]:
+    async with AsyncSession(engine) as session:
+        result = await session.stream(statement)
+        yield encoder.header()
+        async for partition in result.mappings().partitions():
+            yield encoder.encode(partition)
@@ -1,27 +1,160 @@
-from fastapi import FastAPI
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
 from fastapi.middleware.cors import CORSMiddleware
-from src.routers import users, auth
-from dotenv import load_dotenv
-import os
+from sqlalchemy.exc import SQLAlchemyError
+from sqlmodel import Session
+from src.routers import users, auth, admin, requisitions, metrics as metrics_router
+from src.auth import warm_auth_caches
+from src.db_queries.tokens import purge_expired_refresh_tokens_in_db
+from src.cache import configure_caches, recent_writers, response_cache
+from src.metrics import MetricsMiddleware, metrics
+from src.profiling import ProfilerMiddleware
+from src.query_stats import QueryStatsMiddleware, instrument_queries
+from src.models import (
+    create_db_connection, create_async_db_connection, create_read_db_connections, create_async_read_db_connections,
+    get_database_mode, sqlite_maintenance, sqlite_profile_pragmas,
+)
+from src.passwords import password_hasher, PasswordHasherBusy
+from src.settings import get_settings
+from src.throttle import LoginThrottled, login_throttle, retry_after_header
+
+logger = logging.getLogger(__name__)
+
+async def run_sqlite_maintenance(engine, interval: float):
+    # Checkpoints keep the WAL from growing between idle periods; runs off the event loop
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            busy, frames, checkpointed = await asyncio.to_thread(sqlite_maintenance, engine)
+        except SQLAlchemyError as e:
+            logger.warning(f"SQLite maintenance failed: {e}")
+            continue
+        except Exception:
+            # Anything else would end the task for the life of the process
+            logger.exception("SQLite maintenance failed unexpectedly")
+            continue
+        if busy or checkpointed < frames:
+            logger.info(f"WAL checkpoint copied {checkpointed} of {frames} frames, retrying next run")
+
+def purge_refresh_tokens(engine) -> int:
+    with Session(engine) as session:
+        return purge_expired_refresh_tokens_in_db(session)
+
+async def run_refresh_token_purge(engine, interval: float):
+    # Every login inserts a refresh token; expired ones are dropped here, off the event loop
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            purged = await asyncio.to_thread(purge_refresh_tokens, engine)
+        except Exception:
+            logger.exception("Refresh token purge failed")
+            continue
+        if purged:
+            logger.info(f"Purged {purged} expired refresh tokens")
+
+async def _cancel(task: asyncio.Task | None) -> None:
+    if task is None:
+        return
+    task.cancel()
+    try:
+        await task
+    except asyncio.CancelledError:
+        pass
 
-# Load environment variables from .env file
-load_dotenv()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Settings (and .env) are read here, not when the module is imported
+    settings = get_settings()
+    configure_caches(settings)
+    password_hasher.configure(settings)
+    login_throttle.configure(settings)
+    # One pooled engine per process, shared by every request
+    app.state.engine = create_db_connection()
+    app.state.async_engine = create_async_db_connection() if get_database_mode() == "async" else None
+    # Optional DATABASE_READ_URLS replicas for GET handlers and principal lookups
+    app.state.read_engines = create_read_db_connections()
+    app.state.async_read_engines = create_async_read_db_connections() if app.state.async_engine is not None else []
+    if settings.metrics_enabled:
+        metrics.instrument_engine("sync", app.state.engine)
+        if app.state.async_engine is not None:
+            metrics.instrument_engine("async", app.state.async_engine.sync_engine)
+        for index, engine in enumerate(app.state.read_engines):
+            metrics.instrument_engine(f"read{index}", engine)
+        for index, engine in enumerate(app.state.async_read_engines):
+            metrics.instrument_engine(f"async_read{index}", engine.sync_engine)
+    if settings.query_stats_enabled:
+        for engine in (app.state.engine, *app.state.read_engines):
+            instrument_queries(engine)
+        for engine in filter(None, (app.state.async_engine, *app.state.async_read_engines)):
+            instrument_queries(engine.sync_engine)
+    password_hasher.start()
+    # Nothing cached by an earlier app instance in this process can be trusted
+    response_cache.clear()
+    recent_writers.clear()
+    try:
+        with Session(app.state.engine) as session:
+            warm_auth_caches(session)
+    except SQLAlchemyError as e:
+        logger.warning(f"Could not warm auth caches: {e}")
+    maintenance = None
+    # Checkpointing only means something in WAL mode, which the SQLITE_PROFILE decides
+    wal = sqlite_profile_pragmas(settings.sqlite_profile).get("journal_mode") == "WAL"
+    if app.state.engine.dialect.name == "sqlite" and wal and settings.sqlite_maintenance_interval > 0:
+        maintenance = asyncio.create_task(run_sqlite_maintenance(app.state.engine, settings.sqlite_maintenance_interval))
+    token_purge = None
+    if settings.refresh_token_purge_interval > 0:
+        token_purge = asyncio.create_task(run_refresh_token_purge(app.state.engine, settings.refresh_token_purge_interval))
+    try:
+        yield
+    finally:
+        await _cancel(maintenance)
+        await _cancel(token_purge)
+        password_hasher.shutdown()
+        for async_engine in filter(None, (app.state.async_engine, *app.state.async_read_engines)):
+            await async_engine.dispose()
+        for engine in (app.state.engine, *app.state.read_engines):
+            engine.dispose()
 
-# Get allowed origins from the .env file
-allow_origins = os.getenv("ALLOW_ORIGINS", "").split(",")
+app = FastAPI(lifespan=lifespan)
 
-app = FastAPI()
+@app.exception_handler(PasswordHasherBusy)
+async def password_hasher_busy_handler(request: Request, exc: PasswordHasherBusy):
+    return JSONResponse(status_code=503, content={"detail": str(exc)}, headers={"Retry-After": "1"})
+
+@app.exception_handler(LoginThrottled)
+async def login_throttled_handler(request: Request, exc: LoginThrottled):
+    return JSONResponse(status_code=429, content={"detail": str(exc)}, headers={"Retry-After": retry_after_header(exc.retry_after)})
+
+class SettingsCORSMiddleware(CORSMiddleware):
+    # Starlette builds the middleware stack at startup, so ALLOW_ORIGINS is read then
+    def __init__(self, app):
+        super().__init__(
+            app,
+            allow_origins=get_settings().allow_origins,
+            allow_credentials=True,
+            allow_methods=["*"],  # Allow all methods
+            allow_headers=["*"],  # Allow all headers
+        )
 
 # Add CORS middleware
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=allow_origins,  # Dynamically loaded origins
-    allow_credentials=True,
-    allow_methods=["*"],  # Allow all methods
-    allow_headers=["*"],  # Allow all headers
-)
+app.add_middleware(SettingsCORSMiddleware)
+
+# Idle unless PROFILE_SAMPLE_RATE or PROFILE_SECRET is set
+app.add_middleware(ProfilerMiddleware)
+
+# METRICS_ENABLED=false makes the middleware a pass-through and /metrics a 404
+app.add_middleware(MetricsMiddleware)
+app.include_router(metrics_router.router)
+
+# QUERY_STATS_ENABLED=false stops counting statements and the Server-Timing header
+app.add_middleware(QueryStatsMiddleware)
 
 app.include_router(users.router)
 app.include_router(auth.router)
+app.include_router(admin.router)
+app.include_router(requisitions.router)
 
 
@@ -0,0 +1,207 @@
+import bisect
+import time
+from typing import Iterable
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.pool import QueuePool
+from src.settings import get_settings
+
+# Upper bounds in seconds; one extra slot counts everything above the last bound
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+WAIT_BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0)
+
+def metrics_enabled() -> bool:
+    return get_settings().metrics_enabled
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _labels(**labels: str) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in labels.items()) + "}"
+
+class Histogram:
+    """Fixed-bucket histogram; observing is a bisect and three additions.
+
+    Updates take no lock. They happen on the event loop, so a scrape may
+    at worst see a count that is one observation ahead of the sum.
+    """
+    __slots__ = ("buckets", "counts", "sum", "count")
+
+    def __init__(self, buckets: tuple[float, ...] = LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def render(self, name: str, **labels: str) -> Iterable[str]:
+        cumulative = 0
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            yield f"{name}_bucket{_labels(**labels, le=repr(bound))} {cumulative}"
+        yield f"{name}_bucket{_labels(**labels, le='+Inf')} {cumulative + self.counts[-1]}"
+        yield f"{name}_sum{_labels(**labels)} {self.sum}"
+        yield f"{name}_count{_labels(**labels)} {self.count}"
+
+class Metrics:
+    """Process-wide request, pool and password hashing metrics."""
+
+    def __init__(self):
+        # (method, route, status class) -> count
+        self.requests: dict[tuple[str, str, str], int] = {}
+        # (method, route) -> latency histogram, created on a route's first request
+        self.latency: dict[tuple[str, str], Histogram] = {}
+        self.in_flight = 0
+        self.password_hash_wait = Histogram(WAIT_BUCKETS)
+        self.pool_checkout: dict[str, Histogram] = {}
+        self.pool_checkouts: dict[str, int] = {}
+        self.pool_connects: dict[str, int] = {}
+        self._engines: dict[str, Engine] = {}
+        self._engine_names: dict[Engine, str] = {}
+
+    def observe_request(self, method: str, route: str, status: int, seconds: float) -> None:
+        key = (method, route, f"{status // 100}xx")
+        self.requests[key] = self.requests.get(key, 0) + 1
+        histogram = self.latency.get((method, route))
+        if histogram is None:
+            histogram = self.latency[(method, route)] = Histogram()
+        histogram.observe(seconds)
+
+    def instrument_engine(self, name: str, engine: Engine) -> None:
+        """Count checkouts and new connections on ``engine``'s pool and register its wait histogram.
+
+        Pools have no "before checkout" event, so the wait is timed on the
+        request side by ``session_scope`` through ``checkout_histogram``. The
+        pool events are listened to on the engine, so they follow the pool
+        when it is rebuilt, e.g. after ``engine.dispose()``.
+        """
+        self.pool_checkout[name] = Histogram(WAIT_BUCKETS)
+        self.pool_checkouts[name] = 0
+        self.pool_connects[name] = 0
+        self._engines[name] = engine
+        self._engine_names[engine] = name
+
+        def on_checkout(dbapi_connection, connection_record, connection_proxy):
+            self.pool_checkouts[name] += 1
+
+        def on_connect(dbapi_connection, connection_record):
+            self.pool_connects[name] += 1
+
+        event.listen(engine, "checkout", on_checkout)
+        event.listen(engine, "connect", on_connect)
+
+    def checkout_histogram(self, engine: Engine) -> Histogram | None:
+        name = self._engine_names.get(engine)
+        return None if name is None else self.pool_checkout[name]
+
+    def render(self) -> str:
+        from src.passwords import password_hasher
+        from src.throttle import login_throttle
+
+        lines = [
+            "# HELP http_requests_total Requests handled, by route template and status class.",
+            "# TYPE http_requests_total counter",
+        ]
+        for (method, route, status), count in list(self.requests.items()):
+            lines.append(f"http_requests_total{_labels(method=method, route=route, status=status)} {count}")
+
+        lines += [
+            "# HELP http_request_duration_seconds Time from receiving a request to sending its last byte.",
+            "# TYPE http_request_duration_seconds histogram",
+        ]
+        for (method, route), histogram in list(self.latency.items()):
+            lines.extend(histogram.render("http_request_duration_seconds", method=method, route=route))
+
+        lines += [
+            "# HELP http_requests_in_flight Requests currently being handled.",
+            "# TYPE http_requests_in_flight gauge",
+            f"http_requests_in_flight {self.in_flight}",
+            "# HELP db_pool_checkout_seconds Time spent waiting for a pooled database connection.",
+            "# TYPE db_pool_checkout_seconds histogram",
+        ]
+        for name, histogram in self.pool_checkout.items():
+            lines.extend(histogram.render("db_pool_checkout_seconds", engine=name))
+        lines += [
+            "# HELP db_pool_checkouts_total Connections checked out of the pool.",
+            "# TYPE db_pool_checkouts_total counter",
+            *(f"db_pool_checkouts_total{_labels(engine=name)} {count}" for name, count in self.pool_checkouts.items()),
+            "# HELP db_pool_connections_opened_total New database connections opened by the pool.",
+            "# TYPE db_pool_connections_opened_total counter",
+            *(f"db_pool_connections_opened_total{_labels(engine=name)} {count}" for name, count in self.pool_connects.items()),
+        ]
+
+        lines += [
+            "# HELP db_pool_checked_out Connections currently checked out of the pool.",
+            "# TYPE db_pool_checked_out gauge",
+        ]
+        sizes = []
+        for name, engine in self._engines.items():
+            pool = engine.pool
+            # Only queue pools have a size; in-memory SQLite uses a singleton pool
+            if isinstance(pool, QueuePool):
+                lines.append(f"db_pool_checked_out{_labels(engine=name)} {pool.checkedout()}")
+                sizes.append(f"db_pool_size{_labels(engine=name)} {pool.size()}")
+        lines += [
+            "# HELP db_pool_size Configured number of persistent connections in the pool.",
+            "# TYPE db_pool_size gauge",
+            *sizes,
+        ]
+
+        stats = password_hasher.stats()
+        lines += [
+            "# HELP password_hash_queue_seconds Time bcrypt operations waited for a worker slot.",
+            "# TYPE password_hash_queue_seconds histogram",
+            *self.password_hash_wait.render("password_hash_queue_seconds"),
+            "# HELP password_hash_queue_depth bcrypt operations waiting for a worker slot.",
+            "# TYPE password_hash_queue_depth gauge",
+            f"password_hash_queue_depth {stats['queue_depth']}",
+            "# HELP password_hash_in_flight bcrypt operations running.",
+            "# TYPE password_hash_in_flight gauge",
+            f"password_hash_in_flight {stats['in_flight']}",
+            "# HELP password_hash_rejected_total bcrypt operations rejected after the queue timeout.",
+            "# TYPE password_hash_rejected_total counter",
+            f"password_hash_rejected_total {stats['rejected']}",
+            "# HELP login_throttled_total Login attempts rejected before verification, by limiter key.",
+            "# TYPE login_throttled_total counter",
+        ]
+        for key, limiter_stats in login_throttle.stats().items():
+            lines.append(f"login_throttled_total{_labels(key=key)} {limiter_stats['rejected']}")
+        return "\n".join(lines) + "\n"
+
+metrics = Metrics()
+
+class MetricsMiddleware:
+    """Pure ASGI middleware, so streamed responses are timed to their last byte."""
+
+    def __init__(self, app):
+        self.app = app
+        self.enabled = metrics_enabled()
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self.enabled:
+            return await self.app(scope, receive, send)
+
+        status = 500
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        started = time.perf_counter()
+        metrics.in_flight += 1
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            metrics.in_flight -= 1
+            # The router stores the matched route in the scope; labelling by its
+            # template keeps one series per endpoint rather than per URL
+            route = scope.get("route")
+            metrics.observe_request(scope["method"], getattr(route, "path", "<unmatched>"), status,
+                                    time.perf_counter() - started)
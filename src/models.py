@@ -1,18 +1,13 @@
-import os
-from sqlmodel import SQLModel, Field, create_engine, Session, text, Column, Integer, ForeignKey
+from sqlmodel import SQLModel, Field, create_engine, Session, Column, Integer, ForeignKey
 from datetime import datetime
 from sqlmodel import create_engine
-import bcrypt
-from sqlalchemy import UniqueConstraint
+from sqlalchemy import UniqueConstraint, Index, DDL, event
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import create_async_engine
 from enum import Enum
-from dotenv import load_dotenv, find_dotenv  # Import dotenv
-
-# Load environment variables from .env file
-dotenv_path = find_dotenv()
-if not dotenv_path:
-    print("Warning: .env file is missing!")
-else:
-    load_dotenv(override=True)
+from typing import Literal
+from src.passwords import hash_password_sync
+from src.settings import get_settings
 
 class TeamBase(SQLModel):
     name: str = Field(sa_column_kwargs={"unique": True})
@@ -40,6 +35,8 @@ class UserAction(str, Enum):
     MANAGE_USER = "manage_user"
     MANAGE_TICKET = "manage_ticket"
     UPDATE_TICKET = "update_ticket"
+    CREATE_REQUISITION = "create_requisition"
+    APPROVE_REQUISITION = "approve_requisition"
 
 class RoleBase(SQLModel):
     name: str = Field(sa_column_kwargs={"unique": True})
@@ -76,13 +73,99 @@ class UserBase(SQLModel):
 class UserCreate(UserBase):
     password: str
 
+def _lower_username(context) -> str:
+    return context.get_current_parameters()["username"].lower()
+
 class Users(UserCreate, table=True):
     id: int | None = Field(default=None, primary_key=True)
+    # Case-folded copy of username so prefix search is an index range scan
+    username_lower: str = Field(sa_column_kwargs={"default": _lower_username})
     is_active: bool
     created_at: datetime
     updated_at: datetime
 
-    __table_args__ = (UniqueConstraint("username", "email", name="uix_username_email"),)
+    __table_args__ = (
+        UniqueConstraint("username", "email", name="uix_username_email"),
+        Index("ix_users_username_lower_username", "username_lower", "username"),
+    )
+
+# SQLite FTS5 index over the searchable user columns. It is an external-content
+# table, so it stores only the index, and triggers keep it in step with users.
+USERS_FTS_DDL = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS users_fts USING fts5("
+    "username, first_name, last_name, email, content='users', content_rowid='id')",
+    "CREATE TRIGGER IF NOT EXISTS users_fts_ai AFTER INSERT ON users BEGIN "
+    "INSERT INTO users_fts(rowid, username, first_name, last_name, email) "
+    "VALUES (new.id, new.username, new.first_name, new.last_name, new.email); END",
+    "CREATE TRIGGER IF NOT EXISTS users_fts_ad AFTER DELETE ON users BEGIN "
+    "INSERT INTO users_fts(users_fts, rowid, username, first_name, last_name, email) "
+    "VALUES ('delete', old.id, old.username, old.first_name, old.last_name, old.email); END",
+    "CREATE TRIGGER IF NOT EXISTS users_fts_au AFTER UPDATE ON users BEGIN "
+    "INSERT INTO users_fts(users_fts, rowid, username, first_name, last_name, email) "
+    "VALUES ('delete', old.id, old.username, old.first_name, old.last_name, old.email); "
+    "INSERT INTO users_fts(rowid, username, first_name, last_name, email) "
+    "VALUES (new.id, new.username, new.first_name, new.last_name, new.email); END",
+]
+
+for _statement in USERS_FTS_DDL:
+    event.listen(Users.__table__, "after_create", DDL(_statement).execute_if(dialect="sqlite"))
+event.listen(Users.__table__, "before_drop", DDL("DROP TABLE IF EXISTS users_fts").execute_if(dialect="sqlite"))
+
+class RefreshTokens(SQLModel, table=True):
+    id: int | None = Field(default=None, primary_key=True)
+    # Keyed HMAC of the opaque token; the token itself is only ever held by the client
+    token_hash: str = Field(sa_column_kwargs={"unique": True})
+    # Every rotation of one login shares a family, so reuse of a rotated token can revoke them all
+    family_id: str = Field(index=True)
+    user_id: int = Field(sa_column=Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False, index=True))
+    created_at: datetime
+    expires_at: datetime
+    revoked_at: datetime | None = None
+
+class RequisitionStatus(str, Enum):
+    PENDING = "pending"
+    APPROVED = "approved"
+    REJECTED = "rejected"
+
+class RequisitionBase(SQLModel):
+    title: str
+    description: str | None = None
+    # Minor currency units, so totals never pick up float rounding
+    amount_cents: int = Field(ge=0)
+
+class RequisitionCreate(RequisitionBase):
+    pass
+
+class Requisitions(RequisitionBase, table=True):
+    id: int | None = Field(default=None, primary_key=True)
+    team_id: int = Field(sa_column=Column(Integer, ForeignKey("teams.id", ondelete="RESTRICT"), nullable=False))
+    requester_id: int | None = Field(default=None, sa_column=Column(Integer, ForeignKey("users.id", ondelete="SET NULL")))
+    status: RequisitionStatus = RequisitionStatus.PENDING
+    decided_by: int | None = Field(default=None, sa_column=Column(Integer, ForeignKey("users.id", ondelete="SET NULL")))
+    decided_at: datetime | None = None
+    created_at: datetime
+    updated_at: datetime
+
+    __table_args__ = (
+        # Approver queues are one range scan: equality on status and team, already in
+        # (created_at, id) order. id is the keyset tie-breaker for equal timestamps.
+        Index("ix_requisitions_status_team_id_created_at", "status", "team_id", "created_at", "id"),
+        Index("ix_requisitions_requester_id_created_at", "requester_id", "created_at", "id"),
+    )
+
+class RequisitionInfo(RequisitionBase):
+    id: int
+    team_id: int
+    requester_id: int | None
+    status: RequisitionStatus
+    decided_by: int | None
+    decided_at: datetime | None
+    created_at: datetime
+    updated_at: datetime
+
+class RequisitionDecision(SQLModel):
+    ids: list[int] = Field(min_length=1)
+    status: Literal[RequisitionStatus.APPROVED, RequisitionStatus.REJECTED] = RequisitionStatus.APPROVED
 
 class UserInfo(UserBase):
     id: int
@@ -99,15 +182,126 @@ class UserUpdate(SQLModel):
     is_active: bool | None = None
     team_id: int | None = None
 
-def create_db_connection():
-    # Load DATABASE_URL from .env file, default to sqlite if not set
-    db_url = os.getenv("DATABASE_URL") or "sqlite:///./eoffice.db"
-    engine = create_engine(db_url, echo=False, connect_args={"check_same_thread": False})
+def _pool_options(db_url: str) -> dict:
+    # In-memory SQLite uses a single-connection pool that takes no sizing options
+    url = make_url(db_url)
+    if url.get_backend_name() == "sqlite" and url.database in (None, "", ":memory:"):
+        return {}
+
+    settings = get_settings()
+    return {
+        "pool_size": settings.db_pool_size,
+        "max_overflow": settings.db_max_overflow,
+        "pool_recycle": settings.db_pool_recycle,
+        "pool_pre_ping": settings.db_pool_pre_ping,
+    }
+
+# Named sets of PRAGMAs applied to every pooled SQLite connection, chosen by SQLITE_PROFILE.
+# "default" keeps the library defaults: rollback journal and a full fsync on every commit.
+SQLITE_PROFILES: dict[str, dict[str, str | int]] = {
+    "default": {},
+    # Readers no longer block the writer, and commits only fsync at checkpoints
+    "wal": {"journal_mode": "WAL", "synchronous": "NORMAL", "busy_timeout": 5000},
+    "performance": {
+        "journal_mode": "WAL",
+        "synchronous": "NORMAL",
+        "busy_timeout": 5000,
+        "mmap_size": 256 * 1024 * 1024,
+        # Negative means KiB, so 64 MiB of page cache per connection
+        "cache_size": -64 * 1024,
+        "temp_store": "MEMORY",
+    },
+}
+
+def sqlite_profile_pragmas(name: str) -> dict[str, str | int]:
+    if name not in SQLITE_PROFILES:
+        raise ValueError(f"Invalid SQLITE_PROFILE {name!r}, expected one of {', '.join(SQLITE_PROFILES)}")
+    return SQLITE_PROFILES[name]
+
+def apply_sqlite_profile(engine, name: str, read_only: bool = False) -> None:
+    """Run the profile's PRAGMAs on each new DBAPI connection the pool opens.
+
+    ``read_only`` connections (replicas) also get ``query_only``, so a write
+    that reaches one fails instead of diverging from the primary.
+    """
+    pragmas = sqlite_profile_pragmas(name)
+
+    def set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA foreign_keys=ON")
+        for pragma, value in pragmas.items():
+            cursor.execute(f"PRAGMA {pragma}={value}")
+        if read_only:
+            cursor.execute("PRAGMA query_only=ON")
+        cursor.close()
+
+    event.listen(engine, "connect", set_pragmas)
+
+def sqlite_maintenance(engine) -> tuple[int, int, int]:
+    """Fold the WAL back into the database file and refresh planner statistics.
+
+    Returns the ``wal_checkpoint`` result: (busy, WAL frames, frames checkpointed).
+    Outside WAL mode the checkpoint is a no-op.
+    """
     with engine.connect() as connection:
-            connection.execute(text("PRAGMA foreign_keys=ON"))
-    
+        # PASSIVE never waits on readers or writers; what it cannot copy is left for the next run
+        result = tuple(connection.exec_driver_sql("PRAGMA wal_checkpoint(PASSIVE)").one())
+        connection.exec_driver_sql("PRAGMA optimize")
+    return result
+
+def _create_engine(db_url: str, read_only: bool = False):
+    connect_args = {}
+    if make_url(db_url).get_backend_name() == "sqlite":
+        connect_args["check_same_thread"] = False
+
+    engine = create_engine(db_url, echo=False, connect_args=connect_args, **_pool_options(db_url))
+    if engine.dialect.name == "sqlite":
+        apply_sqlite_profile(engine, get_settings().sqlite_profile, read_only=read_only)
     return engine
 
+def create_db_connection():
+    # DATABASE_URL from the environment or .env, default to sqlite if not set
+    return _create_engine(get_settings().database_url)
+
+def create_read_db_connections() -> list:
+    # One engine per DATABASE_READ_URLS entry; empty when reads go to the primary
+    return [_create_engine(url, read_only=True) for url in get_settings().database_read_urls]
+
+def get_database_mode() -> str:
+    # "async" runs queries on an AsyncEngine, "sync" keeps the blocking Session path
+    mode = get_settings().database_mode
+    if mode not in ("sync", "async"):
+        raise ValueError(f"Invalid DATABASE_MODE {mode!r}, expected 'sync' or 'async'")
+    return mode
+
+def _async_database_url(db_url: str, async_url: str | None = None) -> str:
+    if async_url:
+        return async_url
+
+    url = make_url(db_url)
+    if url.get_backend_name() != "sqlite":
+        raise ValueError("DATABASE_ASYNC_URL and DATABASE_ASYNC_READ_URLS must be set for non-SQLite databases")
+    return url.set(drivername="sqlite+aiosqlite").render_as_string(hide_password=False)
+
+def _create_async_engine(async_url: str, read_only: bool = False):
+    engine = create_async_engine(async_url, echo=False, **_pool_options(async_url))
+    if engine.dialect.name == "sqlite":
+        apply_sqlite_profile(engine.sync_engine, get_settings().sqlite_profile, read_only=read_only)
+    return engine
+
+def create_async_db_connection():
+    settings = get_settings()
+    return _create_async_engine(_async_database_url(settings.database_url, settings.database_async_url))
+
+def create_async_read_db_connections() -> list:
+    settings = get_settings()
+    # DATABASE_ASYNC_READ_URLS pairs up with DATABASE_READ_URLS by position
+    async_urls = settings.database_async_read_urls
+    return [
+        _create_async_engine(_async_database_url(url, async_urls[i] if i < len(async_urls) else None), read_only=True)
+        for i, url in enumerate(settings.database_read_urls)
+    ]
+
 def create_admin_user(engine):
     role = Roles(name='user_admin', description='Add, update, delete users and roles')
     with Session(engine) as session:
@@ -138,10 +332,9 @@ def create_admin_user(engine):
 
     username = 'admin'
     password = 'admin'
-    hashed_password = bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt())
     user = Users(
         username=username,
-        password=hashed_password.decode('utf-8'),
+        password=hash_password_sync(password),
         first_name='Admin',
         last_name='User',
         email='admin@eoffice',
@@ -0,0 +1,81 @@
+import base64
+import json
+from dataclasses import dataclass
+from typing import Any, Callable, Sequence, TypeVar
+from fastapi import HTTPException, Query, Request, Response
+from src.settings import get_settings
+
+T = TypeVar("T")
+
+def encode_cursor(key: tuple) -> str:
+    raw = json.dumps(list(key), separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+def decode_cursor(cursor: str) -> tuple:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        key = json.loads(raw)
+    except (ValueError, json.JSONDecodeError):
+        raise ValueError("Invalid cursor")
+    if not isinstance(key, list) or not key:
+        raise ValueError("Invalid cursor")
+    return tuple(key)
+
+@dataclass(frozen=True)
+class PageParams:
+    """Keyset page request: ``limit`` rows strictly after the ``after`` key.
+
+    ``limit`` is None only when the caller explicitly asked for the
+    unbounded listing with ``all=true``.
+    """
+    limit: int | None
+    after: tuple | None
+
+    @property
+    def fetch_limit(self) -> int | None:
+        # One extra row tells us whether another page exists
+        return None if self.limit is None else self.limit + 1
+
+    def finish(self, rows: Sequence[T], request: Request, response: Response, key: Callable[[T], tuple]) -> list[T]:
+        """Trim the look-ahead row and advertise the next cursor in the headers."""
+        items = list(rows)
+        if self.limit is None or len(items) <= self.limit:
+            return items
+
+        items = items[:self.limit]
+        next_cursor = encode_cursor(key(items[-1]))
+        next_url = request.url.include_query_params(after=next_cursor, limit=self.limit)
+        response.headers["X-Next-Cursor"] = next_cursor
+        response.headers["Link"] = f'<{next_url}>; rel="next"'
+        return items
+
+def page_params(*key_types: Callable[[Any], Any]):
+    """Build a dependency parsing ``limit``/``after``/``all`` for a listing.
+
+    ``key_types`` converts each component of the cursor key, so a tampered
+    or stale cursor becomes a 400 instead of a bad query.
+    """
+    def dependency(
+        limit: int | None = Query(None, ge=1, description="Page size; PAGE_SIZE_DEFAULT when omitted, at most PAGE_SIZE_MAX"),
+        after: str | None = Query(None, description="Opaque cursor from the X-Next-Cursor header of the previous page"),
+        all: bool = Query(False, description="Return every row in one response instead of a page"),
+    ) -> PageParams:
+        if all:
+            return PageParams(limit=None, after=None)
+        # The bounds come from settings at request time, not when routes are declared
+        settings = get_settings()
+        if limit is None:
+            limit = settings.page_size_default
+        elif limit > settings.page_size_max:
+            raise HTTPException(status_code=422, detail=f"limit must be at most {settings.page_size_max}")
+        if after is None:
+            return PageParams(limit=limit, after=None)
+        try:
+            key = decode_cursor(after)
+            if len(key) != len(key_types):
+                raise ValueError("Invalid cursor")
+            return PageParams(limit=limit, after=tuple(convert(value) for convert, value in zip(key_types, key)))
+        except (TypeError, ValueError):
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+
+    return dependency
@@ -0,0 +1,215 @@
+import asyncio
+import os
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from functools import lru_cache
+from src.metrics import metrics
+from src.settings import Settings, get_settings
+
+@lru_cache(maxsize=4)
+def get_pwd_context(rounds: int):
+    # passlib is slow to import, so it is loaded on the first hash or verify
+    from passlib.context import CryptContext
+
+    # min and max pinned to the target make needs_update flag hashes of any other cost
+    return CryptContext(
+        schemes=["bcrypt"], deprecated="auto",
+        bcrypt__default_rounds=rounds, bcrypt__min_rounds=rounds, bcrypt__max_rounds=rounds,
+    )
+
+class PasswordHasherBusy(Exception):
+    """Raised when a hash or verify request waited too long for a worker."""
+
+def hash_password_sync(password: str) -> str:
+    return get_pwd_context(get_settings().bcrypt_rounds).hash(password)
+
+def verify_password_sync(plain_password: str, hashed_password: str) -> bool:
+    return get_pwd_context(get_settings().bcrypt_rounds).verify(plain_password, hashed_password)
+
+def needs_rehash(hashed_password: str) -> bool:
+    # Only parses the hash; no bcrypt work
+    return get_pwd_context(get_settings().bcrypt_rounds).needs_update(hashed_password)
+
+class PasswordHasher:
+    """Runs bcrypt off the event loop on a bounded worker pool.
+
+    At most ``max_concurrency`` operations run at once. Callers that wait
+    longer than ``queue_timeout`` seconds for a slot get PasswordHasherBusy
+    instead of piling up behind a login storm.
+    """
+
+    def __init__(self, executor_kind: str = "thread", max_workers: int | None = None,
+                 max_concurrency: int | None = None, queue_timeout: float = 5.0):
+        if executor_kind not in ("thread", "process"):
+            raise ValueError(f"Invalid executor kind {executor_kind!r}, expected 'thread' or 'process'")
+        self.executor_kind = executor_kind
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.max_concurrency = max_concurrency or self.max_workers
+        self.queue_timeout = queue_timeout
+        self._executor: Executor | None = None
+        self._semaphore: asyncio.Semaphore | None = None
+        self._reset_counters()
+
+    @classmethod
+    def from_settings(cls, settings: Settings) -> "PasswordHasher":
+        return cls(
+            executor_kind=settings.password_hash_executor,
+            max_workers=settings.password_hash_workers,
+            max_concurrency=settings.password_hash_max_concurrency,
+            queue_timeout=settings.password_hash_queue_timeout,
+        )
+
+    def configure(self, settings: Settings) -> None:
+        """Apply ``settings`` to a hasher that is not running; the lifespan calls this before ``start``."""
+        configured = self.from_settings(settings)
+        self.executor_kind = configured.executor_kind
+        self.max_workers = configured.max_workers
+        self.max_concurrency = configured.max_concurrency
+        self.queue_timeout = configured.queue_timeout
+
+    def _reset_counters(self):
+        self.queued = 0
+        self.in_flight = 0
+        self.completed = 0
+        self.rejected = 0
+        self.rehashed = 0
+        self.wait_seconds_total = 0.0
+        self.wait_seconds_max = 0.0
+        self.run_seconds_total = 0.0
+        self.run_seconds_max = 0.0
+
+    def start(self):
+        # Called from the app lifespan; the semaphore belongs to the running loop
+        if self._executor is None:
+            if self.executor_kind == "process":
+                self._executor = ProcessPoolExecutor(max_workers=self.max_workers)
+            else:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="password-hasher")
+        self._semaphore = asyncio.Semaphore(self.max_concurrency)
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True, cancel_futures=True)
+        self._executor = None
+        self._semaphore = None
+
+    async def _run(self, func, *args, bounded_wait: bool = True):
+        # Batch callers pass bounded_wait=False to queue for a slot without a timeout
+        queue_timeout = self.queue_timeout if bounded_wait else None
+        if self._executor is None or self._semaphore is None:
+            self.start()
+        executor, semaphore = self._executor, self._semaphore
+
+        queued_at = time.perf_counter()
+        self.queued += 1
+        try:
+            await asyncio.wait_for(semaphore.acquire(), timeout=queue_timeout)
+        except asyncio.TimeoutError:
+            self.rejected += 1
+            raise PasswordHasherBusy("Password hashing queue is full, try again later")
+        finally:
+            self.queued -= 1
+
+        started_at = time.perf_counter()
+        waited = started_at - queued_at
+        self.wait_seconds_total += waited
+        self.wait_seconds_max = max(self.wait_seconds_max, waited)
+        metrics.password_hash_wait.observe(waited)
+        self.in_flight += 1
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(executor, func, *args)
+        finally:
+            ran = time.perf_counter() - started_at
+            self.in_flight -= 1
+            self.completed += 1
+            self.run_seconds_total += ran
+            self.run_seconds_max = max(self.run_seconds_max, ran)
+            semaphore.release()
+
+    async def hash(self, password: str) -> str:
+        return await self._run(hash_password_sync, password)
+
+    async def hash_many(self, passwords: list[str]) -> list[str]:
+        """Hash a batch in parallel while leaving pool slots free for logins.
+
+        The batch never holds more than half of ``max_concurrency`` slots, and
+        it waits for slots instead of timing out.
+        """
+        batch_limit = asyncio.Semaphore(max(1, self.max_concurrency // 2))
+
+        async def hash_one(password: str) -> str:
+            async with batch_limit:
+                return await self._run(hash_password_sync, password, bounded_wait=False)
+
+        return list(await asyncio.gather(*(hash_one(password) for password in passwords)))
+
+    async def verify(self, plain_password: str, hashed_password: str) -> bool:
+        return await self._run(verify_password_sync, plain_password, hashed_password)
+
+    async def rehash(self, password: str) -> str:
+        """Hash at the configured cost for a stored hash of another cost.
+
+        Runs after the login response, so it queues without a timeout like
+        batch work instead of competing with logins for a bounded wait.
+        """
+        self.rehashed += 1
+        return await self._run(hash_password_sync, password, bounded_wait=False)
+
+    def stats(self) -> dict:
+        return {
+            "executor": self.executor_kind,
+            "bcrypt_rounds": get_settings().bcrypt_rounds,
+            "max_workers": self.max_workers,
+            "max_concurrency": self.max_concurrency,
+            "queue_depth": self.queued,
+            "in_flight": self.in_flight,
+            "completed": self.completed,
+            "rejected": self.rejected,
+            "rehashed": self.rehashed,
+            "wait_seconds_total": self.wait_seconds_total,
+            "wait_seconds_max": self.wait_seconds_max,
+            "run_seconds_total": self.run_seconds_total,
+            "run_seconds_max": self.run_seconds_max,
+        }
+
+# Built with defaults so importing stays free of settings I/O; src.main configures it at startup
+password_hasher = PasswordHasher()
+
+def calibrate(target_ms: float, samples: int = 3, min_rounds: int = 4, max_rounds: int = 16) -> list[tuple[int, float]]:
+    """Median hash time in milliseconds for each cost from ``min_rounds`` up.
+
+    Each extra round doubles the work, so timing stops at the first cost
+    over ``target_ms``.
+    """
+    timings = []
+    for rounds in range(min_rounds, max_rounds + 1):
+        context = get_pwd_context(rounds)
+        runs = []
+        for _ in range(samples):
+            started = time.perf_counter()
+            context.hash("calibration-password")
+            runs.append((time.perf_counter() - started) * 1000)
+        timings.append((rounds, sorted(runs)[len(runs) // 2]))
+        if timings[-1][1] > target_ms:
+            break
+    return timings
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Pick the highest bcrypt cost whose hash time fits a latency budget on this machine.")
+    parser.add_argument("--target-ms", type=float, default=250, help="Time one hash may take, in milliseconds")
+    parser.add_argument("--samples", type=int, default=3, help="Hashes timed per cost; the median is used")
+    parser.add_argument("--min-rounds", type=int, default=10, help="Never recommend a cost below this")
+    args = parser.parse_args()
+
+    timings = calibrate(args.target_ms, args.samples)
+    for rounds, ms in timings:
+        print(f"cost {rounds:>2}  {ms:>9.1f} ms")
+    fitting = [rounds for rounds, ms in timings if ms <= args.target_ms]
+    chosen = max(fitting, default=timings[0][0])
+    if chosen < args.min_rounds:
+        print(f"\nNo cost of at least {args.min_rounds} fits {args.target_ms:.0f} ms on this machine; using the minimum")
+        chosen = args.min_rounds
+    print(f"\nBCRYPT_ROUNDS={chosen}")
@@ -0,0 +1,104 @@
+import asyncio
+import cProfile
+import hmac
+import pstats
+import random
+import re
+import secrets
+import time
+from io import StringIO
+from pathlib import Path
+from src.settings import get_settings
+
+PROFILE_HEADER = b"x-profile"
+PROFILE_ID_PATTERN = re.compile(r"^[0-9]{8}T[0-9]{6}\.[0-9]{9}Z-[A-Z]+-[A-Za-z0-9_.-]*-[0-9a-f]{8}$")
+
+# cProfile hooks the whole thread and only one profiler may be active at a
+# time, so a request that would overlap a running profile is not profiled
+_profiling = False
+
+def _should_profile(scope) -> bool:
+    settings = get_settings()
+    # A request carrying X-Profile with PROFILE_SECRET is always profiled; no secret disables the header
+    if settings.profile_secret:
+        for name, value in scope["headers"]:
+            if name == PROFILE_HEADER:
+                return hmac.compare_digest(value, settings.profile_secret.encode())
+    return settings.profile_sample_rate > 0 and random.random() < settings.profile_sample_rate
+
+def _profile_dir() -> Path:
+    return Path(get_settings().profile_dir)
+
+def _profile_id(scope) -> str:
+    # Ids sort in creation order, which is what rotation relies on
+    now = time.time_ns()
+    stamp = time.strftime("%Y%m%dT%H%M%S", time.gmtime(now // 10**9)) + f".{now % 10**9:09d}Z"
+    slug = re.sub(r"[^A-Za-z0-9_.-]+", "_", scope["path"].strip("/"))[:60]
+    return f"{stamp}-{scope['method']}-{slug}-{secrets.token_hex(4)}"
+
+def _save(profiler: cProfile.Profile, profile_id: str) -> None:
+    profile_dir = _profile_dir()
+    profile_dir.mkdir(parents=True, exist_ok=True)
+    profiler.dump_stats(profile_dir / f"{profile_id}.prof")
+    # Only the newest PROFILE_KEEP profiles are kept; never fewer than the one just advertised in X-Profile-Id
+    keep = max(1, get_settings().profile_keep)
+    for stale in sorted(profile_dir.glob("*.prof"))[:-keep]:
+        stale.unlink(missing_ok=True)
+
+def list_profiles() -> list[dict]:
+    profile_dir = _profile_dir()
+    if not profile_dir.is_dir():
+        return []
+    return [
+        {"id": path.stem, "size": path.stat().st_size, "created_at": path.stat().st_mtime}
+        for path in sorted(profile_dir.glob("*.prof"), reverse=True)
+    ]
+
+def profile_path(profile_id: str) -> Path | None:
+    # The id pattern also keeps the lookup inside PROFILE_DIR
+    if not PROFILE_ID_PATTERN.match(profile_id):
+        return None
+    path = _profile_dir() / f"{profile_id}.prof"
+    return path if path.is_file() else None
+
+def profile_summary(path: Path, sort: str = "cumulative", limit: int = 50) -> str:
+    output = StringIO()
+    pstats.Stats(str(path), stream=output).sort_stats(sort).print_stats(limit)
+    return output.getvalue()
+
+class ProfilerMiddleware:
+    """Runs cProfile around sampled or explicitly requested requests.
+
+    The profile covers everything on the event loop thread while the
+    request is handled: auth, queries (run_sync executes on the loop),
+    validation and serialization. Work handed to the password hasher's
+    pool shows up as time waiting on a future. Other requests interleaved
+    on the loop appear in the profile as well.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        global _profiling
+        if scope["type"] != "http" or _profiling or not _should_profile(scope):
+            return await self.app(scope, receive, send)
+
+        profile_id = _profile_id(scope)
+        async def send_with_id(message):
+            if message["type"] == "http.response.start":
+                message["headers"] = [*message.get("headers", []), (b"x-profile-id", profile_id.encode())]
+            await send(message)
+
+        _profiling = True
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+            try:
+                await self.app(scope, receive, send_with_id)
+            finally:
+                profiler.disable()
+            # Writing the stats and rotating are file I/O; keep them off the event loop
+            await asyncio.to_thread(_save, profiler, profile_id)
+        finally:
+            _profiling = False
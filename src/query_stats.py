@@ -0,0 +1,91 @@
+import logging
+import time
+from collections import Counter
+from contextvars import ContextVar
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from src.settings import get_settings
+
+logger = logging.getLogger(__name__)
+
+def query_stats_enabled() -> bool:
+    return get_settings().query_stats_enabled
+
+class QueryStats:
+    """Statements run and time spent in the database while handling one request."""
+    __slots__ = ("count", "seconds", "shapes")
+
+    def __init__(self, track_shapes: bool):
+        self.count = 0
+        self.seconds = 0.0
+        # statement text -> executions; only kept in development mode
+        self.shapes: Counter[str] | None = Counter() if track_shapes else None
+
+# The middleware sets a fresh QueryStats per request. run_sync greenlets and
+# threadpool iterators inherit the context, so every statement finds it.
+current_query_stats: ContextVar[QueryStats | None] = ContextVar("current_query_stats", default=None)
+
+def _redacted(parameters) -> str:
+    # Keep the shape of the parameters, never their values
+    if isinstance(parameters, dict):
+        return "{" + ", ".join(f"{key}: <{type(value).__name__}>" for key, value in parameters.items()) + "}"
+    if isinstance(parameters, (list, tuple)):
+        if parameters and isinstance(parameters[0], (list, tuple, dict)):
+            return f"[{len(parameters)} rows of {_redacted(parameters[0])}]"
+        return "(" + ", ".join(f"<{type(value).__name__}>" for value in parameters) + ")"
+    return f"<{type(parameters).__name__}>"
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    context._query_started_at = time.perf_counter()
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - context._query_started_at
+    stats = current_query_stats.get()
+    if stats is not None:
+        stats.count += 1
+        stats.seconds += elapsed
+        if stats.shapes is not None:
+            stats.shapes[statement] += 1
+    if elapsed * 1000 >= get_settings().slow_query_ms:
+        logger.warning("Slow query (%.1f ms): %s params=%s", elapsed * 1000, " ".join(statement.split()), _redacted(parameters))
+
+def instrument_queries(engine: Engine) -> None:
+    """Count and time every statement ``engine`` runs against the current request."""
+    event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+
+class QueryStatsMiddleware:
+    """Adds a ``Server-Timing: db`` header with the request's statement count and DB time.
+
+    The header goes out with the response start, so statements run while a
+    streamed body is sent are not included in it.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self.enabled = query_stats_enabled()
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self.enabled:
+            return await self.app(scope, receive, send)
+
+        settings = get_settings()
+        stats = QueryStats(track_shapes=settings.development)
+        token = current_query_stats.set(stats)
+
+        async def send_with_timing(message):
+            if message["type"] == "http.response.start":
+                timing = f'db;dur={stats.seconds * 1000:.2f};desc="{stats.count} statements"'
+                message["headers"] = [*message.get("headers", []), (b"server-timing", timing.encode())]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            current_query_stats.reset(token)
+            if stats.shapes:
+                for statement, count in stats.shapes.items():
+                    # Development mode warns about a statement run more than this many times
+                    if count > settings.repeated_query_threshold:
+                        logger.warning("Possible N+1: %s %s ran the same statement %d times: %s",
+                                       scope["method"], scope["path"], count, " ".join(statement.split()))
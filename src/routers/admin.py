@@ -0,0 +1,39 @@
+from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi.responses import FileResponse, PlainTextResponse
+from src.auth import check_manage_user_permission
+from src.cache import auth_cache_stats, response_cache
+from src.passwords import password_hasher
+from src.profiling import list_profiles, profile_path, profile_summary
+from src.throttle import login_throttle
+
+router = APIRouter(
+    prefix="/admin",
+    tags=["admin"],
+    dependencies=[Depends(check_manage_user_permission)]
+)
+
+@router.get("/stats")
+async def get_stats():
+    return {
+        "auth_cache": auth_cache_stats(),
+        "response_cache": response_cache.stats(),
+        "password_hasher": password_hasher.stats(),
+        "login_throttle": login_throttle.stats(),
+    }
+
+@router.get("/profiles")
+async def get_profiles():
+    return list_profiles()
+
+@router.get("/profiles/{profile_id}")
+async def get_profile(
+    profile_id: str,
+    format: str = Query("prof", pattern="^(prof|text)$", description="Raw pstats file, or a text summary"),
+    sort: str = Query("cumulative", pattern="^(cumulative|tottime|calls)$"),
+):
+    path = profile_path(profile_id)
+    if path is None:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    if format == "text":
+        return PlainTextResponse(profile_summary(path, sort))
+    return FileResponse(path, media_type="application/octet-stream", filename=path.name)
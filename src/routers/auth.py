@@ -1,14 +1,33 @@
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, BackgroundTasks, Depends, Form, Request
 from fastapi.security import OAuth2PasswordRequestForm
 from sqlmodel import Session
-from src.auth import login_for_access_token
-from src.dependency import get_session
+from sqlmodel.ext.asyncio.session import AsyncSession
+from src.auth import login_for_access_token, refresh_access_token, revoke_refresh_token
+from src.dependency import get_db
 
 router = APIRouter()
 
 @router.post("/auth/token")
 async def login(
+    request: Request,
+    background_tasks: BackgroundTasks,
     form_data: OAuth2PasswordRequestForm = Depends(),
-    session: Session = Depends(get_session)
+    session: Session | AsyncSession = Depends(get_db)
 ):
-    return await login_for_access_token(form_data, session)
\ No newline at end of file
+    return await login_for_access_token(request, background_tasks, form_data, session)
+
+@router.post("/auth/refresh")
+async def refresh(
+    refresh_token: str = Form(...),
+    session: Session | AsyncSession = Depends(get_db)
+):
+    return await refresh_access_token(refresh_token, session)
+
+@router.post("/auth/revoke")
+async def revoke(
+    refresh_token: str = Form(...),
+    session: Session | AsyncSession = Depends(get_db)
+):
+    # Unknown tokens are not reported, so the endpoint cannot be used to probe for valid ones
+    await revoke_refresh_token(refresh_token, session)
+    return {"detail": "Refresh token revoked"}
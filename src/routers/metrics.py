@@ -0,0 +1,12 @@
+from fastapi import APIRouter, HTTPException
+from fastapi.responses import PlainTextResponse
+from src.metrics import metrics, metrics_enabled
+
+router = APIRouter()
+
+# Left unauthenticated like any Prometheus target; restrict it at the proxy if needed
+@router.get("/metrics", response_class=PlainTextResponse, include_in_schema=False)
+async def get_metrics():
+    if not metrics_enabled():
+        raise HTTPException(status_code=404, detail="Not Found")
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
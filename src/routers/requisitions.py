@@ -0,0 +1,99 @@
+from datetime import datetime
+from typing import List
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
+from sqlmodel import Session
+from sqlmodel.ext.asyncio.session import AsyncSession
+from src.auth import CurrentUser, get_current_user, require_permission
+from src.dependency import get_db, get_read_db, run_query
+from src.pagination import PageParams, page_params
+from src.db_queries.requisitions import (
+    create_requisition_in_db, decide_requisitions_in_db, get_requester_requisitions_from_db,
+    get_requisition_from_db, get_requisition_queue_from_db,
+)
+from src.models import RequisitionCreate, RequisitionDecision, RequisitionInfo, RequisitionStatus, UserAction
+from src.settings import get_settings
+
+router = APIRouter(
+    prefix="/requisitions",
+    tags=["requisitions"],
+)
+
+def _team_of(current_user: CurrentUser) -> int:
+    # Requisitions are raised for, and approved within, the caller's own team
+    if current_user.team_id is None:
+        raise HTTPException(status_code=400, detail="You are not assigned to a team")
+    return current_user.team_id
+
+def _user_id_of(current_user: CurrentUser) -> int:
+    # A claims token without a user id would otherwise match requisitions whose requester was deleted
+    if current_user.user_id is None:
+        raise HTTPException(status_code=403, detail="Your token does not identify a user; log in again")
+    return current_user.user_id
+
+def _page_key(requisition) -> tuple:
+    return (requisition.created_at.isoformat(), requisition.id)
+
+@router.post("/", response_model=RequisitionInfo)
+async def create_requisition(
+    requisition: RequisitionCreate,
+    current_user: CurrentUser = Depends(require_permission(UserAction.CREATE_REQUISITION)),
+    session: Session | AsyncSession = Depends(get_db)
+):
+    team_id = _team_of(current_user)
+    return await run_query(session, create_requisition_in_db, requisition, team_id, _user_id_of(current_user))
+
+@router.get("/queue", response_model=List[RequisitionInfo])
+async def get_requisition_queue(
+    request: Request, response: Response,
+    status: RequisitionStatus = Query(RequisitionStatus.PENDING, description="Queue to list; oldest first"),
+    current_user: CurrentUser = Depends(require_permission(UserAction.APPROVE_REQUISITION)),
+    page: PageParams = Depends(page_params(datetime.fromisoformat, int)),
+    session: Session | AsyncSession = Depends(get_read_db)
+):
+    team_id = _team_of(current_user)
+    results = await run_query(session, get_requisition_queue_from_db, team_id, status, page.fetch_limit, page.after)
+    return page.finish(results, request, response, key=_page_key)
+
+@router.get("/mine", response_model=List[RequisitionInfo])
+async def get_my_requisitions(
+    request: Request, response: Response,
+    current_user: CurrentUser = Depends(get_current_user),
+    page: PageParams = Depends(page_params(datetime.fromisoformat, int)),
+    session: Session | AsyncSession = Depends(get_read_db)
+):
+    requester_id = _user_id_of(current_user)
+    results = await run_query(session, get_requester_requisitions_from_db, requester_id, page.fetch_limit, page.after)
+    return page.finish(results, request, response, key=_page_key)
+
+@router.post("/approve")
+async def decide_requisitions(
+    decision: RequisitionDecision,
+    atomic: bool = Query(True, description="Decide nothing if any requisition cannot be decided"),
+    current_user: CurrentUser = Depends(require_permission(UserAction.APPROVE_REQUISITION)),
+    session: Session | AsyncSession = Depends(get_db)
+):
+    max_ids = get_settings().requisition_decision_max_ids
+    if len(decision.ids) > max_ids:
+        raise HTTPException(status_code=413, detail=f"At most {max_ids} requisitions can be decided at once")
+    team_id = _team_of(current_user)
+    decided, errors = await run_query(
+        session, decide_requisitions_in_db, decision.ids, decision.status, _user_id_of(current_user), team_id, atomic
+    )
+    if atomic and errors:
+        raise HTTPException(status_code=400, detail={"decided": [], "errors": errors})
+    return {"status": decision.status, "decided": decided, "errors": errors}
+
+@router.get("/{requisition_id}", response_model=RequisitionInfo)
+async def get_requisition(
+    requisition_id: int,
+    current_user: CurrentUser = Depends(get_current_user),
+    session: Session | AsyncSession = Depends(get_read_db)
+):
+    requisition = await run_query(session, get_requisition_from_db, requisition_id)
+    # Visible to its requester and to approvers of its team
+    if requisition is None or not (
+        (current_user.user_id is not None and requisition.requester_id == current_user.user_id)
+        or (current_user.has_permission(UserAction.APPROVE_REQUISITION) and requisition.team_id == current_user.team_id)
+    ):
+        raise HTTPException(status_code=404, detail="Requisition not found")
+    return requisition
@@ -1,19 +1,32 @@
-from fastapi import HTTPException, Depends, APIRouter
+from fastapi import HTTPException, Depends, APIRouter, Body, Query, Request, Response
+from fastapi.responses import StreamingResponse
 from typing import List
+import csv
+import io
 import logging
-from sqlmodel import Session, select
-from src.dependency import get_session
+from sqlmodel import Session
+from sqlmodel.ext.asyncio.session import AsyncSession
+from src.dependency import get_db, get_read_db, pick_engine, run_query
 from src.auth import check_manage_user_permission
-from src.db_queries.users import *
-from src.models import UserCreate, UserInfo, UserUpdate, RoleCreate, RoleInfo, Roles, RolePermissions, RolePermissionCreate, TeamCreate, TeamInfo, TeamUpdate, Teams
+from src.passwords import password_hasher
+from src.pagination import PageParams, page_params
+from src.conditional import Conditional, conditional_get
+from src.export import EXPORT_FORMATS, RowEncoder, stream_rows, stream_rows_async
+from src.db_queries.users import (
+    USER_EXPORT_COLUMNS, bulk_create_users_in_db, check_bulk_users_in_db, create_role_in_db, create_role_permission_in_db,
+    create_team_in_db, create_user_in_db, delete_role_from_db, delete_role_permission_from_db, delete_team_from_db, delete_user_from_db,
+    get_all_role_permissions, get_all_roles, get_role_by_name_from_db, get_role_from_db, get_role_permissions_by_role,
+    get_team_by_name_from_db, get_team_list_from_db, get_users_export_statement, get_users_from_db,
+    replace_role_permissions_in_db, search_users_in_db, update_role_in_db, update_team_in_db, update_user_in_db,
+)
+from src.settings import get_settings
+from src.models import UserCreate, UserInfo, UserUpdate, RoleCreate, RoleInfo, Roles, RolePermissions, RolePermissionCreate, TeamCreate, TeamInfo, TeamUpdate, Teams, UserAction, Users
 from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncEngine
+from pydantic import ValidationError
 
-# Configure logger
+# Handlers and levels are left to the server's logging configuration
 logger = logging.getLogger("users_router")
-logger.setLevel(logging.INFO)
-handler = logging.StreamHandler()
-handler.setFormatter(logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s"))
-logger.addHandler(handler)
 
 router = APIRouter(
     prefix="/users",
@@ -22,35 +35,143 @@ router = APIRouter(
 )
 
 @router.post("/", response_model=UserInfo)
-async def create_user(user: UserCreate, session: Session = Depends(get_session)):
+async def create_user(user: UserCreate, session: Session | AsyncSession = Depends(get_db)):
+    hashed_password = await password_hasher.hash(user.password)
     try:
-        db_user = create_user_in_db(session, user)
+        db_user = await run_query(session, create_user_in_db, user, hashed_password)
         return db_user
     except IntegrityError:
         raise HTTPException(status_code=400, detail="User with this username or email already exists")
 
+def _validation_message(error: ValidationError) -> str:
+    return "; ".join(f"{'.'.join(str(part) for part in err['loc'])}: {err['msg']}" for err in error.errors())
+
+async def _read_bulk_records(request: Request) -> list:
+    content_type = request.headers.get("content-type", "")
+    if content_type.startswith("multipart/form-data"):
+        form = await request.form()
+        upload = form.get("file")
+        if upload is None or isinstance(upload, str):
+            raise HTTPException(status_code=400, detail="Upload the CSV as a 'file' form field")
+        text = (await upload.read()).decode("utf-8-sig")
+    elif content_type.startswith("text/csv"):
+        text = (await request.body()).decode("utf-8-sig")
+    else:
+        try:
+            records = await request.json()
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Body must be a JSON array of users or a CSV file")
+        if not isinstance(records, list):
+            raise HTTPException(status_code=400, detail="Body must be a JSON array of users or a CSV file")
+        return records
+
+    # Empty CSV cells mean "not set", e.g. a user without a team
+    return [{key: (value if value != "" else None) for key, value in row.items()} for row in csv.DictReader(io.StringIO(text))]
+
+@router.post("/bulk")
+async def bulk_create_users(
+    request: Request,
+    mode: str = Query("atomic", pattern="^(atomic|best_effort)$"),
+    session: Session | AsyncSession = Depends(get_db),
+):
+    records = await _read_bulk_records(request)
+    max_rows = get_settings().bulk_import_max_rows
+    if len(records) > max_rows:
+        raise HTTPException(status_code=413, detail=f"At most {max_rows} users can be imported at once")
+
+    valid: list[tuple[int, UserCreate]] = []
+    errors: list[dict] = []
+    for row, record in enumerate(records):
+        try:
+            valid.append((row, UserCreate.model_validate(record)))
+        except ValidationError as e:
+            username = record.get("username") if isinstance(record, dict) else None
+            errors.append({"row": row, "username": username, "error": _validation_message(e)})
+
+    atomic = mode == "atomic"
+    if atomic and errors:
+        raise HTTPException(status_code=400, detail={"created": 0, "errors": errors})
+
+    # bcrypt is the expensive step, so only rows that can be inserted are hashed
+    batch_size = get_settings().bulk_import_batch_size
+    accepted, check_errors = await run_query(session, check_bulk_users_in_db, valid, batch_size)
+    errors = sorted(errors + check_errors, key=lambda error: error["row"])
+    if atomic and errors:
+        raise HTTPException(status_code=400, detail={"created": 0, "errors": errors})
+
+    hashed_passwords = await password_hasher.hash_many([user.password for _, user in accepted])
+    created, insert_errors = await run_query(
+        session, bulk_create_users_in_db,
+        [(row, user, hashed) for (row, user), hashed in zip(accepted, hashed_passwords)],
+        batch_size, atomic,
+    )
+    errors = sorted(errors + insert_errors, key=lambda error: error["row"])
+    if atomic and errors:
+        raise HTTPException(status_code=400, detail={"created": 0, "errors": errors})
+    return {"created": created, "errors": errors}
+
+@router.get("/export")
+async def export_users(
+    request: Request,
+    format: str = Query("ndjson", pattern="^(ndjson|csv)$"),
+    team_id: int | None = None,
+    role_id: int | None = None,
+):
+    statement = get_users_export_statement(team_id, role_id, get_settings().export_batch_size)
+    encoder = RowEncoder(format, USER_EXPORT_COLUMNS)
+    engine = pick_engine(request, read_only=True, tables=(Users.__tablename__,))
+    if isinstance(engine, AsyncEngine):
+        body = stream_rows_async(engine, statement, encoder)
+    else:
+        body = stream_rows(engine, statement, encoder)
+    return StreamingResponse(
+        body,
+        media_type=EXPORT_FORMATS[format],
+        headers={"Content-Disposition": f'attachment; filename="users.{format}"'},
+    )
+
+# Kept under "/-/", a segment no username route matches, so a user named "search" stays reachable
+@router.get("/-/search", response_model=List[UserInfo])
+async def search_users(
+    request: Request, response: Response,
+    q: str = Query(..., min_length=1, description="Words to match against username, name and email"),
+    page: PageParams = Depends(page_params(int)), session: Session | AsyncSession = Depends(get_read_db)
+):
+    # Ranked results have no stable key, so the cursor carries the row offset
+    offset = page.after[0] if page.after else 0
+    results = await run_query(session, search_users_in_db, q, page.fetch_limit, offset)
+    return page.finish(results, request, response, key=lambda _: (offset + (page.limit or 0),))
+
 @router.get("/{username}", response_model=List[UserInfo])
-async def get_users(username: str, session: Session = Depends(get_session)):
-    results = get_users_from_db(session, username)
+async def get_users(
+    username: str, request: Request, response: Response,
+    conditional: Conditional = Depends(conditional_get(Users.__tablename__)),
+    page: PageParams = Depends(page_params(str, str)), session: Session | AsyncSession = Depends(get_read_db)
+):
+    results = await run_query(session, get_users_from_db, username, page.fetch_limit, page.after)
     if not results:
         raise HTTPException(status_code=404, detail="No users found")
-    return results
+    users = page.finish(results, request, response, key=lambda user: (user.username_lower, user.username))
+    conditional.last_modified(*(user.updated_at for user in users))
+    return conditional.respond(UserInfo, users)
 
 @router.delete("/{username}")
-async def delete_user(username: str, session: Session = Depends(get_session)):
-    db_user = delete_user_from_db(session, username)
+async def delete_user(username: str, session: Session | AsyncSession = Depends(get_db)):
+    db_user = await run_query(session, delete_user_from_db, username)
     if not db_user:
         raise HTTPException(status_code=404, detail="User not found")
     return {"message": f"User {username} successfully deleted"}
 
 @router.patch("/{username}", response_model=UserInfo)
-async def update_user(username: str, user_update: UserUpdate, session: Session = Depends(get_session)):
+async def update_user(username: str, user_update: UserUpdate, session: Session | AsyncSession = Depends(get_db)):
     update_data = user_update.model_dump(exclude_unset=True)
     if not update_data:
         raise HTTPException(status_code=400, detail="No valid fields to update")
-    
+    if update_data.get("password") is not None:
+        update_data["password"] = await password_hasher.hash(update_data["password"])
+
     try:
-        db_user = update_user_in_db(session, username, update_data)  # Use the update_user_in_db function
+        db_user = await run_query(session, update_user_in_db, username, update_data)  # Use the update_user_in_db function
         return db_user
     except ValueError as e:
         raise HTTPException(status_code=404, detail=str(e))
@@ -61,76 +182,86 @@ async def update_user(username: str, user_update: UserUpdate, session: Session =
 
 # --- Team CRUD endpoints added in users.py ---
 @router.post("/teams/", response_model=TeamInfo)
-async def create_team(team: TeamCreate, session: Session = Depends(get_session)):
+async def create_team(team: TeamCreate, session: Session | AsyncSession = Depends(get_db)):
     new_team = Teams(**team.model_dump())
     try:
-        created_team = create_team_in_db(session, new_team)
+        created_team = await run_query(session, create_team_in_db, new_team)
         return created_team
     except IntegrityError:
         raise HTTPException(status_code=400, detail="Team with this name or description already exists")
 
 @router.get("/teams/{team_name}", response_model=TeamInfo)
-async def get_team(team_name: str, session: Session = Depends(get_session)):
-    team = get_team_by_name_from_db(session, team_name)
+async def get_team(team_name: str, session: Session | AsyncSession = Depends(get_read_db)):
+    team = await run_query(session, get_team_by_name_from_db, team_name)
     if not team:
         raise HTTPException(status_code=404, detail="Team not found")
     return team
 
 @router.get("/teams/", response_model=List[TeamInfo])
-async def list_teams(session: Session = Depends(get_session)):
-    teams = get_team_list_from_db(session)
-    return teams
+async def list_teams(
+    request: Request, response: Response,
+    conditional: Conditional = Depends(conditional_get(Teams.__tablename__)),
+    page: PageParams = Depends(page_params(int)), session: Session | AsyncSession = Depends(get_read_db)
+):
+    async def load():
+        teams = await run_query(session, get_team_list_from_db, page.fetch_limit, page.after)
+        return page.finish(teams, request, response, key=lambda team: (team.id,))
+    return await conditional.cached(TeamInfo, load)
 
 @router.patch("/teams/{team_name}", response_model=TeamInfo)
-async def update_team(team_update_data: TeamUpdate, session: Session = Depends(get_session)):
-    db_team = get_team_by_name_from_db(session, team_update_data.name)
-    if not db_team:
-        raise HTTPException(status_code=404, detail="Team not found") 
-
-    if db_team.description == team_update_data.description:
-        raise HTTPException(status_code=400, detail="No changes detected in team description") 
-    
+async def update_team(team_update_data: TeamUpdate, session: Session | AsyncSession = Depends(get_db)):
     try:
-        updated_team = update_team_in_db(session, team_update_data)
-        return updated_team
-    except ValueError as e:
-        raise HTTPException(status_code=400, detail=str(e))
+        updated_team = await run_query(session, update_team_in_db, team_update_data)
+    except ValueError:
+        raise HTTPException(status_code=404, detail="Team not found") 
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+    if updated_team is None:
+        raise HTTPException(status_code=400, detail="No changes detected in team description") 
+    return updated_team
 
 @router.delete("/teams/{team_name}")
-async def delete_team(team_name: str, session: Session = Depends(get_session)):
-    team = delete_team_from_db(session, team_name)
-    if not team:
+async def delete_team(team_name: str, session: Session | AsyncSession = Depends(get_db)):
+    try:
+        team = await run_query(session, delete_team_from_db, team_name)
+    except ValueError:
         raise HTTPException(status_code=404, detail="Team not found")
+    except IntegrityError:
+        raise HTTPException(status_code=400, detail="Team cannot be deleted, it is used by one or more users")
     return {"message": f"Team {team.name} successfully deleted"}
 
 # CRUD endpoints for Roles
 @router.post("/roles", response_model=RoleInfo)
-async def create_role(role: RoleCreate, session: Session = Depends(get_session)):
+async def create_role(role: RoleCreate, session: Session | AsyncSession = Depends(get_db)):
     try:
-        db_role = create_role_in_db(session, role)
+        db_role = await run_query(session, create_role_in_db, role)
         return db_role
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
 
 @router.get("/roles/all", response_model=list[RoleInfo])
-async def read_roles(session: Session = Depends(get_session)):
-    roles = get_all_roles(session)
-    return roles
+async def read_roles(
+    request: Request, response: Response,
+    conditional: Conditional = Depends(conditional_get(Roles.__tablename__)),
+    page: PageParams = Depends(page_params(int)), session: Session | AsyncSession = Depends(get_read_db)
+):
+    async def load():
+        roles = await run_query(session, get_all_roles, page.fetch_limit, page.after)
+        return page.finish(roles, request, response, key=lambda role: (role.id,))
+    return await conditional.cached(RoleInfo, load)
 
 @router.get("/roles/{role_id}", response_model=RoleInfo)
-async def read_role(role_id: int, session: Session = Depends(get_session)):
-    role = session.get(Roles, role_id)
+async def read_role(role_id: int, session: Session | AsyncSession = Depends(get_read_db)):
+    role = await run_query(session, get_role_from_db, role_id)
     if not role:
          raise HTTPException(status_code=404, detail="Role not found")
     return role
 
 @router.patch("/roles/{role_id}", response_model=RoleInfo)
-async def update_role(role_id: int, role_update: RoleCreate, session: Session = Depends(get_session)):
+async def update_role(role_id: int, role_update: RoleCreate, session: Session | AsyncSession = Depends(get_db)):
     update_data = role_update.model_dump(exclude_unset=True)
     try:
-         role = update_role_in_db(session, role_id, update_data)
+         role = await run_query(session, update_role_in_db, role_id, update_data)
          if not role:
               raise HTTPException(status_code=404, detail="Role not found")
          return role
@@ -138,9 +269,9 @@ async def update_role(role_id: int, role_update: RoleCreate, session: Session =
          raise HTTPException(status_code=400, detail=str(e))
 
 @router.delete("/roles/{role_id}")
-async def delete_role(role_id: int, session: Session = Depends(get_session)):
+async def delete_role(role_id: int, session: Session | AsyncSession = Depends(get_db)):
     try:
-        return_message = delete_role_from_db(session, role_id)
+        return_message = await run_query(session, delete_role_from_db, role_id)
         return {"message": return_message}
     except ValueError:
         raise HTTPException(status_code=404, detail="Role not found")
@@ -153,10 +284,10 @@ async def delete_role(role_id: int, session: Session = Depends(get_session)):
 # CRUD endpoints for RolePermissions
 @router.post("/roles/permissions/", response_model=RolePermissions)
 async def add_role_permission(
-    role_permission: RolePermissionCreate, session: Session = Depends(get_session)
+    role_permission: RolePermissionCreate, session: Session | AsyncSession = Depends(get_db)
 ):
     try:
-        rp = create_role_permission_in_db(session, role_permission)
+        rp = await run_query(session, create_role_permission_in_db, role_permission)
         return rp
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
@@ -164,10 +295,10 @@ async def add_role_permission(
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.delete("/roles/permissions/", response_model=dict)
-async def remove_role_permission(role_id: int, permission: str, session: Session = Depends(get_session)
+async def remove_role_permission(role_id: int, permission: str, session: Session | AsyncSession = Depends(get_db)
 ):
     try:
-        delete_role_permission_from_db(session, role_id, permission)
+        await run_query(session, delete_role_permission_from_db, role_id, permission)
         return {
             "message": f"Role permission {permission} for Role ID {role_id} successfully deleted"
         }
@@ -176,21 +307,41 @@ async def remove_role_permission(role_id: int, permission: str, session: Session
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@router.put("/roles/{role_id}/permissions", response_model=list[RolePermissions])
+async def replace_role_permissions(
+    role_id: int, permissions: list[UserAction] = Body(...), session: Session | AsyncSession = Depends(get_db)
+):
+    try:
+        return await run_query(session, replace_role_permissions_in_db, role_id, set(permissions))
+    except ValueError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except IntegrityError:
+        raise HTTPException(status_code=409, detail="The role's permissions were changed concurrently, try again")
+
 @router.get("/roles/permissions/", response_model=list[RolePermissions])
-async def list_all_role_permissions(session: Session = Depends(get_session)):
-    permissions = get_all_role_permissions(session)
-    if not permissions:
-        raise HTTPException(status_code=404, detail="No role permissions found")
-    return permissions
+async def list_all_role_permissions(
+    request: Request, response: Response,
+    conditional: Conditional = Depends(conditional_get(RolePermissions.__tablename__)),
+    page: PageParams = Depends(page_params(int, UserAction)), session: Session | AsyncSession = Depends(get_read_db)
+):
+    async def load():
+        permissions = await run_query(session, get_all_role_permissions, page.fetch_limit, page.after)
+        if not permissions:
+            raise HTTPException(status_code=404, detail="No role permissions found")
+        return page.finish(permissions, request, response, key=lambda rp: (rp.role_id, rp.permission.value))
+    return await conditional.cached(RolePermissions, load)
 
 @router.get("/roles/permissions/by-name/{role_name}", response_model=list[RolePermissions])
-async def list_role_permissions_by_role_name(role_name: str, session: Session = Depends(get_session)):
-    stmt = select(Roles).where(Roles.name == role_name)
-    role = session.exec(stmt).first()
+async def list_role_permissions_by_role_name(
+    role_name: str,
+    conditional: Conditional = Depends(conditional_get(Roles.__tablename__, RolePermissions.__tablename__)),
+    session: Session | AsyncSession = Depends(get_read_db)
+):
+    role = await run_query(session, get_role_by_name_from_db, role_name)
     if not role or role.id is None:
         raise HTTPException(status_code=404, detail=f"Role with name {role_name} not found")
     
-    permissions = get_role_permissions_by_role(session, role.id)
+    permissions = await run_query(session, get_role_permissions_by_role, role.id)
     if not permissions:
         raise HTTPException(status_code=404, detail=f"No permissions found for role {role_name}")
-    return permissions
+    return conditional.respond(RolePermissions, permissions)
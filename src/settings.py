@@ -0,0 +1,154 @@
+import logging
+import os
+import tempfile
+from dataclasses import dataclass
+from functools import lru_cache
+
+logger = logging.getLogger(__name__)
+
+def _bool(value: str) -> bool:
+    return value.lower() in ("1", "true", "yes")
+
+def _list(value: str) -> list[str]:
+    return [item.strip() for item in value.split(",") if item.strip()]
+
+def _optional_int(value: str | None) -> int | None:
+    return int(value) if value else None
+
+@dataclass(frozen=True)
+class Settings:
+    """Every environment-driven option, read once per process by ``get_settings``."""
+    # Database
+    database_url: str
+    database_async_url: str | None
+    database_mode: str
+    database_read_urls: list[str]
+    database_async_read_urls: list[str]
+    read_your_writes_seconds: float
+    db_pool_size: int
+    db_max_overflow: int
+    db_pool_recycle: int
+    db_pool_pre_ping: bool
+    sqlite_profile: str
+    sqlite_maintenance_interval: float
+    # HTTP
+    allow_origins: list[str]
+    app_env: str
+    page_size_default: int
+    page_size_max: int
+    bulk_import_max_rows: int
+    bulk_import_batch_size: int
+    export_batch_size: int
+    requisition_decision_max_ids: int
+    # Auth
+    token_mode: str
+    refresh_token_key: str
+    refresh_token_expire_days: float
+    refresh_token_purge_interval: float
+    refresh_token_reuse_grace_seconds: float
+    auth_cache_ttl: float
+    role_cache_size: int
+    user_cache_size: int
+    token_cache_size: int
+    login_rate_per_username: float
+    login_burst_per_username: float
+    login_rate_per_ip: float
+    login_burst_per_ip: float
+    login_throttle_max_keys: int
+    response_cache_max_bytes: int
+    response_cache_ttl: float
+    # Password hashing
+    bcrypt_rounds: int
+    password_hash_executor: str
+    password_hash_workers: int | None
+    password_hash_max_concurrency: int | None
+    password_hash_queue_timeout: float
+    # Observability
+    metrics_enabled: bool
+    query_stats_enabled: bool
+    slow_query_ms: float
+    repeated_query_threshold: int
+    profile_sample_rate: float
+    profile_secret: str
+    profile_dir: str
+    profile_keep: int
+
+    @property
+    def development(self) -> bool:
+        return self.app_env in ("dev", "development")
+
+    @classmethod
+    def from_env(cls) -> "Settings":
+        env = os.environ.get
+        return cls(
+            database_url=env("DATABASE_URL") or "sqlite:///./eoffice.db",
+            database_async_url=env("DATABASE_ASYNC_URL") or None,
+            database_mode=env("DATABASE_MODE", "async").lower(),
+            database_read_urls=_list(env("DATABASE_READ_URLS", "")),
+            database_async_read_urls=_list(env("DATABASE_ASYNC_READ_URLS", "")),
+            read_your_writes_seconds=float(env("READ_YOUR_WRITES_SECONDS", "5")),
+            db_pool_size=int(env("DB_POOL_SIZE", "5")),
+            db_max_overflow=int(env("DB_MAX_OVERFLOW", "10")),
+            db_pool_recycle=int(env("DB_POOL_RECYCLE", "-1")),
+            db_pool_pre_ping=_bool(env("DB_POOL_PRE_PING", "false")),
+            sqlite_profile=env("SQLITE_PROFILE", "default").lower(),
+            sqlite_maintenance_interval=float(env("SQLITE_MAINTENANCE_INTERVAL", "300")),
+            allow_origins=env("ALLOW_ORIGINS", "").split(","),
+            app_env=env("APP_ENV", "production").lower(),
+            page_size_default=int(env("PAGE_SIZE_DEFAULT", "50")),
+            page_size_max=int(env("PAGE_SIZE_MAX", "500")),
+            bulk_import_max_rows=int(env("BULK_IMPORT_MAX_ROWS", "10000")),
+            bulk_import_batch_size=int(env("BULK_IMPORT_BATCH_SIZE", "500")),
+            export_batch_size=int(env("EXPORT_BATCH_SIZE", "1000")),
+            requisition_decision_max_ids=int(env("REQUISITION_DECISION_MAX_IDS", "1000")),
+            token_mode=env("TOKEN_MODE", "reference").lower(),
+            refresh_token_key=env("REFRESH_TOKEN_KEY", ""),
+            refresh_token_expire_days=float(env("REFRESH_TOKEN_EXPIRE_DAYS", "14")),
+            refresh_token_purge_interval=float(env("REFRESH_TOKEN_PURGE_INTERVAL", "3600")),
+            refresh_token_reuse_grace_seconds=float(env("REFRESH_TOKEN_REUSE_GRACE_SECONDS", "10")),
+            auth_cache_ttl=float(env("AUTH_CACHE_TTL", "60")),
+            role_cache_size=int(env("ROLE_CACHE_SIZE", "256")),
+            user_cache_size=int(env("USER_CACHE_SIZE", "1024")),
+            token_cache_size=int(env("TOKEN_CACHE_SIZE", "4096")),
+            login_rate_per_username=float(env("LOGIN_RATE_PER_USERNAME", "10")),
+            login_burst_per_username=float(env("LOGIN_BURST_PER_USERNAME", "5")),
+            login_rate_per_ip=float(env("LOGIN_RATE_PER_IP", "60")),
+            login_burst_per_ip=float(env("LOGIN_BURST_PER_IP", "20")),
+            login_throttle_max_keys=int(env("LOGIN_THROTTLE_MAX_KEYS", "10000")),
+            response_cache_max_bytes=int(env("RESPONSE_CACHE_MAX_BYTES", str(4 * 1024 * 1024))),
+            response_cache_ttl=float(env("RESPONSE_CACHE_TTL", "60")),
+            bcrypt_rounds=int(env("BCRYPT_ROUNDS", "12")),
+            password_hash_executor=env("PASSWORD_HASH_EXECUTOR", "thread").lower(),
+            password_hash_workers=_optional_int(env("PASSWORD_HASH_WORKERS")),
+            password_hash_max_concurrency=_optional_int(env("PASSWORD_HASH_MAX_CONCURRENCY")),
+            password_hash_queue_timeout=float(env("PASSWORD_HASH_QUEUE_TIMEOUT", "5")),
+            metrics_enabled=_bool(env("METRICS_ENABLED", "true")),
+            query_stats_enabled=_bool(env("QUERY_STATS_ENABLED", "true")),
+            slow_query_ms=float(env("SLOW_QUERY_MS", "200")),
+            repeated_query_threshold=int(env("REPEATED_QUERY_THRESHOLD", "10")),
+            profile_sample_rate=float(env("PROFILE_SAMPLE_RATE", "0")),
+            profile_secret=env("PROFILE_SECRET", ""),
+            profile_dir=env("PROFILE_DIR") or os.path.join(tempfile.gettempdir(), "eoffice-profiles"),
+            profile_keep=int(env("PROFILE_KEEP", "50")),
+        )
+
+def _load_dotenv() -> None:
+    # Imported here so modules that never need settings never pay for python-dotenv
+    from dotenv import find_dotenv, load_dotenv
+
+    dotenv_path = find_dotenv(usecwd=True)
+    if not dotenv_path:
+        logger.info("No .env file found, using the process environment only")
+        return
+    # Variables already set in the environment win over the file
+    load_dotenv(dotenv_path)
+
+@lru_cache(maxsize=1)
+def get_settings() -> Settings:
+    """Load .env and the environment once; later calls return the same object.
+
+    Nothing calls this at import time, so importing any module stays free of
+    file I/O. Tests that change the environment call ``get_settings.cache_clear()``.
+    """
+    _load_dotenv()
+    return Settings.from_env()
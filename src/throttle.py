@@ -0,0 +1,105 @@
+import math
+import threading
+import time
+from collections import OrderedDict
+from typing import Hashable
+from src.settings import Settings
+
+class LoginThrottled(Exception):
+    """Raised before a login attempt is verified when its username or client is over the limit."""
+
+    def __init__(self, retry_after: float):
+        super().__init__("Too many login attempts, try again later")
+        self.retry_after = retry_after
+
+class TokenBucketLimiter:
+    """Per-key token buckets holding at most ``maxsize`` keys.
+
+    Each key may spend ``burst`` attempts at once and then ``rate`` per
+    second. Keys are kept in LRU order and the least recently seen is
+    dropped past ``maxsize``; a dropped key comes back with a full bucket,
+    which is also what an idle key would have refilled to.
+    """
+
+    def __init__(self, rate: float, burst: float, maxsize: int):
+        self.rate = rate
+        self.burst = burst
+        self.maxsize = maxsize
+        # key -> (tokens left, monotonic time they were counted)
+        self._buckets: OrderedDict[Hashable, tuple[float, float]] = OrderedDict()
+        self._lock = threading.Lock()
+        self.allowed = 0
+        self.rejected = 0
+        self.evictions = 0
+
+    def acquire(self, key: Hashable) -> float:
+        """Spend one token for ``key``; returns 0 if allowed, else seconds until one is available."""
+        if self.rate <= 0:
+            return 0.0
+        now = time.monotonic()
+        with self._lock:
+            tokens, counted_at = self._buckets.get(key, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - counted_at) * self.rate)
+            if tokens >= 1:
+                tokens -= 1
+                retry_after = 0.0
+                self.allowed += 1
+            else:
+                retry_after = (1 - tokens) / self.rate
+                self.rejected += 1
+            self._buckets[key] = (tokens, now)
+            self._buckets.move_to_end(key)
+            while len(self._buckets) > self.maxsize:
+                self._buckets.popitem(last=False)
+                self.evictions += 1
+        return retry_after
+
+    def clear(self) -> None:
+        with self._lock:
+            self._buckets.clear()
+
+    def stats(self) -> dict:
+        return {
+            "keys": len(self._buckets),
+            "allowed": self.allowed,
+            "rejected": self.rejected,
+            "evictions": self.evictions,
+        }
+
+class LoginThrottle:
+    """Limits login attempts per username and per client IP, ahead of bcrypt."""
+
+    def __init__(self):
+        # Defaults; configure applies LOGIN_* settings at startup
+        self.by_username = TokenBucketLimiter(10 / 60, 5, 10000)
+        self.by_ip = TokenBucketLimiter(60 / 60, 20, 10000)
+
+    def configure(self, settings: Settings) -> None:
+        # Rates are configured per minute; a new app instance starts with empty buckets
+        for limiter, per_minute, burst in (
+            (self.by_username, settings.login_rate_per_username, settings.login_burst_per_username),
+            (self.by_ip, settings.login_rate_per_ip, settings.login_burst_per_ip),
+        ):
+            limiter.rate = per_minute / 60
+            limiter.burst = burst
+            limiter.maxsize = settings.login_throttle_max_keys
+            limiter.clear()
+
+    def check(self, username: str, client_ip: str | None) -> None:
+        # The IP bucket goes first so a flood against many usernames spends no per-user tokens
+        if client_ip is not None:
+            retry_after = self.by_ip.acquire(client_ip)
+            if retry_after:
+                raise LoginThrottled(retry_after)
+        retry_after = self.by_username.acquire(username.lower())
+        if retry_after:
+            raise LoginThrottled(retry_after)
+
+    def stats(self) -> dict:
+        return {"username": self.by_username.stats(), "ip": self.by_ip.stats()}
+
+def retry_after_header(seconds: float) -> str:
+    # Retry-After takes whole seconds; rounding down would invite an early retry
+    return str(max(1, math.ceil(seconds)))
+
+login_throttle = LoginThrottle()
@@ -5,11 +5,29 @@ from fastapi.testclient import TestClient
 from sqlmodel import SQLModel
 from src.main import app
 from src.models import create_db_connection, create_admin_user
+from src.settings import get_settings
+
+@pytest.fixture(autouse=True)
+def settings_env(monkeypatch):
+    """Override environment variables for one test; settings are reloaded around it."""
+    def override(**values):
+        for key, value in values.items():
+            monkeypatch.setenv(key, str(value))
+        get_settings.cache_clear()
+
+    get_settings.cache_clear()
+    yield override
+    get_settings.cache_clear()
+
+@pytest.fixture
+def db_mode():
+    # Parametrize a test with "db_mode" to run it against a specific data-access path
+    return os.getenv("DATABASE_MODE", "async")
 
 @pytest.fixture(name="engine")
-def engine_fixture(monkeypatch):
+def engine_fixture(settings_env, db_mode):
     # Override the DATABASE_URL to use the test database file
-    monkeypatch.setenv("DATABASE_URL", "sqlite:///./tests/test_eoffice.db")
+    settings_env(DATABASE_URL="sqlite:///./tests/test_eoffice.db", DATABASE_MODE=db_mode)
     engine = create_db_connection()
     yield engine
 
@@ -99,3 +117,22 @@ def access_type_data():
         "type": "Read",
         "description": "Read access"
     }
+
+@pytest.fixture
+def count_statements(engine):
+    """Record every SQL statement the sync engine executes inside a ``with`` block."""
+    from contextlib import contextmanager
+    from sqlalchemy import event
+
+    @contextmanager
+    def counter():
+        statements = []
+        def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+        event.listen(engine, "before_cursor_execute", before_cursor_execute)
+        try:
+            yield statements
+        finally:
+            event.remove(engine, "before_cursor_execute", before_cursor_execute)
+
+    return counter
@@ -0,0 +1,394 @@
+import hashlib
+import time
+from datetime import timedelta
+import pytest
+from jose import jwt, JWTError
+from src.auth import create_access_token, decode_access_token
+from src.cache import role_permissions_cache, user_principal_cache, verified_token_cache, TTLCache, current_permission_epoch
+
+def admin_role_id(client, auth_headers):
+    response = client.get("/users/roles/all", headers=auth_headers)
+    assert response.status_code == 200
+    return next(role["id"] for role in response.json() if role["name"] == "user_admin")
+
+def test_repeated_requests_hit_auth_cache(client, auth_headers):
+    client.get("/users/teams/", headers=auth_headers)
+    hits = role_permissions_cache.hits
+    response = client.get("/users/teams/", headers=auth_headers)
+    assert response.status_code == 200
+    assert role_permissions_cache.hits == hits + 1
+    assert user_principal_cache.get("admin") is not None
+
+def test_removing_permission_takes_effect_immediately(client, auth_headers):
+    role_id = admin_role_id(client, auth_headers)
+    response = client.delete(
+        "/users/roles/permissions/",
+        params={"role_id": role_id, "permission": "manage_user"},
+        headers=auth_headers,
+    )
+    assert response.status_code == 200
+
+    response = client.get("/users/teams/", headers=auth_headers)
+    assert response.status_code == 403
+
+def test_deactivated_user_is_rejected(client, user_data, auth_headers):
+    role_id = admin_role_id(client, auth_headers)
+    user_data["role_id"] = role_id
+    response = client.post("/users", json=user_data, headers=auth_headers)
+    assert response.status_code == 200
+
+    response = client.post("/auth/token", data={"username": user_data["username"], "password": user_data["password"]})
+    user_headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+    assert client.get("/users/teams/", headers=user_headers).status_code == 200
+
+    response = client.patch(f"/users/{user_data['username']}", json={"is_active": False}, headers=auth_headers)
+    assert response.status_code == 200
+    assert client.get("/users/teams/", headers=user_headers).status_code == 401
+
+def test_deactivated_user_gets_no_tokens(client, user_data, auth_headers, engine):
+    from sqlmodel import Session, select
+    from src.models import RefreshTokens
+
+    assert client.post("/users", json=user_data, headers=auth_headers).status_code == 200
+    response = client.patch(f"/users/{user_data['username']}", json={"is_active": False}, headers=auth_headers)
+    assert response.status_code == 200
+    with Session(engine) as session:
+        stored = len(session.exec(select(RefreshTokens)).all())
+
+    response = client.post("/auth/token", data={"username": user_data["username"], "password": user_data["password"]})
+    assert response.status_code == 401
+    with Session(engine) as session:
+        assert len(session.exec(select(RefreshTokens)).all()) == stored
+
+def test_admin_stats(client, auth_headers):
+    response = client.get("/admin/stats", headers=auth_headers)
+    assert response.status_code == 200
+    data = response.json()
+    assert {"hits", "misses", "evictions"} <= data["auth_cache"]["role_permissions"].keys()
+    assert "queue_depth" in data["password_hasher"]
+
+def test_ttl_cache_evicts_least_recently_used():
+    cache = TTLCache(maxsize=2, ttl=60)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.get("a") == 1
+    cache.set("c", 3)
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    assert cache.evictions == 1
+
+def test_ttl_cache_expires_entries():
+    cache = TTLCache(maxsize=2, ttl=0)
+    cache.set("a", 1)
+    assert cache.get("a") is None
+    assert cache.expirations == 1
+
+def claims_token(client, settings_env, admin_user):
+    settings_env(TOKEN_MODE="claims")
+    response = client.post("/auth/token", data=admin_user)
+    assert response.status_code == 200
+    return response.json()["access_token"]
+
+def test_claims_token_authorizes_without_database(client, settings_env, admin_user):
+    token = claims_token(client, settings_env, admin_user)
+    payload = jwt.get_unverified_claims(token)
+    assert payload["perms"] == ["manage_user"]
+    assert payload["pe"] == current_permission_epoch()
+
+    misses = user_principal_cache.misses
+    user_principal_cache.clear()
+    response = client.get("/users/teams/", headers={"Authorization": f"Bearer {token}"})
+    assert response.status_code == 200
+    assert user_principal_cache.misses == misses
+
+def test_stale_claims_token_falls_back_to_database(client, settings_env, admin_user, auth_headers):
+    token = claims_token(client, settings_env, admin_user)
+    role_id = admin_role_id(client, auth_headers)
+    response = client.delete(
+        "/users/roles/permissions/",
+        params={"role_id": role_id, "permission": "manage_user"},
+        headers=auth_headers,
+    )
+    assert response.status_code == 200
+
+    response = client.get("/users/teams/", headers={"Authorization": f"Bearer {token}"})
+    assert response.status_code == 403
+
+def test_deactivated_user_cannot_log_in_for_claims_token(client, settings_env, user_data, auth_headers):
+    settings_env(TOKEN_MODE="claims")
+    user_data["role_id"] = admin_role_id(client, auth_headers)
+    assert client.post("/users", json=user_data, headers=auth_headers).status_code == 200
+    response = client.patch(f"/users/{user_data['username']}", json={"is_active": False}, headers=auth_headers)
+    assert response.status_code == 200
+
+    response = client.post("/auth/token", data={"username": user_data["username"], "password": user_data["password"]})
+    assert response.status_code == 401
+    assert "access_token" not in response.json()
+
+def test_repeated_token_skips_verification(client, auth_headers):
+    client.get("/users/teams/", headers=auth_headers)
+    hits = verified_token_cache.hits
+    client.get("/users/teams/", headers=auth_headers)
+    assert verified_token_cache.hits == hits + 1
+
+def test_cached_token_is_not_used_after_expiry():
+    token = create_access_token({"sub": "admin"}, expires_delta=timedelta(seconds=30))
+    payload = decode_access_token(token)
+    key = hashlib.sha256(token.encode()).digest()
+    assert verified_token_cache.get(key) == payload
+
+    # A cached payload past its exp is ignored and the token is verified again
+    verified_token_cache.set(key, dict(payload, exp=time.time() - 1))
+    assert decode_access_token(token)["exp"] == payload["exp"]
+
+def test_expired_token_is_rejected():
+    token = create_access_token({"sub": "admin"}, expires_delta=timedelta(seconds=-1))
+    with pytest.raises(JWTError):
+        decode_access_token(token)
+
+def test_metrics_endpoint(client, auth_headers):
+    assert client.get("/users/teams/", headers=auth_headers).status_code == 200
+    assert client.get("/users/teams/missing", headers=auth_headers).status_code == 404
+
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain; version=0.0.4")
+    body = response.text
+    assert 'http_requests_total{method="GET",route="/users/teams/",status="2xx"}' in body
+    assert 'http_requests_total{method="GET",route="/users/teams/{team_name}",status="4xx"}' in body
+    assert 'http_request_duration_seconds_bucket{method="GET",route="/users/teams/",le="+Inf"}' in body
+    assert "http_requests_in_flight 1" in body
+    assert 'db_pool_checkout_seconds_count{engine="sync"}' in body
+    # The login done by the auth_token fixture went through the bcrypt queue
+    assert "password_hash_queue_seconds_count 0\n" not in body
+
+def test_metrics_pool_checkouts_survive_dispose():
+    import asyncio
+    from sqlalchemy import create_engine, text
+    from src.dependency import session_scope
+    from src.metrics import Metrics, metrics
+
+    engine = create_engine("sqlite://")
+    local = Metrics()
+    local.instrument_engine("probe", engine)
+    with engine.connect() as connection:
+        connection.execute(text("SELECT 1"))
+    # A rebuilt pool keeps the listeners registered on the engine
+    engine.dispose()
+    with engine.connect() as connection:
+        connection.execute(text("SELECT 1"))
+    assert local.pool_checkouts["probe"] == 2
+    assert local.pool_connects["probe"] == 2
+    body = local.render()
+    assert 'db_pool_checkouts_total{engine="probe"} 2' in body
+    assert 'db_pool_connections_opened_total{engine="probe"} 2' in body
+
+    # Sessions opened through session_scope time the wait for their connection
+    metrics.instrument_engine("probe", engine)
+    async def open_one():
+        async with session_scope(engine) as session:
+            session.exec(text("SELECT 1"))
+    try:
+        asyncio.run(open_one())
+        assert metrics.pool_checkout["probe"].count == 1
+    finally:
+        for registry in (metrics.pool_checkout, metrics.pool_checkouts, metrics.pool_connects, metrics._engines):
+            registry.pop("probe")
+        metrics._engine_names.pop(engine)
+
+def test_metrics_histogram_buckets():
+    from src.metrics import Histogram
+
+    histogram = Histogram((0.1, 1.0))
+    for value in (0.05, 0.1, 0.5, 2.0):
+        histogram.observe(value)
+    lines = list(histogram.render("latency", route="/x"))
+    assert lines[:3] == [
+        'latency_bucket{route="/x",le="0.1"} 2',
+        'latency_bucket{route="/x",le="1.0"} 3',
+        'latency_bucket{route="/x",le="+Inf"} 4',
+    ]
+    assert lines[-1] == 'latency_count{route="/x"} 4'
+
+def test_profile_requested_by_header(client, auth_headers, settings_env, tmp_path):
+    settings_env(PROFILE_SECRET="let-me-profile", PROFILE_DIR=tmp_path, PROFILE_KEEP=2)
+
+    assert "X-Profile-Id" not in client.get("/users/teams/", headers=auth_headers).headers
+    wrong = client.get("/users/teams/", headers={**auth_headers, "X-Profile": "guess"})
+    assert "X-Profile-Id" not in wrong.headers
+
+    profile_ids = []
+    for _ in range(3):
+        response = client.get("/users/roles/all", headers={**auth_headers, "X-Profile": "let-me-profile"})
+        assert response.status_code == 200
+        profile_ids.append(response.headers["X-Profile-Id"])
+
+    # Only the newest PROFILE_KEEP profiles are kept
+    listed = [profile["id"] for profile in client.get("/admin/profiles", headers=auth_headers).json()]
+    assert sorted(listed) == sorted(profile_ids[1:])
+
+    response = client.get(f"/admin/profiles/{profile_ids[-1]}", params={"format": "text"}, headers=auth_headers)
+    assert response.status_code == 200
+    assert "function calls" in response.text
+    response = client.get(f"/admin/profiles/{profile_ids[-1]}", headers=auth_headers)
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/octet-stream"
+
+    assert client.get("/admin/profiles/..%2F..%2Fetc%2Fpasswd", headers=auth_headers).status_code == 404
+    assert client.get("/admin/profiles").status_code == 401
+
+def test_profile_sampling(client, auth_headers, settings_env, tmp_path):
+    settings_env(PROFILE_SAMPLE_RATE=1.0, PROFILE_DIR=tmp_path)
+    response = client.get("/users/teams/", headers=auth_headers)
+    assert (tmp_path / f"{response.headers['X-Profile-Id']}.prof").is_file()
+
+def test_profile_keep_zero_keeps_latest(client, auth_headers, settings_env, tmp_path):
+    settings_env(PROFILE_SAMPLE_RATE=1.0, PROFILE_DIR=tmp_path, PROFILE_KEEP=0)
+    for _ in range(2):
+        response = client.get("/users/teams/", headers=auth_headers)
+    assert [path.stem for path in tmp_path.glob("*.prof")] == [response.headers["X-Profile-Id"]]
+
+def test_login_throttled_before_hashing(client, admin_user, settings_env, monkeypatch):
+    from src.settings import get_settings
+    from src.throttle import login_throttle
+
+    settings_env(LOGIN_BURST_PER_USERNAME=2, LOGIN_RATE_PER_USERNAME=1)
+    login_throttle.configure(get_settings())
+    wrong = {"username": "admin", "password": "wrong"}
+    assert client.post("/auth/token", data=wrong).status_code == 401
+    assert client.post("/auth/token", data=wrong).status_code == 401
+
+    async def verify(*args):
+        raise AssertionError("a throttled login reached bcrypt")
+    monkeypatch.setattr("src.auth.password_hasher.verify", verify)
+    # Usernames are throttled case-insensitively, even with the right password
+    response = client.post("/auth/token", data={**admin_user, "username": "ADMIN"})
+    assert response.status_code == 429
+    assert int(response.headers["Retry-After"]) >= 1
+    assert login_throttle.stats()["username"]["rejected"] == 1
+
+def test_login_throttled_per_ip(client, settings_env):
+    from src.settings import get_settings
+    from src.throttle import login_throttle
+
+    settings_env(LOGIN_BURST_PER_IP=3, LOGIN_RATE_PER_IP=1)
+    login_throttle.configure(get_settings())
+    statuses = [client.post("/auth/token", data={"username": f"user{i}", "password": "x"}).status_code for i in range(4)]
+    assert statuses == [401, 401, 401, 429]
+    assert 'login_throttled_total{key="ip"} 1' in client.get("/metrics").text
+
+def test_token_bucket_memory_is_bounded():
+    from src.throttle import TokenBucketLimiter
+
+    limiter = TokenBucketLimiter(rate=1, burst=1, maxsize=2)
+    for key in ("a", "b", "c"):
+        assert limiter.acquire(key) == 0
+    assert limiter.stats()["keys"] == 2
+    assert limiter.evictions == 1
+    assert 0 < limiter.acquire("c") <= 1
+
+def login(client, credentials):
+    response = client.post("/auth/token", data=credentials)
+    assert response.status_code == 200
+    return response.json()
+
+def test_refresh_rotates_without_hashing(client, admin_user, engine, monkeypatch, settings_env):
+    from sqlmodel import Session, select
+    from src.models import RefreshTokens
+
+    tokens = login(client, admin_user)
+    with Session(engine) as session:
+        stored = session.exec(select(RefreshTokens.token_hash)).all()
+    # Only a keyed hash of the opaque token is stored
+    assert tokens["refresh_token"] not in stored and len(stored) == 2
+
+    async def verify(*args):
+        raise AssertionError("refresh ran bcrypt")
+    monkeypatch.setattr("src.auth.password_hasher.verify", verify)
+    response = client.post("/auth/refresh", data={"refresh_token": tokens["refresh_token"]})
+    assert response.status_code == 200
+    refreshed = response.json()
+    assert refreshed["refresh_token"] != tokens["refresh_token"]
+    headers = {"Authorization": f"Bearer {refreshed['access_token']}"}
+    assert client.get("/users/teams/", headers=headers).status_code == 200
+
+    # The spent token is refused, and replaying it revokes its successor too
+    settings_env(REFRESH_TOKEN_REUSE_GRACE_SECONDS=0)
+    assert client.post("/auth/refresh", data={"refresh_token": tokens["refresh_token"]}).status_code == 401
+    assert client.post("/auth/refresh", data={"refresh_token": refreshed["refresh_token"]}).status_code == 401
+
+def test_concurrent_refresh_keeps_the_winner_logged_in(client, admin_user):
+    tokens = login(client, admin_user)
+    winner = client.post("/auth/refresh", data={"refresh_token": tokens["refresh_token"]})
+    assert winner.status_code == 200
+    # A second tab presents the same token moments later: refused, but the family survives
+    assert client.post("/auth/refresh", data={"refresh_token": tokens["refresh_token"]}).status_code == 401
+    assert client.post("/auth/refresh", data={"refresh_token": winner.json()["refresh_token"]}).status_code == 200
+
+def test_revoked_refresh_token_is_refused(client, admin_user):
+    tokens = login(client, admin_user)
+    assert client.post("/auth/revoke", data={"refresh_token": tokens["refresh_token"]}).status_code == 200
+    assert client.post("/auth/refresh", data={"refresh_token": tokens["refresh_token"]}).status_code == 401
+    assert client.post("/auth/refresh", data={"refresh_token": "not-a-token"}).status_code == 401
+
+def test_expired_refresh_tokens_are_purged(client, admin_user, engine):
+    from sqlmodel import Session, select
+    from src.db_queries.tokens import purge_expired_refresh_tokens_in_db
+    from src.models import RefreshTokens
+
+    tokens = login(client, admin_user)
+    # Spend one token so the table holds a spent and a live row for the same family
+    assert client.post("/auth/refresh", data={"refresh_token": tokens["refresh_token"]}).status_code == 200
+    with Session(engine) as session:
+        rows = len(session.exec(select(RefreshTokens)).all())
+        assert purge_expired_refresh_tokens_in_db(session) == 0
+        # Spent tokens stay until they expire, so replaying one is still detected
+        assert len(session.exec(select(RefreshTokens)).all()) == rows
+
+        latest = max(token.expires_at for token in session.exec(select(RefreshTokens)).all())
+        assert purge_expired_refresh_tokens_in_db(session, now=latest) == rows
+        assert session.exec(select(RefreshTokens)).all() == []
+
+def test_password_change_revokes_refresh_tokens(client, user_data, auth_headers):
+    assert client.post("/users/", json=user_data, headers=auth_headers).status_code == 200
+    tokens = login(client, {"username": user_data["username"], "password": user_data["password"]})
+    response = client.patch(f"/users/{user_data['username']}", json={"password": "changed-password"}, headers=auth_headers)
+    assert response.status_code == 200
+    assert client.post("/auth/refresh", data={"refresh_token": tokens["refresh_token"]}).status_code == 401
+
+def test_login_rehashes_to_configured_cost(client, admin_user, engine, settings_env):
+    from sqlmodel import Session, select
+    from src.models import Users
+    from src.passwords import password_hasher
+
+    def stored_hash():
+        with Session(engine) as session:
+            return session.exec(select(Users.password).where(Users.username == "admin")).one()
+
+    assert stored_hash().startswith("$2b$12$")
+    settings_env(BCRYPT_ROUNDS=4)
+    rehashed = password_hasher.rehashed
+    # The test client runs background tasks before returning, so the new hash is already stored
+    assert client.post("/auth/token", data=admin_user).status_code == 200
+    assert stored_hash().startswith("$2b$04$")
+    assert password_hasher.rehashed == rehashed + 1
+
+    # Already at the target cost: nothing more to do
+    assert client.post("/auth/token", data=admin_user).status_code == 200
+    assert password_hasher.rehashed == rehashed + 1
+
+def test_failed_rehash_is_dropped(client, admin_user, settings_env, monkeypatch):
+    settings_env(BCRYPT_ROUNDS=4)
+
+    async def shut_down(password):
+        raise RuntimeError("cannot schedule new futures after shutdown")
+    monkeypatch.setattr("src.auth.password_hasher.rehash", shut_down)
+    # The test client would re-raise an exception escaping the background task
+    assert client.post("/auth/token", data=admin_user).status_code == 200
+
+def test_rehash_never_overwrites_a_changed_password(engine, admin_user):
+    from sqlmodel import Session
+    from src.db_queries.users import update_password_hash_in_db
+
+    with Session(engine) as session:
+        assert not update_password_hash_in_db(session, "admin", "$2b$04$stale", "$2b$04$new")
@@ -0,0 +1,22 @@
+from benchmarks.compare import compare
+from benchmarks.run import percentile, summarize
+
+def _result(throughput: float, p95: float, errors: int = 0) -> dict:
+    return {
+        "meta": {"users": 1000, "concurrency": 16, "database_mode": "async"},
+        "scenarios": {"list_teams": {"throughput_rps": throughput, "errors": errors, "latency_ms": {"p95": p95}}},
+    }
+
+def test_summarize_percentiles():
+    summary = summarize([i / 1000 for i in range(1, 101)], errors=2, elapsed=2.0)
+    assert summary["requests"] == 100
+    assert summary["throughput_rps"] == 50.0
+    assert summary["latency_ms"]["p50"] == 50.0
+    assert summary["latency_ms"]["p99"] == 99.0
+    assert percentile([], 0.5) == 0.0
+
+def test_compare_flags_regressions():
+    baseline = _result(throughput=100, p95=10)
+    assert compare(_result(throughput=90, p95=11), baseline, threshold=0.25)[0]["regression"] == ""
+    assert compare(_result(throughput=70, p95=10), baseline, threshold=0.25)[0]["regression"] == "throughput"
+    assert compare(_result(throughput=100, p95=13, errors=1), baseline, threshold=0.25)[0]["regression"] == "p95, errors"
@@ -0,0 +1,225 @@
+import shutil
+import sqlite3
+import pytest
+from fastapi.testclient import TestClient
+from sqlmodel import text
+from src.main import app
+from src.models import create_db_connection, sqlite_maintenance
+
+def test_engine_is_shared_across_requests(client, auth_headers):
+    engine = app.state.engine
+    response = client.get("/users/teams/", headers=auth_headers)
+    assert response.status_code == 200
+    response = client.get("/users/roles/all", headers=auth_headers)
+    assert response.status_code == 200
+    assert app.state.engine is engine
+
+def test_foreign_keys_enabled_on_every_pooled_connection(engine):
+    connections = [engine.connect() for _ in range(3)]
+    try:
+        for connection in connections:
+            assert connection.execute(text("PRAGMA foreign_keys")).scalar() == 1
+    finally:
+        for connection in connections:
+            connection.close()
+
+def test_pool_options_from_environment(settings_env):
+    settings_env(DATABASE_URL="sqlite:///./tests/test_eoffice.db", DB_POOL_SIZE=3, DB_MAX_OVERFLOW=2, DB_POOL_PRE_PING="true")
+    engine = create_db_connection()
+    try:
+        assert engine.pool.size() == 3
+        assert engine.pool._max_overflow == 2
+        assert engine.pool._pre_ping is True
+    finally:
+        engine.dispose()
+
+def test_sqlite_performance_profile(settings_env, tmp_path):
+    settings_env(DATABASE_URL=f"sqlite:///{tmp_path / 'profile.db'}", SQLITE_PROFILE="performance")
+    engine = create_db_connection()
+    try:
+        with engine.connect() as connection:
+            pragma = lambda name: connection.execute(text(f"PRAGMA {name}")).scalar()
+            assert pragma("journal_mode") == "wal"
+            assert pragma("synchronous") == 1  # NORMAL
+            assert pragma("busy_timeout") == 5000
+            assert pragma("cache_size") == -65536
+            assert pragma("temp_store") == 2  # MEMORY
+            assert pragma("mmap_size") == 256 * 1024 * 1024
+            assert pragma("foreign_keys") == 1
+
+            connection.execute(text("CREATE TABLE t (x INTEGER)"))
+            connection.execute(text("INSERT INTO t VALUES (1)"))
+            connection.commit()
+        busy, frames, checkpointed = sqlite_maintenance(engine)
+        assert busy == 0 and frames > 0 and checkpointed == frames
+    finally:
+        engine.dispose()
+
+@pytest.mark.parametrize("profile, started", [("default", False), ("wal", True)])
+def test_sqlite_maintenance_only_in_wal_mode(settings_env, tmp_path, monkeypatch, profile, started):
+    from sqlmodel import SQLModel
+
+    settings_env(DATABASE_URL=f"sqlite:///{tmp_path / 'maintenance.db'}", SQLITE_PROFILE=profile, DATABASE_MODE="sync")
+    engine = create_db_connection()
+    SQLModel.metadata.create_all(engine)
+    engine.dispose()
+    runs = []
+    async def record(engine, interval):
+        runs.append(interval)
+    monkeypatch.setattr("src.main.run_sqlite_maintenance", record)
+    with TestClient(app):
+        pass
+    assert bool(runs) == started
+
+def test_sqlite_maintenance_survives_unexpected_errors(monkeypatch):
+    import asyncio
+    from src.main import run_sqlite_maintenance
+
+    calls = []
+    def flaky(engine):
+        calls.append(engine)
+        if len(calls) == 1:
+            raise RuntimeError("disk went away")
+        return (0, 0, 0)
+    monkeypatch.setattr("src.main.sqlite_maintenance", flaky)
+
+    async def run():
+        task = asyncio.create_task(run_sqlite_maintenance(None, 0.001))
+        for _ in range(500):
+            if len(calls) >= 2 or task.done():
+                break
+            await asyncio.sleep(0.01)
+        assert not task.done()
+        task.cancel()
+    asyncio.run(run())
+    assert len(calls) >= 2
+
+def test_unknown_sqlite_profile(settings_env):
+    settings_env(DATABASE_URL="sqlite:///./tests/test_eoffice.db", SQLITE_PROFILE="fastest")
+    with pytest.raises(ValueError, match="SQLITE_PROFILE"):
+        create_db_connection()
+
+@pytest.mark.parametrize("db_mode", ["sync", "async"])
+def test_crud_round_trip_in_each_database_mode(client, user_data, auth_headers, db_mode):
+    assert (app.state.async_engine is not None) == (db_mode == "async")
+
+    response = client.post("/users", json=user_data, headers=auth_headers)
+    assert response.status_code == 200
+
+    response = client.patch(f"/users/{user_data['username']}", json={"first_name": "Renamed"}, headers=auth_headers)
+    assert response.status_code == 200
+    assert response.json()["first_name"] == "Renamed"
+
+    response = client.get(f"/users/{user_data['username']}", headers=auth_headers)
+    assert response.status_code == 200
+    assert response.json()[0]["first_name"] == "Renamed"
+
+    response = client.delete(f"/users/{user_data['username']}", headers=auth_headers)
+    assert response.status_code == 200
+
+def test_server_timing_counts_statements(client, auth_headers, user_data):
+    assert client.post("/users/", json=user_data, headers=auth_headers).status_code == 200
+
+    response = client.patch(f"/users/{user_data['username']}", json={"first_name": "Renamed"}, headers=auth_headers)
+    assert response.status_code == 200
+    timing = response.headers["Server-Timing"]
+    assert timing.startswith("db;dur=")
+    # One UPDATE ... RETURNING; the caller's principal comes from the auth cache
+    assert timing.endswith('desc="1 statements"')
+
+def test_slow_query_log_redacts_parameters(client, auth_headers, user_data, settings_env, caplog):
+    import logging
+
+    settings_env(SLOW_QUERY_MS=0)
+    with caplog.at_level(logging.WARNING, logger="src.query_stats"):
+        assert client.post("/users/", json=user_data, headers=auth_headers).status_code == 200
+
+    slow = [record.getMessage() for record in caplog.records if record.getMessage().startswith("Slow query")]
+    assert any("INSERT INTO users" in message for message in slow)
+    assert not any(user_data["email"] in message for message in slow)
+    assert any("<str>" in message for message in slow)
+
+def test_repeated_statement_warning(settings_env, caplog):
+    import asyncio
+    import logging
+    from src.query_stats import QueryStatsMiddleware, current_query_stats
+
+    settings_env(APP_ENV="development", REPEATED_QUERY_THRESHOLD=2)
+
+    async def app(scope, receive, send):
+        stats = current_query_stats.get()
+        stats.shapes.update(["SELECT * FROM roles WHERE id = ?"] * 3 + ["SELECT 1"])
+        await send({"type": "http.response.start", "status": 200, "headers": []})
+
+    messages = []
+    async def send(message):
+        messages.append(message)
+
+    scope = {"type": "http", "method": "GET", "path": "/users/roles/permissions/by-name/admin"}
+    with caplog.at_level(logging.WARNING, logger="src.query_stats"):
+        asyncio.run(QueryStatsMiddleware(app)(scope, None, send))
+
+    warnings = [record.getMessage() for record in caplog.records]
+    assert len(warnings) == 1
+    assert "ran the same statement 3 times: SELECT * FROM roles WHERE id = ?" in warnings[0]
+    assert (b"server-timing", b'db;dur=0.00;desc="0 statements"') in messages[0]["headers"]
+
+@pytest.fixture
+def replicas(client, settings_env, tmp_path):
+    """Two file-copy replicas of the test database, taken once the admin exists."""
+    paths = [tmp_path / f"replica{i}.db" for i in range(2)]
+    for path in paths:
+        shutil.copy("tests/test_eoffice.db", path)
+    settings_env(DATABASE_READ_URLS=",".join(f"sqlite:///{path}" for path in paths))
+    return paths
+
+def add_team_directly(path, name):
+    with sqlite3.connect(path) as connection:
+        connection.execute("INSERT INTO teams (name, description) VALUES (?, 'replica only')", (name,))
+
+def test_reads_round_robin_over_replicas(replicas, auth_headers):
+    # Only the second replica has this team, so the answer shows which one served the read
+    add_team_directly(replicas[1], "replicated")
+    with TestClient(app) as client:
+        statuses = {client.get("/users/teams/replicated", headers=auth_headers).status_code for _ in range(4)}
+        assert statuses == {200, 404}
+
+        # Replicas are read-only even if a write were routed to one
+        with app.state.read_engines[0].connect() as connection:
+            with pytest.raises(Exception, match="readonly"):
+                connection.execute(text("DELETE FROM teams"))
+
+def test_writer_reads_its_own_writes(replicas, auth_headers):
+    with TestClient(app) as client:
+        response = client.post("/users/teams/", json={"name": "fresh", "description": "primary only"}, headers=auth_headers)
+        assert response.status_code == 200
+        # Within READ_YOUR_WRITES_SECONDS the writer's reads stay on the primary
+        for _ in range(4):
+            assert client.get("/users/teams/fresh", headers=auth_headers).status_code == 200
+
+def test_writer_reads_its_own_writes_on_another_worker(replicas, auth_headers):
+    from src.cache import recent_writers
+
+    with TestClient(app) as client:
+        response = client.post("/users/teams/", json={"name": "fresh", "description": "primary only"}, headers=auth_headers)
+        assert response.status_code == 200
+        assert "last_write" in response.cookies
+        # Another worker never saw the write; the signed cookie keeps the reads on the primary
+        recent_writers.clear()
+        for _ in range(4):
+            assert client.get("/users/teams/fresh", headers=auth_headers).status_code == 200
+
+        # A forged cookie is ignored
+        written_at = client.cookies["last_write"].rpartition(".")[0]
+        client.cookies.set("last_write", f"{written_at}.{'0' * 64}")
+        statuses = {client.get("/users/teams/fresh", headers=auth_headers).status_code for _ in range(4)}
+        assert statuses == {404}
+
+def test_reads_leave_primary_after_window(replicas, auth_headers, settings_env):
+    settings_env(READ_YOUR_WRITES_SECONDS=0)
+    with TestClient(app) as client:
+        response = client.post("/users/teams/", json={"name": "fresh", "description": "primary only"}, headers=auth_headers)
+        assert response.status_code == 200
+        # With no window the replicas, which never saw the write, answer every read
+        for _ in range(4):
+            assert client.get("/users/teams/fresh", headers=auth_headers).status_code == 404
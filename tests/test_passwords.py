@@ -0,0 +1,53 @@
+import asyncio
+import pytest
+from src.passwords import PasswordHasher, PasswordHasherBusy, verify_password_sync
+
+def test_hash_and_verify_on_worker_pool():
+    async def scenario():
+        hasher = PasswordHasher(max_workers=2)
+        hasher.start()
+        try:
+            hashed = await hasher.hash("secret")
+            assert await hasher.verify("secret", hashed)
+            assert not await hasher.verify("wrong", hashed)
+            return hashed, hasher.stats()
+        finally:
+            hasher.shutdown()
+
+    hashed, stats = asyncio.run(scenario())
+    assert verify_password_sync("secret", hashed)
+    assert stats["completed"] == 3
+    assert stats["queue_depth"] == 0
+    assert stats["in_flight"] == 0
+    assert stats["run_seconds_total"] > 0
+
+def test_queued_requests_time_out_when_pool_is_saturated():
+    async def scenario():
+        hasher = PasswordHasher(max_workers=1, max_concurrency=1, queue_timeout=0.01)
+        hasher.start()
+        try:
+            results = await asyncio.gather(
+                hasher.hash("first"), hasher.hash("second"), return_exceptions=True
+            )
+            return results, hasher.stats()
+        finally:
+            hasher.shutdown()
+
+    results, stats = asyncio.run(scenario())
+    assert any(isinstance(result, PasswordHasherBusy) for result in results)
+    assert any(isinstance(result, str) for result in results)
+    assert stats["rejected"] == 1
+
+def test_invalid_executor_kind():
+    with pytest.raises(ValueError):
+        PasswordHasher(executor_kind="fiber")
+
+def test_updated_password_is_hashed(client, user_data, auth_headers):
+    response = client.post("/users", json=user_data, headers=auth_headers)
+    assert response.status_code == 200
+
+    response = client.patch(f"/users/{user_data['username']}", json={"password": "newpassword"}, headers=auth_headers)
+    assert response.status_code == 200
+
+    response = client.post("/auth/token", data={"username": user_data["username"], "password": "newpassword"})
+    assert response.status_code == 200
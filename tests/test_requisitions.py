@@ -0,0 +1,174 @@
+import pytest
+from jose import jwt
+from sqlalchemy import text
+from src.auth import create_access_token
+
+@pytest.fixture
+def team_ids(client, auth_headers):
+    ids = []
+    for name in ("Purchasing", "Facilities"):
+        response = client.post("/users/teams/", json={"name": name, "description": name}, headers=auth_headers)
+        assert response.status_code == 200
+        ids.append(response.json()["id"])
+    return ids
+
+@pytest.fixture
+def workflow_roles(client, auth_headers):
+    roles = {}
+    for name, permissions in (
+        ("requester", ["create_requisition"]),
+        ("approver", ["create_requisition", "approve_requisition"]),
+    ):
+        response = client.post("/users/roles", json={"name": name, "description": name}, headers=auth_headers)
+        assert response.status_code == 200
+        roles[name] = response.json()["id"]
+        response = client.put(f"/users/roles/{roles[name]}/permissions", json=permissions, headers=auth_headers)
+        assert response.status_code == 200
+    return roles
+
+@pytest.fixture
+def login_as(client, auth_headers, workflow_roles):
+    """Create a user with a workflow role and team and return their auth headers."""
+    def login(username: str, role: str, team_id: int | None):
+        user = {
+            "username": username, "password": "testpassword", "first_name": username, "last_name": "User",
+            "email": f"{username}@example.com", "role_id": workflow_roles[role], "team_id": team_id,
+        }
+        assert client.post("/users/", json=user, headers=auth_headers).status_code == 200
+        response = client.post("/auth/token", data={"username": username, "password": "testpassword"})
+        assert response.status_code == 200
+        return {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+    return login
+
+def _raise(client, headers, title, amount_cents=1000):
+    response = client.post("/requisitions/", json={"title": title, "amount_cents": amount_cents}, headers=headers)
+    assert response.status_code == 200
+    return response.json()
+
+def test_create_requisition(client, team_ids, login_as):
+    requester = login_as("alice", "requester", team_ids[0])
+    requisition = _raise(client, requester, "Printer paper", 2500)
+    assert requisition["status"] == "pending"
+    assert requisition["team_id"] == team_ids[0]
+    assert requisition["decided_by"] is None
+
+    response = client.get(f"/requisitions/{requisition['id']}", headers=requester)
+    assert response.status_code == 200
+    assert response.json()["title"] == "Printer paper"
+
+    response = client.get("/requisitions/mine", headers=requester)
+    assert [r["id"] for r in response.json()] == [requisition["id"]]
+
+def test_create_requisition_requires_team(client, login_as):
+    requester = login_as("alice", "requester", None)
+    response = client.post("/requisitions/", json={"title": "Desk", "amount_cents": 1}, headers=requester)
+    assert response.status_code == 400
+
+def test_requester_cannot_see_queue_or_approve(client, team_ids, login_as):
+    requester = login_as("alice", "requester", team_ids[0])
+    requisition = _raise(client, requester, "Chair")
+    assert client.get("/requisitions/queue", headers=requester).status_code == 403
+    response = client.post("/requisitions/approve", json={"ids": [requisition["id"]]}, headers=requester)
+    assert response.status_code == 403
+
+def test_queue_is_keyset_paginated_per_team(client, team_ids, login_as):
+    requester = login_as("alice", "requester", team_ids[0])
+    approver = login_as("bob", "approver", team_ids[0])
+    other_team = login_as("carol", "requester", team_ids[1])
+    raised = [_raise(client, requester, f"Item {i}")["id"] for i in range(5)]
+    _raise(client, other_team, "Elsewhere")
+
+    seen, params = [], {"limit": 2}
+    while True:
+        response = client.get("/requisitions/queue", params=params, headers=approver)
+        assert response.status_code == 200
+        seen.extend(r["id"] for r in response.json())
+        next_cursor = response.headers.get("X-Next-Cursor")
+        if next_cursor is None:
+            break
+        params = {"limit": 2, "after": next_cursor}
+    assert seen == raised
+
+def test_atomic_approval_rejects_whole_batch(client, team_ids, login_as):
+    requester = login_as("alice", "requester", team_ids[0])
+    approver = login_as("bob", "approver", team_ids[0])
+    other_team = login_as("carol", "requester", team_ids[1])
+    pending = _raise(client, requester, "Toner")["id"]
+    own = _raise(client, approver, "Own laptop")["id"]
+    foreign = _raise(client, other_team, "Elsewhere")["id"]
+
+    response = client.post("/requisitions/approve", json={"ids": [pending, own, foreign, 999999]}, headers=approver)
+    assert response.status_code == 400
+    errors = {error["id"]: error["error"] for error in response.json()["detail"]["errors"]}
+    assert set(errors) == {own, foreign, 999999}
+    assert errors[foreign] == errors[999999] == "Requisition not found"
+
+    # Nothing was decided, so the queue is unchanged
+    queue = client.get("/requisitions/queue", headers=approver).json()
+    assert {r["id"] for r in queue} == {pending, own}
+
+def test_batched_approval(client, team_ids, login_as, settings_env):
+    requester = login_as("alice", "requester", team_ids[0])
+    approver = login_as("bob", "approver", team_ids[0])
+    raised = [_raise(client, requester, f"Item {i}")["id"] for i in range(4)]
+
+    response = client.post("/requisitions/approve", json={"ids": raised[:3]}, headers=approver)
+    assert response.status_code == 200
+    assert response.json()["decided"] == raised[:3]
+
+    # Best effort decides what it can and reports the rest
+    response = client.post(
+        "/requisitions/approve", params={"atomic": False},
+        json={"ids": raised, "status": "rejected"}, headers=approver,
+    )
+    assert response.status_code == 200
+    body = response.json()
+    assert body["decided"] == [raised[3]]
+    assert [error["id"] for error in body["errors"]] == raised[:3]
+    assert body["errors"][0]["error"] == "Requisition is already approved"
+
+    assert client.get("/requisitions/queue", headers=approver).json() == []
+    approved = client.get("/requisitions/queue", params={"status": "approved"}, headers=approver).json()
+    assert [r["id"] for r in approved] == raised[:3]
+    assert all(r["decided_by"] is not None and r["decided_at"] is not None for r in approved)
+
+    settings_env(REQUISITION_DECISION_MAX_IDS=2)
+    response = client.post("/requisitions/approve", json={"ids": raised}, headers=approver)
+    assert response.status_code == 413
+
+def test_requisition_hidden_from_other_teams(client, team_ids, login_as):
+    requester = login_as("alice", "requester", team_ids[0])
+    outsider = login_as("carol", "approver", team_ids[1])
+    requisition = _raise(client, requester, "Monitor")
+    assert client.get(f"/requisitions/{requisition['id']}", headers=outsider).status_code == 404
+
+def test_queue_uses_status_team_index(engine):
+    # The approver queue must be a range scan of the composite index, with no sort step
+    query = (
+        "EXPLAIN QUERY PLAN SELECT * FROM requisitions WHERE status = 'PENDING' AND team_id = 1 "
+        "AND (created_at > '2026-01-01' OR (created_at = '2026-01-01' AND id > 5)) ORDER BY created_at, id LIMIT 20"
+    )
+    with engine.connect() as connection:
+        plan = " ".join(row[-1] for row in connection.execute(text(query)))
+    assert "ix_requisitions_status_team_id_created_at" in plan
+    assert "TEMP B-TREE" not in plan
+
+def test_token_without_user_id_is_refused(client, engine, team_ids, login_as, settings_env):
+    requester = login_as("alice", "requester", team_ids[0])
+    requisition = _raise(client, requester, "Orphaned")
+    # Deleting a requester leaves their requisitions with no requester
+    with engine.begin() as connection:
+        connection.execute(text("UPDATE requisitions SET requester_id = NULL"))
+
+    settings_env(TOKEN_MODE="claims")
+    response = client.post("/auth/token", data={"username": "alice", "password": "testpassword"})
+    token = response.json()["access_token"]
+    payload = jwt.get_unverified_claims(token)
+    del payload["uid"]
+    headers = {"Authorization": f"Bearer {create_access_token(payload)}"}
+
+    assert client.get(f"/requisitions/{requisition['id']}", headers=headers).status_code == 404
+    assert client.get("/requisitions/mine", headers=headers).status_code == 403
+    response = client.post("/requisitions/", json={"title": "Desk", "amount_cents": 1}, headers=headers)
+    assert response.status_code == 403
@@ -1,3 +1,12 @@
+import csv
+import io
+import json
+import time
+from datetime import datetime, timedelta
+import pytest
+from sqlalchemy import text
+from src.db_queries import users as user_queries
+
 def test_create_user(client, user_data, auth_headers):
     response = client.post("/users", json=user_data, headers=auth_headers)
     assert response.status_code == 200
@@ -619,3 +628,438 @@ def test_get_role_permissions_by_role_name(client, role_id, auth_headers):
     # Verify that each returned permission belongs to the role we queried
     for item in data:
         assert item["role_id"] == role_id
+
+def test_list_teams_keyset_pagination(client, auth_headers):
+    for i in range(5):
+        response = client.post("/users/teams/", json={"name": f"PagedTeam{i}", "description": f"Team {i}"}, headers=auth_headers)
+        assert response.status_code == 200
+
+    names = []
+    params = {"limit": 2}
+    while True:
+        response = client.get("/users/teams/", params=params, headers=auth_headers)
+        assert response.status_code == 200
+        page = response.json()
+        assert len(page) <= 2
+        names.extend(team["name"] for team in page)
+        next_cursor = response.headers.get("X-Next-Cursor")
+        if next_cursor is None:
+            break
+        assert 'rel="next"' in response.headers["Link"]
+        params = {"limit": 2, "after": next_cursor}
+
+    assert names == [f"PagedTeam{i}" for i in range(5)]
+
+def test_list_teams_unbounded_opt_in(client, auth_headers):
+    for i in range(3):
+        client.post("/users/teams/", json={"name": f"AllTeam{i}", "description": f"Team {i}"}, headers=auth_headers)
+
+    response = client.get("/users/teams/", params={"limit": 1, "all": "true"}, headers=auth_headers)
+    assert response.status_code == 200
+    assert len(response.json()) == 3
+    assert "X-Next-Cursor" not in response.headers
+
+def test_role_permissions_keyset_pagination(client, role_id, auth_headers):
+    for permission in ("manage_ticket", "update_ticket"):
+        client.post("/users/roles/permissions/", json={"role_id": role_id, "permission": permission}, headers=auth_headers)
+
+    seen = []
+    params = {"limit": 1}
+    while True:
+        response = client.get("/users/roles/permissions/", params=params, headers=auth_headers)
+        assert response.status_code == 200
+        seen.extend((item["role_id"], item["permission"]) for item in response.json())
+        if "X-Next-Cursor" not in response.headers:
+            break
+        params = {"limit": 1, "after": response.headers["X-Next-Cursor"]}
+
+    assert len(seen) == 3
+    assert len(set(seen)) == 3
+    assert (role_id, "manage_ticket") in seen
+
+def test_invalid_cursor(client, auth_headers):
+    response = client.get("/users/teams/", params={"after": "not-a-cursor"}, headers=auth_headers)
+    assert response.status_code == 400
+    assert response.json()["detail"] == "Invalid cursor"
+
+def test_get_users_prefix_is_case_insensitive(client, user_data, auth_headers):
+    user_data["username"] = "CaseUser"
+    response = client.post("/users", json=user_data, headers=auth_headers)
+    assert response.status_code == 200
+
+    response = client.get("/users/caseu", headers=auth_headers)
+    assert response.status_code == 200
+    assert [user["username"] for user in response.json()] == ["CaseUser"]
+
+def test_get_users_prefix_at_end_of_unicode(client, user_data, auth_headers):
+    user_data["username"] = "zoë"
+    assert client.post("/users", json=user_data, headers=auth_headers).status_code == 200
+    assert [user["username"] for user in client.get("/users/ZOË", headers=auth_headers).json()] == ["zoë"]
+
+    # No character sorts after U+10FFFF, so the range is open-ended
+    assert client.get("/users/z\U0010ffff", headers=auth_headers).status_code == 404
+    assert user_queries._prefix_upper_bound("\U0010ffff") is None
+    assert user_queries._prefix_upper_bound("a\U0010ffff") == "b"
+    assert user_queries._prefix_upper_bound("a\ud7ff") == "a\ue000"
+
+def test_search_users_full_text(client, user_data, auth_headers):
+    people = [("jdoe", "John", "Doe"), ("asmith", "Alice", "Smith"), ("jsmith", "Jane", "Smith")]
+    for username, first_name, last_name in people:
+        payload = dict(user_data, username=username, first_name=first_name, last_name=last_name, email=f"{username}@example.com")
+        response = client.post("/users", json=payload, headers=auth_headers)
+        assert response.status_code == 200
+
+    response = client.get("/users/-/search", params={"q": "smith"}, headers=auth_headers)
+    assert response.status_code == 200
+    assert sorted(user["username"] for user in response.json()) == ["asmith", "jsmith"]
+
+    response = client.get("/users/-/search", params={"q": "ali smi"}, headers=auth_headers)
+    assert [user["username"] for user in response.json()] == ["asmith"]
+
+    # Updates and deletes keep the index in sync
+    client.patch("/users/jdoe", json={"last_name": "Smithers"}, headers=auth_headers)
+    client.delete("/users/asmith", headers=auth_headers)
+    response = client.get("/users/-/search", params={"q": "smith"}, headers=auth_headers)
+    assert sorted(user["username"] for user in response.json()) == ["jdoe", "jsmith"]
+
+    response = client.get("/users/-/search", params={"q": "smith", "limit": 1}, headers=auth_headers)
+    assert len(response.json()) == 1
+    response = client.get("/users/-/search", params={"q": "smith", "limit": 1, "after": response.headers["X-Next-Cursor"]}, headers=auth_headers)
+    assert len(response.json()) == 1
+    assert "X-Next-Cursor" not in response.headers
+
+def test_user_named_search_is_reachable(client, user_data, auth_headers):
+    payload = dict(user_data, username="search", email="search@example.com")
+    assert client.post("/users", json=payload, headers=auth_headers).status_code == 200
+    response = client.get("/users/search", headers=auth_headers)
+    assert response.status_code == 200
+    assert [user["username"] for user in response.json()] == ["search"]
+
+def test_search_users_ignores_query_syntax(client, auth_headers):
+    response = client.get("/users/-/search", params={"q": '"-*'}, headers=auth_headers)
+    assert response.status_code == 200
+    assert response.json() == []
+
+@pytest.mark.parametrize("db_mode", ["sync", "async"])
+def test_export_users(client, user_data, auth_headers, db_mode):
+    team = client.post("/users/teams/", json={"name": "ExportTeam", "description": "Exported"}, headers=auth_headers).json()
+    for i in range(3):
+        payload = dict(user_data, username=f"export{i}", email=f"export{i}@example.com", team_id=team["id"] if i else None)
+        assert client.post("/users", json=payload, headers=auth_headers).status_code == 200
+
+    response = client.get("/users/export", params={"format": "ndjson"}, headers=auth_headers)
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+    rows = [json.loads(line) for line in response.text.splitlines()]
+    assert [row["username"] for row in rows] == ["admin", "export0", "export1", "export2"]
+    assert all("password" not in row for row in rows)
+
+    response = client.get("/users/export", params={"format": "csv", "team_id": team["id"]}, headers=auth_headers)
+    assert response.status_code == 200
+    rows = list(csv.DictReader(io.StringIO(response.text)))
+    assert [row["username"] for row in rows] == ["export1", "export2"]
+    assert "password" not in rows[0]
+
+def test_export_users_rejects_unknown_format(client, auth_headers):
+    response = client.get("/users/export", params={"format": "xml"}, headers=auth_headers)
+    assert response.status_code == 422
+
+def test_bulk_create_users_json(client, user_data, auth_headers):
+    users = [dict(user_data, username=f"bulk{i}", email=f"bulk{i}@example.com") for i in range(5)]
+    response = client.post("/users/bulk", json=users, headers=auth_headers)
+    assert response.status_code == 200
+    assert response.json() == {"created": 5, "errors": []}
+
+    response = client.get("/users/bulk", headers=auth_headers)
+    assert [user["username"] for user in response.json()] == [f"bulk{i}" for i in range(5)]
+
+    # Passwords were hashed, so the imported users can log in
+    response = client.post("/auth/token", data={"username": "bulk3", "password": user_data["password"]})
+    assert response.status_code == 200
+
+def test_bulk_create_users_atomic_rejects_everything(client, user_data, auth_headers, monkeypatch):
+    from src.passwords import password_hasher
+
+    async def fail(passwords):
+        raise AssertionError("a rejected import should hash no passwords")
+    monkeypatch.setattr(password_hasher, "hash_many", fail)
+    users = [
+        dict(user_data, username="good", email="good@example.com"),
+        dict(user_data, username="badteam", email="badteam@example.com", team_id=9999),
+        dict(user_data, username="good", email="again@example.com"),
+        {"username": "incomplete"},
+    ]
+    response = client.post("/users/bulk", json=users, headers=auth_headers)
+    assert response.status_code == 400
+    errors = response.json()["detail"]["errors"]
+    assert [error["row"] for error in errors] == [3]
+
+    users.pop()
+    response = client.post("/users/bulk", json=users, headers=auth_headers)
+    assert response.status_code == 400
+    errors = response.json()["detail"]["errors"]
+    assert [(error["row"], error["error"]) for error in errors] == [
+        (1, "Team with ID 9999 not found"),
+        (2, "Username good already exists"),
+    ]
+    assert client.get("/users/good", headers=auth_headers).status_code == 404
+
+def test_bulk_create_users_best_effort_csv(client, user_data, auth_headers, monkeypatch):
+    from src.passwords import password_hasher
+
+    client.post("/users", json=dict(user_data, username="existing", email="existing@example.com"), headers=auth_headers)
+    hashed = []
+    hash_many = password_hasher.hash_many
+    async def record(passwords):
+        hashed.extend(passwords)
+        return await hash_many(passwords)
+    monkeypatch.setattr(password_hasher, "hash_many", record)
+    lines = ["username,password,first_name,last_name,email,team_id,role_id"]
+    lines.append(f"csv1,pw,Csv,One,csv1@example.com,,{user_data['role_id']}")
+    lines.append(f"existing,pw,Csv,Two,csv2@example.com,,{user_data['role_id']}")
+    lines.append(f"csv3,pw,Csv,Three,csv3@example.com,,9999")
+    files = {"file": ("users.csv", "\n".join(lines), "text/csv")}
+    response = client.post("/users/bulk", params={"mode": "best_effort"}, files=files, headers=auth_headers)
+    assert response.status_code == 200
+    data = response.json()
+    assert data["created"] == 1
+    assert [(error["row"], error["username"]) for error in data["errors"]] == [(1, "existing"), (2, "csv3")]
+    # Rejected rows are never hashed
+    assert len(hashed) == 1
+    assert client.get("/users/csv1", headers=auth_headers).status_code == 200
+
+def test_replace_role_permissions(client, role_id, auth_headers):
+    client.post("/users/roles/permissions/", json={"role_id": role_id, "permission": "manage_ticket"}, headers=auth_headers)
+
+    response = client.put(f"/users/roles/{role_id}/permissions", json=["update_ticket", "manage_user"], headers=auth_headers)
+    assert response.status_code == 200
+    assert response.json() == [
+        {"role_id": role_id, "permission": "manage_user"},
+        {"role_id": role_id, "permission": "update_ticket"},
+    ]
+
+    response = client.get("/users/roles/permissions/", headers=auth_headers)
+    stored = sorted(item["permission"] for item in response.json() if item["role_id"] == role_id)
+    assert stored == ["manage_user", "update_ticket"]
+
+    response = client.put(f"/users/roles/{role_id}/permissions", json=[], headers=auth_headers)
+    assert response.status_code == 200
+    assert response.json() == []
+
+def test_replace_role_permissions_invalidates_cache_once(client, role_id, auth_headers, monkeypatch):
+    invalidated = []
+    monkeypatch.setattr(user_queries, "invalidate_role", invalidated.append)
+    client.put(f"/users/roles/{role_id}/permissions", json=["manage_ticket", "update_ticket"], headers=auth_headers)
+    assert invalidated == [role_id]
+
+    # Re-sending the same set changes nothing and invalidates nothing
+    client.put(f"/users/roles/{role_id}/permissions", json=["update_ticket", "manage_ticket"], headers=auth_headers)
+    assert invalidated == [role_id]
+
+def test_replace_permissions_for_missing_role(client, auth_headers):
+    response = client.put("/users/roles/9999/permissions", json=["manage_ticket"], headers=auth_headers)
+    assert response.status_code == 404
+
+def test_replace_permissions_conflicts_with_concurrent_insert(engine, client, role_id, auth_headers):
+    from sqlalchemy.exc import IntegrityError
+    from sqlmodel import Session
+    from src.models import UserAction
+
+    class Result(list):
+        def all(self):
+            return self
+
+    class StaleSession(Session):
+        # The permission read misses a row another request inserts just after it
+        def exec(self, statement, *args, **kwargs):
+            if "rolepermissions" in str(statement):
+                return Result()
+            return super().exec(statement, *args, **kwargs)
+
+    assert client.post("/users/roles/permissions/", json={"role_id": role_id, "permission": "manage_ticket"}, headers=auth_headers).status_code == 200
+    with StaleSession(engine) as session:
+        with pytest.raises(IntegrityError):
+            user_queries.replace_role_permissions_in_db(session, role_id, {UserAction.MANAGE_TICKET})
+
+def test_replace_permissions_conflict_is_409(client, role_id, auth_headers, monkeypatch):
+    from sqlalchemy.exc import IntegrityError
+
+    def conflict(*args):
+        raise IntegrityError("INSERT INTO rolepermissions", {}, Exception("UNIQUE constraint failed"))
+    monkeypatch.setattr("src.routers.users.replace_role_permissions_in_db", conflict)
+    response = client.put(f"/users/roles/{role_id}/permissions", json=["manage_ticket"], headers=auth_headers)
+    assert response.status_code == 409
+
+def test_replace_permissions_rejects_unknown_action(client, role_id, auth_headers):
+    response = client.put(f"/users/roles/{role_id}/permissions", json=["fly"], headers=auth_headers)
+    assert response.status_code == 422
+
+def test_write_paths_issue_a_single_statement(engine, count_statements, user_data, client, auth_headers):
+    from sqlmodel import Session
+    from src.models import RolePermissionCreate, TeamUpdate, UserAction
+
+    assert client.post("/users/", json=user_data, headers=auth_headers).status_code == 200
+    assert client.post("/users/teams/", json={"name": "ops", "description": "Ops"}, headers=auth_headers).status_code == 200
+
+    with Session(engine, expire_on_commit=False) as session, count_statements() as statements:
+        user = user_queries.update_user_in_db(session, user_data["username"], {"first_name": "Renamed"})
+        assert user.first_name == "Renamed"
+        assert len(statements) == 1
+
+        statements.clear()
+        team = user_queries.update_team_in_db(session, TeamUpdate(name="ops", description="Operations"))
+        assert team.description == "Operations"
+        assert len(statements) == 1
+
+        statements.clear()
+        permission = RolePermissionCreate(role_id=user_data["role_id"], permission=UserAction.MANAGE_TICKET)
+        user_queries.create_role_permission_in_db(session, permission)
+        assert len(statements) == 1
+        with pytest.raises(ValueError, match="already exists"):
+            user_queries.create_role_permission_in_db(session, permission)
+        assert len(statements) == 2
+
+        statements.clear()
+        user_queries.delete_role_permission_from_db(session, user_data["role_id"], UserAction.MANAGE_TICKET)
+        assert user_queries.delete_user_from_db(session, user_data["username"]).username == user_data["username"]
+        assert len(statements) == 2
+
+def test_update_team_without_changes(client, auth_headers):
+    assert client.post("/users/teams/", json={"name": "ops", "description": "Ops"}, headers=auth_headers).status_code == 200
+
+    response = client.patch("/users/teams/ops", json={"name": "ops", "description": "Ops"}, headers=auth_headers)
+    assert response.status_code == 400
+    assert response.json()["detail"] == "No changes detected in team description"
+
+    response = client.patch("/users/teams/missing", json={"name": "missing", "description": "Ops"}, headers=auth_headers)
+    assert response.status_code == 404
+
+def test_role_permission_for_missing_role(client, auth_headers):
+    response = client.post("/users/roles/permissions/", json={"role_id": 9999, "permission": "manage_ticket"}, headers=auth_headers)
+    assert response.status_code == 400
+    assert response.json()["detail"] == "Role with ID 9999 not found"
+
+def test_list_etag_and_conditional_get(client, auth_headers):
+    assert client.post("/users/teams/", json={"name": "ops", "description": "Ops"}, headers=auth_headers).status_code == 200
+
+    response = client.get("/users/teams/", headers=auth_headers)
+    assert response.status_code == 200
+    etag = response.headers["ETag"]
+    assert etag.startswith('"')
+
+    response = client.get("/users/teams/", headers={**auth_headers, "If-None-Match": etag})
+    assert response.status_code == 304
+    assert response.headers["ETag"] == etag
+    assert response.content == b""
+
+    # Tags follow the body: with one team the first page is the whole list
+    assert client.get("/users/teams/?limit=1", headers=auth_headers).headers["ETag"] == etag
+
+    # A write to the table invalidates the tag
+    assert client.patch("/users/teams/ops", json={"name": "ops", "description": "Operations"}, headers=auth_headers).status_code == 200
+    response = client.get("/users/teams/", headers={**auth_headers, "If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.headers["ETag"] != etag
+    assert response.json()[0]["description"] == "Operations"
+
+    # Other tables keep their tags
+    roles_etag = client.get("/users/roles/all", headers=auth_headers).headers["ETag"]
+    assert client.get("/users/roles/all", headers={**auth_headers, "If-None-Match": roles_etag}).status_code == 304
+    permissions_etag = client.get("/users/roles/permissions/", headers=auth_headers).headers["ETag"]
+    assert client.get("/users/roles/permissions/", headers={**auth_headers, "If-None-Match": f"W/{permissions_etag}"}).status_code == 304
+
+def test_etag_follows_writes_made_outside_the_app(client, auth_headers, engine):
+    from src.cache import response_cache
+
+    assert client.post("/users/teams/", json={"name": "ops", "description": "Ops"}, headers=auth_headers).status_code == 200
+    etag = client.get("/users/teams/", headers=auth_headers).headers["ETag"]
+
+    # A script or another worker writes; this process's cache entry then expires
+    with engine.begin() as connection:
+        connection.execute(text("UPDATE teams SET description = 'Operations' WHERE name = 'ops'"))
+    response_cache.clear()
+
+    response = client.get("/users/teams/", headers={**auth_headers, "If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.headers["ETag"] != etag
+    assert response.json()[0]["description"] == "Operations"
+
+    # Uncached listings are tagged by their body as well
+    response = client.get("/users/roles/permissions/by-name/user_admin", headers=auth_headers)
+    assert client.get(
+        "/users/roles/permissions/by-name/user_admin", headers={**auth_headers, "If-None-Match": response.headers["ETag"]}
+    ).status_code == 304
+
+def test_user_lookup_last_modified(client, auth_headers, user_data):
+    assert client.post("/users/", json=user_data, headers=auth_headers).status_code == 200
+
+    response = client.get(f"/users/{user_data['username']}", headers=auth_headers)
+    assert response.status_code == 200
+    last_modified = response.headers["Last-Modified"]
+
+    # Once its second is over, the date validates
+    time.sleep(1)
+    response = client.get(f"/users/{user_data['username']}", headers={**auth_headers, "If-Modified-Since": last_modified})
+    assert response.status_code == 304
+    assert response.headers["Last-Modified"] == last_modified
+
+    response = client.get(f"/users/{user_data['username']}", headers={**auth_headers, "If-Modified-Since": "Thu, 01 Jan 1970 00:00:00 GMT"})
+    assert response.status_code == 200
+
+def test_last_modified_in_current_second_is_not_validated(client, auth_headers, user_data, engine):
+    assert client.post("/users/", json=user_data, headers=auth_headers).status_code == 200
+    # The row's timestamp is persisted and is never earlier than the current second here
+    with engine.begin() as connection:
+        connection.execute(text("UPDATE users SET updated_at = :at"), {"at": (datetime.now() + timedelta(hours=1)).isoformat(sep=" ")})
+
+    last_modified = client.get(f"/users/{user_data['username']}", headers=auth_headers).headers["Last-Modified"]
+    response = client.get(f"/users/{user_data['username']}", headers={**auth_headers, "If-Modified-Since": last_modified})
+    assert response.status_code == 200
+
+def test_reference_lists_served_from_response_cache(client, auth_headers, monkeypatch):
+    from src.cache import response_cache
+
+    assert client.post("/users/teams/", json={"name": "ops", "description": "Ops"}, headers=auth_headers).status_code == 200
+    first = client.get("/users/teams/", headers=auth_headers)
+    assert first.status_code == 200
+
+    def fail(*args, **kwargs):
+        raise AssertionError("cached listing should not query the database")
+    monkeypatch.setattr("src.routers.users.get_team_list_from_db", fail)
+    hits = response_cache.hits
+    second = client.get("/users/teams/", headers=auth_headers)
+    assert second.status_code == 200
+    assert second.json() == first.json()
+    assert second.headers["ETag"] == first.headers["ETag"]
+    assert response_cache.hits == hits + 1
+    monkeypatch.undo()
+
+    # Cached pages keep their cursor headers
+    assert client.post("/users/teams/", json={"name": "dev", "description": "Dev"}, headers=auth_headers).status_code == 200
+    page = client.get("/users/teams/?limit=1", headers=auth_headers)
+    cached_page = client.get("/users/teams/?limit=1", headers=auth_headers)
+    assert cached_page.headers["X-Next-Cursor"] == page.headers["X-Next-Cursor"]
+    assert [team["name"] for team in client.get("/users/teams/", headers=auth_headers).json()] == ["ops", "dev"]
+
+    stats = client.get("/admin/stats", headers=auth_headers).json()["response_cache"]
+    assert stats["size"] >= 1
+    assert stats["invalidations"] >= 1
+
+def test_response_cache_byte_cap():
+    from src.cache import ResponseCache
+
+    cache = ResponseCache(max_bytes=10, ttl=60)
+    cache.set("a", b"12345", {}, ("teams",))
+    cache.set("b", b"12345", {}, ("roles",))
+    assert cache.get("a") == (b"12345", {})
+    cache.set("c", b"123", {}, ("roles",))
+    # "b" was least recently used
+    assert cache.get("b") is None
+    assert cache.stats()["bytes"] == 8
+    cache.set("huge", b"x" * 11, {}, ("teams",))
+    assert cache.get("huge") is None
+
+    cache.invalidate_tables("roles")
+    assert cache.get("c") is None
+    assert cache.get("a") is not None
+    assert cache.stats()["bytes"] == 5